@@ -0,0 +1,109 @@
+"""Compare the element encoding the element store embeds and prompts with:
+`prettify()` of each cleaned element (before) against the one-line
+`encode_element` (after), on fixture pages. No browser needed.
+
+Reports elements kept, total and largest element in tokens, and time to
+clean and encode each page.
+
+Usage: python benchmarks/element_encoding.py [--runs 20]
+"""
+import argparse
+import statistics
+import time
+
+import tiktoken
+
+from browserpilot.agents.element_store import (
+    BP_ID_ATTRIBUTE,
+    clean_html,
+    get_elements_for_llm,
+)
+
+CLASSES = "flex items-center justify-between px-4 py-2 text-sm font-medium hover:bg-gray-100"
+
+
+def navigation_page():
+    links = "".join(
+        f'<li class="{CLASSES}"><a class="{CLASSES}" href="/products/category/{i}'
+        f'?utm_source=nav&amp;utm_medium=web&amp;ref=header-{i}" target="_blank" '
+        f'rel="noopener" data-track="nav-{i}">Category {i}</a></li>'
+        for i in range(200)
+    )
+    return f'<html><body><nav class="{CLASSES}"><ul class="{CLASSES}">{links}</ul></nav></body></html>'
+
+
+def form_page():
+    fields = "".join(
+        f'<div class="form-group row mb-3"><label for="field-{i}" class="col-sm-2 col-form-label">'
+        f'Field {i}</label><div class="col-sm-10"><input id="field-{i}" name="field_{i}" '
+        f'type="text" class="form-control form-control-lg" placeholder="Enter field {i}" '
+        f'autocomplete="off" tabindex="{i}"></div></div>'
+        for i in range(50)
+    )
+    return (
+        f'<html><body><form action="/submit" method="post" class="needs-validation">{fields}'
+        '<button type="submit" class="btn btn-primary btn-lg">Save</button></form></body></html>'
+    )
+
+
+def article_page():
+    paragraphs = "".join(
+        f'<p class="article-body__paragraph">Paragraph {i}. ' + "Lorem ipsum dolor sit amet. " * 20 + "</p>"
+        for i in range(40)
+    )
+    return (
+        '<html><body><article class="article"><h1 class="article__title">Title</h1>'
+        f"{paragraphs}</article></body></html>"
+    )
+
+
+PAGES = {"navigation": navigation_page, "form": form_page, "article": article_page}
+
+
+def prettify_elements(html):
+    """The encoding before: every cleaned element, emptied, prettified."""
+    soup = clean_html(html, keep_bp_id=True)
+    elements = soup.find_all()
+    [ele.clear() for ele in elements if ele.contents]
+    texts = []
+    for ele in elements:
+        ele.attrs.pop(BP_ID_ATTRIBUTE, None)
+        if ele.attrs:
+            texts.append(ele.prettify())
+    return texts
+
+
+def compact_elements(html):
+    soup = clean_html(html, keep_bp_id=True)
+    return [text for _, text in get_elements_for_llm(soup) if text is not None]
+
+
+def measure(encode, html, runs, encoding):
+    seconds = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        texts = encode(html)
+        seconds.append(time.perf_counter() - start)
+    tokens = [len(encoding.encode(text)) for text in texts]
+    return len(texts), sum(tokens), max(tokens, default=0), 1000 * statistics.median(seconds)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--runs", type=int, default=20)
+    args = parser.parse_args()
+    encoding = tiktoken.get_encoding("cl100k_base")
+
+    print(
+        f"{'page':<12}{'encoding':<10}{'elements':>10}{'tokens':>10}"
+        f"{'largest':>9}{'ms':>8}"
+    )
+    for name, page in PAGES.items():
+        html = page()
+        for label, encode in [("prettify", prettify_elements), ("compact", compact_elements)]:
+            elements, tokens, largest, ms = measure(encode, html, args.runs, encoding)
+            print(f"{name:<12}{label:<10}{elements:>10}{tokens:>10}{largest:>9}{ms:>8.1f}")
+
+
+if __name__ == "__main__":
+    main()
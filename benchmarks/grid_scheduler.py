@@ -0,0 +1,101 @@
+"""Run jobs through GridScheduler, with local chromedriver processes standing
+in for grid nodes.
+
+Starts `--nodes` chromedriver processes, serves a local fixture page, and
+submits `--jobs` precompiled jobs (so no LLM calls are made). Kills one node
+halfway through with `--kill-one`, to exercise health checks and requeueing.
+Prints per-node throughput and queue latency.
+
+Usage: python benchmarks/grid_scheduler.py ./chromedriver [--nodes 3] [--jobs 12]
+"""
+import argparse
+import json
+import socket
+import subprocess
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from browserpilot.agents.grid_scheduler import GridScheduler, check_health
+
+
+class Handler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        body = b"<html><body><h1>Fixture</h1><a href='/'>Again</a></body></html>"
+        self.send_response(200)
+        self.send_header("Content-Type", "text/html")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_node(chromedriver_path):
+    port = free_port()
+    process = subprocess.Popen(
+        [chromedriver_path, f"--port={port}"],
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    url = f"http://127.0.0.1:{port}"
+    for _ in range(50):
+        if check_health(url):
+            break
+        time.sleep(0.1)
+    return process, url
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("chromedriver_path")
+    parser.add_argument("--nodes", type=int, default=3)
+    parser.add_argument("--capacity", type=int, default=2)
+    parser.add_argument("--jobs", type=int, default=12)
+    parser.add_argument("--kill-one", action="store_true")
+    args = parser.parse_args()
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    page = f"http://127.0.0.1:{server.server_port}/"
+    instructions = {
+        "instructions": [f"Go to {page}", "Click the link"],
+        "compiled": [
+            f"env.get('{page}')",
+            "env.click(env.find_element(by='tag name', value='a'))",
+        ],
+    }
+
+    nodes = [start_node(args.chromedriver_path) for _ in range(args.nodes)]
+    scheduler = GridScheduler(
+        [{"url": url, "capacity": args.capacity} for _, url in nodes],
+        health_interval=1,
+        headless=True,
+    )
+    start = time.time()
+    for _ in range(args.jobs):
+        scheduler.submit(instructions)
+    scheduler.start()
+    if args.kill_one:
+        time.sleep(3)
+        nodes[0][0].kill()
+    scheduler.shutdown()
+    seconds = time.time() - start
+
+    for process, _ in nodes:
+        process.kill()
+    server.shutdown()
+    failed = sum(job.status == "failed" for job in scheduler.jobs)
+    print(f"{args.jobs} jobs ({failed} failed) in {seconds:.1f}s")
+    print(json.dumps(scheduler.stats(), indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+"""Check that importing the agent stays fast, using `python -X importtime`.
+
+Fails (exit code 1) if importing `--module` in a fresh interpreter takes
+longer than `--budget-ms`, or if it pulls in any of the heavy dependencies
+that should only be loaded on first use (llama_index, langchain, the OpenAI
+SDK, BeautifulSoup, NumPy). Prints the slowest imports either way.
+`tests/test_import_time.py` checks the same with a looser budget.
+
+Usage: python benchmarks/import_time.py [--budget-ms 800] [--runs 3]
+"""
+import argparse
+import subprocess
+import sys
+
+# Only imported when Memory, retrieve_information, ask_llm_to_find_element or
+# get_completion are first used.
+DEFERRED_MODULES = [
+    "llama_index",
+    "langchain",
+    "langchain_core",
+    "langchain_openai",
+    "openai",
+    "bs4",
+    "numpy",
+]
+
+
+def import_times(module):
+    """Returns {module: (self_us, cumulative_us)} for one cold import."""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True,
+        text=True,
+    )
+    if result.returncode != 0:
+        sys.exit(result.stderr)
+    times = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "[us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:") :].split("|")
+        times[name.strip()] = (int(self_us), int(cumulative_us))
+    return times
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--module", default="browserpilot.agents.gpt_selenium_agent")
+    parser.add_argument("--budget-ms", type=float, default=800)
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--top", type=int, default=15)
+    args = parser.parse_args()
+
+    # The best of a few runs, to be robust to a noisy machine.
+    runs = [import_times(args.module) for _ in range(args.runs)]
+    times = min(runs, key=lambda run: run[args.module][1])
+    total_ms = times[args.module][1] / 1000
+
+    print(f"Slowest imports of {args.module}:")
+    slowest = sorted(times.items(), key=lambda item: -item[1][1])
+    for name, (_, cumulative_us) in slowest[: args.top]:
+        print(f"{cumulative_us / 1000:>10.1f} ms  {name}")
+
+    failures = []
+    if total_ms > args.budget_ms:
+        failures.append(f"Import took {total_ms:.1f} ms, over the {args.budget_ms} ms budget.")
+    eager = sorted(
+        name
+        for name in times
+        if name.split(".")[0] in DEFERRED_MODULES and "." not in name
+    )
+    if eager:
+        failures.append(f"Imported eagerly: {', '.join(eager)}.")
+
+    print(f"\nTotal: {total_ms:.1f} ms (budget {args.budget_ms} ms)")
+    for failure in failures:
+        print(f"FAIL: {failure}")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,121 @@
+"""Compare page-load time and bytes loaded across load profiles.
+
+Serves a local fixture page with images, fonts, a video and "tracker"
+scripts (each with some artificial latency), then loads it with every load
+profile in a headless Chrome.
+
+Usage: python benchmarks/load_profiles.py ./chromedriver [--runs 5]
+"""
+import argparse
+import statistics
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from selenium import webdriver
+from selenium.webdriver.chrome.service import Service
+
+from browserpilot.agents.load_profiles import (
+    LOAD_PROFILES,
+    NetworkController,
+    configure_chrome_options,
+)
+
+LATENCY = 0.05  # Seconds per subresource.
+PAYLOAD = b"\0" * 200_000
+
+
+def fixture_page():
+    images = "".join(f'<img src="/img/{i}.png">' for i in range(20))
+    return f"""<html><head>
+<link rel="stylesheet" href="/style.css">
+<script src="/www.google-analytics.com/analytics.js"></script>
+<script src="/connect.facebook.net/sdk.js"></script>
+</head><body>
+<h1>Fixture</h1><p>Some text the agent actually needs.</p>
+{images}
+<video src="/clip.mp4" autoplay muted></video>
+</body></html>""".encode()
+
+
+class Handler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path == "/":
+            body, content_type = fixture_page(), "text/html"
+        elif self.path == "/style.css":
+            body = b"@font-face{font-family:f;src:url(/font.woff2)} body{font-family:f}"
+            content_type = "text/css"
+        else:
+            time.sleep(LATENCY)
+            body, content_type = PAYLOAD, "application/octet-stream"
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("Cache-Control", "no-store")
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def benchmark(chromedriver_path, url, load_profile, runs):
+    options = webdriver.ChromeOptions()
+    options.add_argument("--headless")
+    configure_chrome_options(options, load_profile)
+    driver = webdriver.Chrome(service=Service(chromedriver_path), options=options)
+    network = NetworkController(driver, load_profile)
+    network.track = True
+    driver.execute_cdp_cmd("Network.enable", {})
+    driver.execute_cdp_cmd("Network.setCacheDisabled", {"cacheDisabled": True})
+    try:
+        timings = []
+        network.collect()
+        for _ in range(runs):
+            driver.get("about:blank")
+            start = time.perf_counter()
+            driver.get(url)
+            timings.append(time.perf_counter() - start)
+        stats = network.collect()
+    except Exception:
+        driver.quit()
+        raise
+    driver.quit()
+    return {
+        "seconds": statistics.mean(timings),
+        "requests": stats["requests"] / runs,
+        "blocked_requests": stats["blocked_requests"] / runs,
+        "bytes_loaded": stats["bytes_loaded"] / runs,
+        "bytes_saved": stats["bytes_saved"] / runs,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("chromedriver_path")
+    parser.add_argument("--runs", type=int, default=5)
+    args = parser.parse_args()
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_port}/"
+
+    results = {
+        profile: benchmark(args.chromedriver_path, url, profile, args.runs)
+        for profile in LOAD_PROFILES
+    }
+    server.shutdown()
+
+    baseline = results["default"]
+    print(f"{'profile':<18}{'load (s)':>10}{'requests':>10}{'blocked':>10}{'KB loaded':>12}{'KB saved':>10}{'est. KB saved':>15}")
+    for profile, result in results.items():
+        saved = (baseline["bytes_loaded"] - result["bytes_loaded"]) / 1000
+        print(
+            f"{profile:<18}{result['seconds']:>10.3f}{result['requests']:>10.1f}"
+            f"{result['blocked_requests']:>10.1f}{result['bytes_loaded'] / 1000:>12.1f}"
+            f"{saved:>10.1f}{result['bytes_saved'] / 1000:>15.1f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+"""Compare top-k retrieval over Memory's embedding matrix with llama_index's
+default similarity search.
+
+Uses random embeddings, so no API calls are made. The llama_index column is
+the function `SimpleVectorStore` uses for every query.
+
+Usage: python benchmarks/memory_topk.py [--chunks 10000 100000] [--dim 1536]
+"""
+import argparse
+import statistics
+import tempfile
+import time
+
+import numpy as np
+from llama_index.core.indices.query.embedding_utils import get_top_k_embeddings
+
+from browserpilot.agents.memories.vector_search import VectorSearch
+
+
+def timeit(fn, runs):
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - start)
+    return statistics.median(timings)
+
+
+def benchmark(chunks, dim, top_k, runs):
+    rng = np.random.default_rng(0)
+    embeddings = rng.standard_normal((chunks, dim), dtype=np.float32)
+    node_ids = [str(i) for i in range(chunks)]
+    query = rng.standard_normal(dim, dtype=np.float32)
+
+    search = VectorSearch()
+    search.add(node_ids, embeddings)
+    with tempfile.TemporaryDirectory() as folder:
+        search.save(folder)
+        mapped = VectorSearch.load(folder, mmap=True)
+        matrix = timeit(lambda: search.top_k(query, top_k), runs)
+        mmap = timeit(lambda: mapped.top_k(query, top_k), runs)
+
+    embedding_list = embeddings.tolist()
+    query_list = query.tolist()
+    baseline = timeit(
+        lambda: get_top_k_embeddings(
+            query_list,
+            embedding_list,
+            similarity_top_k=top_k,
+            embedding_ids=node_ids,
+        ),
+        max(1, runs // 10),
+    )
+    return {"llama_index": baseline, "matrix": matrix, "mmap": mmap}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--chunks", type=int, nargs="+", default=[10_000, 100_000])
+    parser.add_argument("--dim", type=int, default=1536)
+    parser.add_argument("--top-k", type=int, default=3)
+    parser.add_argument("--runs", type=int, default=20)
+    args = parser.parse_args()
+
+    print(f"{'chunks':>8}{'llama_index (ms)':>18}{'matrix (ms)':>13}{'mmap (ms)':>11}{'speedup':>9}")
+    for chunks in args.chunks:
+        result = benchmark(chunks, args.dim, args.top_k, args.runs)
+        print(
+            f"{chunks:>8}{result['llama_index'] * 1000:>18.1f}"
+            f"{result['matrix'] * 1000:>13.2f}{result['mmap'] * 1000:>11.2f}"
+            f"{result['llama_index'] / result['matrix']:>8.0f}x"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,151 @@
+"""Compare the HTML and accessibility-tree page representations used for
+element lookup: tokens embedded per page, tokens prompted per lookup, and
+sync and lookup latency.
+
+Serves a local fixture page (navigation with utility classes, long URLs, a
+form, a table and an iframe), then syncs each store against it in a
+headless Chrome. Embeddings are mocked unless `--real-embeddings` is given
+(which needs OPENAI_API_KEY), so that only the representation is measured.
+
+Usage: python benchmarks/page_representations.py ./chromedriver [--runs 5]
+"""
+import argparse
+import statistics
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import tiktoken
+from llama_index.core import Settings
+from llama_index.core.embeddings import MockEmbedding
+from selenium import webdriver
+from selenium.webdriver.chrome.service import Service
+
+from browserpilot.agents.accessibility import AccessibilityStore
+from browserpilot.agents.element_store import ElementStore
+
+CANDIDATES_PER_LOOKUP = 5
+DESCRIPTIONS = [
+    "the search box",
+    "the sign in link",
+    "the newsletter email field",
+    "the subscribe button",
+    "the price of the second plan",
+]
+STORES = {"html": ElementStore, "accessibility": AccessibilityStore}
+
+
+def fixture_page():
+    classes = "flex items-center justify-between px-4 py-2 text-sm font-medium hover:bg-gray-100"
+    nav = "".join(
+        f'<li class="{classes}"><a class="{classes}" href="/products/category/{i}'
+        f'?utm_source=nav&amp;utm_medium=web&amp;ref=header-{i}" data-track="nav-{i}">'
+        f"Category {i}</a></li>"
+        for i in range(30)
+    )
+    rows = "".join(
+        f'<tr class="{classes}"><td class="{classes}">Plan {i}</td>'
+        f'<td class="{classes}">${10 * i}/mo</td></tr>'
+        for i in range(1, 6)
+    )
+    return f"""<html><head><title>Fixture</title></head><body>
+<header class="{classes}"><nav aria-label="Main"><ul class="{classes}">{nav}</ul></nav>
+<form role="search" class="{classes}"><input type="search" aria-label="Search" class="{classes}" placeholder="Search"></form>
+<a href="/login?next=%2Faccount%2Fsettings&amp;source=header" class="{classes}">Sign in</a></header>
+<main class="{classes}"><h1 class="{classes}">Pricing</h1>
+<table class="{classes}">{rows}</table>
+<div class="{classes}"><div class="{classes}"><div class="{classes}"><p class="{classes}">Lorem ipsum dolor sit amet.</p></div></div></div>
+</main>
+<iframe src="/newsletter" title="Newsletter"></iframe>
+</body></html>""".encode()
+
+
+def newsletter_page():
+    return b"""<html><body><form>
+<label for="email">Email</label><input id="email" type="email" class="form-control input-lg" required>
+<button type="submit" class="btn btn-primary btn-lg">Subscribe</button>
+</form></body></html>"""
+
+
+class Handler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        body = newsletter_page() if self.path == "/newsletter" else fixture_page()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/html")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def benchmark(driver, url, store_class, runs, encoding):
+    sync_seconds, lookup_seconds = [], []
+    for _ in range(runs):
+        driver.get(url)
+        store = store_class()
+        start = time.perf_counter()
+        store.sync(driver)
+        sync_seconds.append(time.perf_counter() - start)
+        for description in DESCRIPTIONS:
+            start = time.perf_counter()
+            node_ids = store.retrieve(description, similarity_top_k=CANDIDATES_PER_LOOKUP)
+            lookup_seconds.append(time.perf_counter() - start)
+
+    texts = [text for entries in store.entries.values() for text in entries.values()]
+    prompted = []
+    for description in DESCRIPTIONS:
+        node_ids = store.retrieve(description, similarity_top_k=CANDIDATES_PER_LOOKUP)
+        candidates = "\n".join(store.get(node_id)[0] for node_id in node_ids)
+        prompted.append(len(encoding.encode(candidates)))
+    return {
+        "elements": len(texts),
+        "embedded_tokens": sum(len(encoding.encode(text)) for text in texts),
+        "prompted_tokens": statistics.mean(prompted),
+        "sync_ms": 1000 * statistics.median(sync_seconds),
+        "lookup_ms": 1000 * statistics.median(lookup_seconds),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("chromedriver_path")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--real-embeddings", action="store_true")
+    args = parser.parse_args()
+
+    if not args.real_embeddings:
+        Settings.embed_model = MockEmbedding(embed_dim=256)
+    encoding = tiktoken.get_encoding("cl100k_base")
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_port}/"
+
+    options = webdriver.ChromeOptions()
+    options.add_argument("--headless")
+    driver = webdriver.Chrome(service=Service(args.chromedriver_path), options=options)
+    try:
+        results = {
+            name: benchmark(driver, url, store_class, args.runs, encoding)
+            for name, store_class in STORES.items()
+        }
+    finally:
+        driver.quit()
+        server.shutdown()
+
+    print(
+        f"{'representation':<16}{'elements':>10}{'embedded tok':>14}"
+        f"{'prompted tok':>14}{'sync (ms)':>11}{'lookup (ms)':>13}"
+    )
+    for name, result in results.items():
+        print(
+            f"{name:<16}{result['elements']:>10}{result['embedded_tokens']:>14}"
+            f"{result['prompted_tokens']:>14.0f}{result['sync_ms']:>11.1f}"
+            f"{result['lookup_ms']:>13.1f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
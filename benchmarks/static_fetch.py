@@ -0,0 +1,135 @@
+"""Compare reading server-rendered pages through the browser against the
+static HTTP fast path (`static_fetch=True`).
+
+Serves fixture pages locally: articles rendered on the server, plus one
+single-page app that the fast path has to hand to the browser. For each
+mode, runs `env.get(url)` and `env.get_text_from_page()` on every page and
+reports the latency per page and the CPU time used, by this process and (if
+psutil is installed) by chromedriver and Chrome.
+
+Usage: python benchmarks/static_fetch.py ./chromedriver [--pages 20]
+"""
+import argparse
+import statistics
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from browserpilot.agents import GPTSeleniumAgent
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+SPA_PATH = "/app"
+
+
+def article_page(number):
+    paragraphs = "".join(
+        f"<p>Paragraph {i} of article {number}. " + "Lorem ipsum dolor sit amet. " * 15 + "</p>"
+        for i in range(12)
+    )
+    links = "".join(f'<li><a href="/article/{i}">Article {i}</a></li>' for i in range(20))
+    return (
+        f"<html><head><title>Article {number}</title>"
+        '<link rel="stylesheet" href="/style.css"><script src="/analytics.js"></script></head>'
+        f"<body><nav><ul>{links}</ul></nav><article><h1>Article {number}</h1>{paragraphs}</article>"
+        "</body></html>"
+    ).encode()
+
+
+def app_page():
+    return (
+        '<html><body><div id="root"></div><script>'
+        "document.getElementById('root').innerText = 'Rendered by JavaScript.';"
+        "</script></body></html>"
+    ).encode()
+
+
+class Handler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path == SPA_PATH:
+            body, content_type = app_page(), "text/html"
+        elif self.path.startswith("/article/"):
+            body, content_type = article_page(self.path.rsplit("/", 1)[1]), "text/html"
+        elif self.path.endswith(".js"):
+            body, content_type = b"window.analytics = true;", "application/javascript"
+        else:
+            body, content_type = b"body { font-family: sans-serif; }", "text/css"
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def browser_cpu_seconds(agent):
+    """CPU time of chromedriver and everything it started, e.g. Chrome."""
+    if psutil is None:
+        return 0.0
+    root = psutil.Process(agent.driver.service.process.pid)
+    total = 0.0
+    for process in [root] + root.children(recursive=True):
+        try:
+            times = process.cpu_times()
+            total += times.user + times.system
+        except psutil.NoSuchProcess:
+            pass
+    return total
+
+
+def benchmark(chromedriver_path, urls, static_fetch):
+    agent = GPTSeleniumAgent(
+        chromedriver_path=chromedriver_path,
+        headless=True,
+        user_data_dir=f"user_data_static_fetch_{static_fetch}",
+        static_fetch=static_fetch,
+    )
+    try:
+        agent.get(urls[0])  # Warm up.
+        latencies = []
+        cpu_start, browser_cpu_start = time.process_time(), browser_cpu_seconds(agent)
+        for url in urls:
+            start = time.perf_counter()
+            agent.get(url)
+            agent.get_text_from_page()
+            latencies.append(time.perf_counter() - start)
+        cpu = time.process_time() - cpu_start
+        browser_cpu = browser_cpu_seconds(agent) - browser_cpu_start
+    finally:
+        agent.driver.quit()
+    return latencies, cpu, browser_cpu
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("chromedriver_path")
+    parser.add_argument("--pages", type=int, default=20)
+    args = parser.parse_args()
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base = f"http://127.0.0.1:{server.server_port}"
+    urls = [f"{base}/article/{i}" for i in range(args.pages)] + [base + SPA_PATH]
+
+    print(f"{'mode':<10}{'median ms':>11}{'p95 ms':>9}{'SPA ms':>9}{'cpu s':>8}{'browser cpu s':>15}")
+    try:
+        for label, static_fetch in [("browser", False), ("static", True)]:
+            latencies, cpu, browser_cpu = benchmark(args.chromedriver_path, urls, static_fetch)
+            articles = sorted(latencies[:-1])
+            p95 = articles[int(0.95 * (len(articles) - 1))]
+            print(
+                f"{label:<10}{1000 * statistics.median(articles):>11.1f}{1000 * p95:>9.1f}"
+                f"{1000 * latencies[-1]:>9.1f}{cpu:>8.2f}"
+                f"{(browser_cpu if psutil else float('nan')):>15.2f}"
+            )
+    finally:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
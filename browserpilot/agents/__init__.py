@@ -1,2 +1,4 @@
 from .gpt_selenium_agent import GPTSeleniumAgent
 # from .goal_agent import GoalAgent
+from .async_gpt_selenium_agent import AsyncGPTSeleniumAgent
+from .grid_scheduler import GridScheduler
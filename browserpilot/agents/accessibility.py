@@ -0,0 +1,243 @@
+"""Accessibility-tree representation of a page, as a compact alternative to
+cleaned HTML for element lookup and retrieval."""
+import logging
+
+from selenium.common.exceptions import WebDriverException
+from selenium.webdriver.common.by import By
+
+from .element_store import BP_ID_ATTRIBUTE, TOP_FRAME_KEY, ElementStore
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+PAGE_REPRESENTATIONS = ["html", "accessibility"]
+
+MAX_NAME_LENGTH = 80  # Characters of an accessible name.
+# Text leaves; their content already shows up in their parent's name.
+TEXT_ROLES = set(["StaticText", "InlineTextBox", "ListMarker"])
+# Form controls, which are worth keeping even without a name.
+INPUT_ROLES = set(
+    [
+        "textbox",
+        "searchbox",
+        "combobox",
+        "checkbox",
+        "radio",
+        "slider",
+        "spinbutton",
+        "switch",
+    ]
+)
+# AX properties worth showing, and how.
+STATE_PROPERTIES = [
+    "focused",
+    "disabled",
+    "checked",
+    "selected",
+    "expanded",
+    "pressed",
+    "required",
+    "invalid",
+]
+
+# Stamps every element that doesn't have an id of its own yet. Ids are
+# prefixed, so they never collide with the ones ElementStore hands out. As in
+# ElementStore, the ids we stamped are kept in a WeakMap: a clone of a stamped
+# element (or an element the page gave the attribute) carries an id that
+# isn't its own, and is stamped again so that two elements never share one.
+STAMP_SCRIPT = """
+var attr = arguments[0];
+var ax = window.__bpAx;
+if (!ax || ax.doc !== document) {
+    ax = window.__bpAx = {doc: document, ids: new WeakMap(), next: 0};
+}
+var all = document.getElementsByTagName('*');
+for (var i = 0; i < all.length; i++) {
+    var el = all[i];
+    if (ax.ids.get(el) !== el.getAttribute(attr)) {
+        var id = 'a' + (ax.next++);
+        el.setAttribute(attr, id);
+        ax.ids.set(el, id);
+    }
+}
+"""
+
+
+def describe_ax_node(node):
+    """One line for an AX node, e.g. `button "Search" disabled`. Returns None
+    for nodes that are ignored, text leaves, or have no name (only grouping
+    or decorating), except for form controls."""
+    if node.get("ignored"):
+        return None
+    role = node.get("role", {}).get("value", "")
+    name = " ".join(str(node.get("name", {}).get("value", "")).split())
+    if role in TEXT_ROLES or not (name or role in INPUT_ROLES):
+        return None
+    if len(name) > MAX_NAME_LENGTH:
+        name = name[:MAX_NAME_LENGTH] + "..."
+
+    parts = [role]
+    if name:
+        parts.append(f'"{name}"')
+    value = node.get("value", {}).get("value")
+    if value not in [None, ""] and role in INPUT_ROLES:
+        parts.append(f'value="{str(value)[:MAX_NAME_LENGTH]}"')
+    for prop in node.get("properties", []):
+        value = prop.get("value", {}).get("value")
+        if prop.get("name") in STATE_PROPERTIES and value not in [None, False, "false"]:
+            parts.append(prop["name"] if value is True else f"{prop['name']}={value}")
+        elif prop.get("name") == "level":
+            parts.append(f"level={value}")
+    description = node.get("description", {}).get("value")
+    if description:
+        parts.append(f"({' '.join(str(description).split())[:MAX_NAME_LENGTH]})")
+    return " ".join(parts)
+
+
+def _bp_ids_by_backend_node(snapshot):
+    """Maps backend node id => (document index, data-bp-id) from a
+    `DOMSnapshot.captureSnapshot` result."""
+    strings = snapshot["strings"]
+    ids = {}
+    for doc_index, document in enumerate(snapshot["documents"]):
+        nodes = document["nodes"]
+        for backend_id, attributes in zip(nodes["backendNodeId"], nodes["attributes"]):
+            for i in range(0, len(attributes), 2):
+                if strings[attributes[i]] == BP_ID_ATTRIBUTE:
+                    ids[backend_id] = (doc_index, strings[attributes[i + 1]])
+                    break
+    return ids
+
+
+def _iframe_bp_ids(snapshot, bp_ids):
+    """Maps document index => data-bp-id of the iframe in the top document
+    that holds it. Nested iframes are left out, as in ElementStore."""
+    iframes = {}
+    nodes = snapshot["documents"][0]["nodes"]
+    content_documents = nodes.get("contentDocumentIndex", {"index": [], "value": []})
+    for node_index, doc_index in zip(
+        content_documents["index"], content_documents["value"]
+    ):
+        found = bp_ids.get(nodes["backendNodeId"][node_index])
+        if found is not None:
+            iframes[doc_index] = found[1]
+    return iframes
+
+
+class AccessibilityStore(ElementStore):
+    """Keeps one line per meaningful accessibility node, e.g.
+    `link "Sign in"` or `textbox "Search" focused`, for every frame of the
+    page.
+
+    The tree comes from `Accessibility.getFullAXTree`, which drops layout
+    noise like class names and URLs and merges text into the name of its
+    element. Nodes are mapped to elements through their backend node ids in
+    a DOM snapshot, where each element carries the `data-bp-id` stamped on
+    it, so lookups reuse ElementStore's `locate` and `get`. Needs CDP.
+    """
+
+    def __init__(self, metrics=None):
+        super().__init__(metrics=metrics)
+        self.texts = {}  # Frame key => text of the page, for retrieval.
+
+    def sync(self, driver):
+        """Bring the store up to date with the page in `driver`. Costs one
+        script per frame, a DOM snapshot, and an AX tree per frame."""
+        self._stamp(driver)
+        snapshot = driver.execute_cdp_cmd(
+            "DOMSnapshot.captureSnapshot", {"computedStyles": []}
+        )
+        bp_ids = _bp_ids_by_backend_node(snapshot)
+        iframe_keys = _iframe_bp_ids(snapshot, bp_ids)
+
+        frame_keys = {}  # CDP frame id => store key.
+        strings = snapshot["strings"]
+        for doc_index, document in enumerate(snapshot["documents"]):
+            frame_id = strings[document["frameId"]]
+            if doc_index == 0:
+                frame_keys[frame_id] = TOP_FRAME_KEY
+            elif doc_index in iframe_keys:
+                frame_keys[frame_id] = iframe_keys[doc_index]
+
+        updated = {key: {} for key in frame_keys.values()}
+        self.texts = {key: [] for key in frame_keys.values()}
+        for frame_id, key in frame_keys.items():
+            for node in self._ax_tree(driver, frame_id):
+                role = node.get("role", {}).get("value")
+                name = node.get("name", {}).get("value")
+                if role == "StaticText" and name and not node.get("ignored"):
+                    self.texts[key].append(str(name))
+                text = describe_ax_node(node)
+                if text is None:
+                    continue
+                if role in INPUT_ROLES:
+                    self.texts[key].append(text)  # Has no text leaves.
+                found = bp_ids.get(node.get("backendDOMNodeId"))
+                if found is not None:
+                    updated[key][found[1]] = text
+
+        for key in list(self.entries):
+            if key not in updated:
+                self._drop_frame(key)
+        for key, elements in updated.items():
+            self._update_frame(driver, key, elements)
+
+    def page_text(self):
+        """The text the page exposes to assistive technology (so nothing
+        hidden), plus its form controls, one per line. Call after `sync`."""
+        return "\n".join(
+            "\n".join(lines) for lines in self.texts.values() if lines
+        )
+
+    def _stamp(self, driver):
+        driver.execute_script(STAMP_SCRIPT, BP_ID_ATTRIBUTE)
+        for iframe in driver.find_elements(by=By.TAG_NAME, value="iframe"):
+            try:
+                driver.switch_to.frame(iframe)
+                driver.execute_script(STAMP_SCRIPT, BP_ID_ATTRIBUTE)
+            except WebDriverException:
+                pass  # E.g. the iframe went away.
+            finally:
+                driver.switch_to.default_content()
+
+    def _ax_tree(self, driver, frame_id):
+        try:
+            result = driver.execute_cdp_cmd(
+                "Accessibility.getFullAXTree", {"frameId": frame_id}
+            )
+        except WebDriverException as exc:
+            logger.debug(f"No accessibility tree for frame {frame_id}: {exc}")
+            return []
+        return result.get("nodes", [])
+
+    def _update_frame(self, driver, key, elements):
+        if key != TOP_FRAME_KEY and key not in self.iframes:
+            iframes = driver.find_elements(
+                By.CSS_SELECTOR, f'iframe[{BP_ID_ATTRIBUTE}="{key}"]'
+            )
+            if not iframes:
+                return
+            self.iframes[key] = iframes[0]
+        elif key == TOP_FRAME_KEY:
+            self.iframes[key] = None
+
+        from llama_index.core.schema import TextNode
+
+        entries = self.entries.setdefault(key, {})
+        gone = list(entries) + self._pending_bp_ids(key)
+        self._remove(key, [bp_id for bp_id in gone if bp_id not in elements])
+        stale = [
+            bp_id
+            for bp_id, text in elements.items()
+            if bp_id in entries and entries[bp_id] != text
+        ]
+        self._remove(key, stale)
+        nodes = [
+            TextNode(text=text, id_=f"{key}:{bp_id}")
+            for bp_id, text in elements.items()
+            if bp_id not in entries
+        ]
+        self._insert(self._within_budget(nodes), "accessibility_store")
+        logger.debug(
+            f"Frame {key}: {len(nodes)} AX nodes embedded, {len(entries)} total."
+        )
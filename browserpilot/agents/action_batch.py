@@ -0,0 +1,155 @@
+"""Batching of consecutive clicks and key presses into one W3C Actions
+request."""
+import logging
+
+from selenium.webdriver.common.action_chains import ActionChains
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# For each element, whether it takes text when clicked, so that
+# `send_keys_to_element`, which clicks it to focus it first, types into it.
+# Clicking a checkbox, radio button or select would change or open it, and
+# clicking a file input opens a dialog.
+TYPABLE_SCRIPT = """
+var TEXT_TYPES = ['text', 'search', 'email', 'url', 'tel', 'password', 'number'];
+return arguments[0].map(function (el) {
+    if (el.disabled || el.readOnly) {
+        return false;
+    }
+    if (el.tagName === 'TEXTAREA' || el.isContentEditable) {
+        return true;
+    }
+    return el.tagName === 'INPUT' && TEXT_TYPES.indexOf(el.type) >= 0;
+});
+"""
+
+
+class ActionBatchError(Exception):
+    """Performing a batch failed. The actions queued before `statement_index`
+    (the statement that queued the first action that wasn't performed, if
+    known) happened; later ones may have partly happened."""
+
+    def __init__(self, message, statement_index=None):
+        super().__init__(message)
+        self.statement_index = statement_index
+
+
+class ActionBatch:
+    """Queues clicks and key presses on elements of one frame, and sends them
+    as a single ActionChains submission with one frame switch.
+
+    A click is the same sequence `env.click` performs on its own (pause, move
+    to the element, pause, click). Keys are typed into text fields with
+    `send_keys_to_element`, which clicks the element to focus it first; any
+    other element (e.g. a checkbox, select or file input) gets a plain
+    `send_keys` of its own instead, between the actions before and after it.
+    The queue is only sent on `flush`, so the caller has to flush before
+    anything that reads the page. Each action keeps the index of the
+    statement of generated code that queued it, so that a failure can be
+    blamed on that statement.
+    """
+
+    def __init__(self, driver, pause=0.01):
+        self.driver = driver
+        self.pause = pause
+        self.iframe = None  # Of every element in the batch.
+        self.steps = []  # (action name, element, keys, statement index).
+        self.url = None  # Before the first action, if asked for.
+        self.flushing = False
+        self.performed = 0  # Steps of the batch being flushed that are done.
+
+    def __len__(self):
+        return len(self.steps)
+
+    @property
+    def pending(self):
+        return bool(self.steps) and not self.flushing
+
+    def accepts(self, element):
+        """Whether `element` can go in this batch, i.e. it is empty or the
+        element is in the same frame."""
+        iframe = getattr(element, "iframe", None)
+        return not self.steps or _same_frame(iframe, self.iframe)
+
+    def add(self, action, element, keys=None, url=None, statement_index=None):
+        if not self.steps:
+            self.iframe = getattr(element, "iframe", None)
+            self.url = url
+        self.steps.append((action, element, keys, statement_index))
+
+    def discard(self, statement_index):
+        """Drop the actions queued by statement `statement_index` or later,
+        e.g. because it failed and will be run again."""
+        self.steps = [
+            step
+            for step in self.steps
+            if step[3] is None or step[3] < statement_index
+        ]
+        if not self.steps:
+            self.clear()
+
+    def clear(self):
+        self.steps = []
+        self.iframe = None
+        self.url = None
+
+    def flush(self):
+        """Send the queued actions. Returns how many there were."""
+        if not self.pending:
+            return 0
+        steps, iframe = self.steps, self.iframe
+        self.flushing = True
+        self.performed = 0
+        try:
+            if iframe is not None:
+                self.driver.switch_to.frame(iframe)
+            try:
+                self._perform(steps)
+            except Exception as exc:
+                summary = ", ".join(step[0] for step in steps)
+                indices = [
+                    step[3] for step in steps[self.performed:] if step[3] is not None
+                ]
+                raise ActionBatchError(
+                    f"Batch of {len(steps)} actions ({summary}) failed: {exc}",
+                    statement_index=min(indices) if indices else None,
+                ) from exc
+            finally:
+                if iframe is not None:
+                    self.driver.switch_to.default_content()
+        finally:
+            self.flushing = False
+            self.clear()
+        logger.debug(f"Performed a batch of {len(steps)} actions.")
+        return len(steps)
+
+    def _perform(self, steps):
+        typed = [step[1] for step in steps if step[0] == "send_keys"]
+        typable = self.driver.execute_script(TYPABLE_SCRIPT, typed) if typed else []
+        chain, queued = ActionChains(self.driver), 0
+        for action, element, keys, _ in steps:
+            if action == "click":
+                chain.pause(self.pause).move_to_element(element).pause(
+                    self.pause
+                ).click(element)
+            elif typable.pop(0):
+                chain.send_keys_to_element(element, keys)
+            else:
+                if queued:
+                    chain.perform()
+                    self.performed += queued
+                element.send_keys(keys)
+                self.performed += 1
+                chain, queued = ActionChains(self.driver), 0
+                continue
+            queued += 1
+        if queued:
+            chain.perform()
+            self.performed += queued
+
+
+def _same_frame(a, b):
+    if a is None or b is None:
+        return a is b
+    return a.id == b.id
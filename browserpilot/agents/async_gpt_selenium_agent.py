@@ -0,0 +1,424 @@
+"""Asyncio front end for GPTSeleniumAgent, so one event loop can drive many
+browsers."""
+import ast
+import asyncio
+import functools
+import inspect
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from . import gpt_selenium_agent
+from .gpt_selenium_agent import GPTSeleniumAgent
+from .execution import StatementExecutor, is_dead_session
+from .metrics import record_sleep
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# `env` methods which only talk to WebDriver (or the disk). They are run on
+# the shared executor so that they don't block the event loop.
+WEBDRIVER_METHODS = set(
+    [
+        "find_element",
+        "find_elements",
+        "find_nearest",
+        "send_keys",
+        "click",
+        "scroll",
+        "get_text_of_element",
+        "get_text_from_page",
+        "get_many",
+        "is_element_visible_in_viewport",
+        "save",
+        "screenshot",
+    ]
+)
+# `env` methods which call the LLM or embeddings from within llama_index.
+# They are run on the executor too, but count against the LLM limit.
+LLM_METHODS = set(
+    [
+        "retrieve_information",
+        "ask_llm_to_find_element",
+        "ask_llm_to_find_elements",
+        "query_memory",
+    ]
+)
+# `env` methods that return async generators. Generated code iterates them
+# with `async for`, instead of awaiting them.
+ASYNC_ITERATOR_METHODS = set(["iter_elements"])
+
+
+class AsyncLimits:
+    """Concurrency limits shared by every AsyncGPTSeleniumAgent on an event
+    loop: how many LLM calls may be in flight, and how many threads may run
+    blocking WebDriver commands."""
+
+    def __init__(self, llm_concurrency=8, webdriver_threads=32):
+        self.llm_concurrency = llm_concurrency
+        self.webdriver_threads = webdriver_threads
+        self.executor = ThreadPoolExecutor(
+            max_workers=webdriver_threads, thread_name_prefix="browserpilot"
+        )
+        self._llm_semaphore = None
+
+    @property
+    def llm(self):
+        """Semaphore bounding concurrent LLM calls. Created lazily so that it
+        belongs to the running loop."""
+        if self._llm_semaphore is None:
+            self._llm_semaphore = asyncio.Semaphore(self.llm_concurrency)
+        return self._llm_semaphore
+
+    async def run_blocking(self, func, *args, **kwargs):
+        """Run `func` on the bounded executor."""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            self.executor, functools.partial(func, *args, **kwargs)
+        )
+
+
+_default_limits = None
+
+
+def get_default_limits():
+    """The limits used by agents that aren't given their own."""
+    global _default_limits
+    if _default_limits is None:
+        _default_limits = AsyncLimits()
+    return _default_limits
+
+
+class _AwaitEnvCalls(ast.NodeTransformer):
+    """Turns every `env.method(...)` call into `await env.method(...)`.
+
+    Functions defined in generated code that call `env` become coroutine
+    functions, and calls to them are awaited too. Their names are kept in
+    `async_functions`, so that later statements and blocks await them as
+    well. Generator expressions that await become list comprehensions.
+    Lambdas are left alone, since `await` is not allowed in them.
+
+    Loops and comprehensions over an async iterator (see
+    ASYNC_ITERATOR_METHODS) become `async for`, and any other use of one is
+    collected into a list first.
+    """
+
+    def __init__(self):
+        self.async_functions = set()
+
+    def visit_Call(self, node):
+        self.generic_visit(node)
+        func = node.func
+        if _is_env_call(node, ASYNC_ITERATOR_METHODS):
+            if getattr(node, "_async_iter", False):
+                return node
+            return _collect(node)
+        if (
+            isinstance(func, ast.Attribute)
+            and isinstance(func.value, ast.Name)
+            and func.value.id == "env"
+        ) or (isinstance(func, ast.Name) and func.id in self.async_functions):
+            return ast.Await(value=node)
+        return node
+
+    def visit_For(self, node):
+        if not _is_env_call(node.iter, ASYNC_ITERATOR_METHODS):
+            return self.generic_visit(node)
+        node.iter._async_iter = True
+        self.generic_visit(node)
+        async_node = ast.AsyncFor(
+            **{field: getattr(node, field, None) for field in node._fields}
+        )
+        return ast.copy_location(async_node, node)
+
+    def visit_comprehension(self, node):
+        if _is_env_call(node.iter, ASYNC_ITERATOR_METHODS):
+            node.iter._async_iter = True
+            node.is_async = 1
+        return self.generic_visit(node)
+
+    def visit_FunctionDef(self, node):
+        if _calls_env(node):
+            self.async_functions.add(node.name)  # Before, for recursive calls.
+        self.generic_visit(node)
+        if not _awaits(node):
+            self.async_functions.discard(node.name)  # E.g. only a lambda calls `env`.
+            return node
+        self.async_functions.add(node.name)
+        async_node = ast.AsyncFunctionDef(
+            **{field: getattr(node, field, None) for field in node._fields}
+        )
+        return ast.copy_location(async_node, node)
+
+    def visit_Lambda(self, node):
+        return node  # `await` is not allowed in a lambda.
+
+    def visit_GeneratorExp(self, node):
+        # With an `await` in it, a generator expression is an async generator,
+        # which `sum`, `any`, `list` etc. can't iterate, so build a list.
+        self.generic_visit(node)
+        if not _awaits(node):
+            return node
+        list_node = ast.ListComp(elt=node.elt, generators=node.generators)
+        return ast.copy_location(list_node, node)
+
+
+def _is_env_call(node, methods):
+    return (
+        isinstance(node, ast.Call)
+        and isinstance(node.func, ast.Attribute)
+        and isinstance(node.func.value, ast.Name)
+        and node.func.value.id == "env"
+        and node.func.attr in methods
+    )
+
+
+def _collect(node):
+    """`[item async for item in <node>]`, for an async iterator used as a
+    plain value, e.g. `list(env.iter_elements(...))`."""
+    item = "_bp_item"
+    comprehension = ast.comprehension(
+        target=ast.Name(id=item, ctx=ast.Store()), iter=node, ifs=[], is_async=1
+    )
+    list_node = ast.ListComp(
+        elt=ast.Name(id=item, ctx=ast.Load()), generators=[comprehension]
+    )
+    return ast.copy_location(list_node, node)
+
+
+def _calls_env(node):
+    return any(
+        isinstance(child, ast.Attribute)
+        and isinstance(child.value, ast.Name)
+        and child.value.id == "env"
+        for child in ast.walk(node)
+    )
+
+
+def _awaits(node):
+    """Whether `node` (e.g. the body of a function) awaits, outside nested
+    scopes."""
+    children = list(ast.iter_child_nodes(node))
+    while children:
+        child = children.pop()
+        if isinstance(child, (ast.Await, ast.AsyncFor)) or (
+            isinstance(child, ast.comprehension) and child.is_async
+        ):
+            return True
+        if not isinstance(
+            child, (ast.FunctionDef, ast.AsyncFunctionDef, ast.Lambda, ast.ClassDef)
+        ):
+            children.extend(ast.iter_child_nodes(child))
+    return False
+
+
+class AsyncGPTSeleniumAgent:
+    """Runs a GPTSeleniumAgent from an event loop.
+
+    LLM completions are awaited on the shared async OpenAI client, and
+    WebDriver commands (and waits) run on a bounded executor, so many agents
+    can share one process. Create it with `await
+    AsyncGPTSeleniumAgent.create(...)`, which takes the same arguments as
+    GPTSeleniumAgent, and then `await agent.run()`.
+    """
+
+    def __init__(self, agent: GPTSeleniumAgent, limits: AsyncLimits = None):
+        self.agent = agent
+        self.limits = limits or get_default_limits()
+        self.instruction_compiler = agent.instruction_compiler
+        self.executor = None  # Set in `run`.
+        self.await_env_calls = _AwaitEnvCalls()
+
+    @classmethod
+    async def create(cls, *args, limits=None, **kwargs):
+        """Launch the browser on the executor and wrap the agent."""
+        limits = limits or get_default_limits()
+        agent = await limits.run_blocking(GPTSeleniumAgent, *args, **kwargs)
+        return cls(agent, limits)
+
+    def __getattr__(self, name):
+        # Anything we don't override is looked up on the wrapped agent, with
+        # blocking `env` methods wrapped into coroutines.
+        if name == "agent":
+            raise AttributeError(name)
+        attr = getattr(self.agent, name)
+        if name in WEBDRIVER_METHODS:
+            return functools.partial(self.limits.run_blocking, attr)
+        if name in LLM_METHODS:
+            return functools.partial(self._run_llm_blocking, attr)
+        return attr
+
+    async def _run_llm_blocking(self, func, *args, **kwargs):
+        async with self.limits.llm:
+            return await self.limits.run_blocking(func, *args, **kwargs)
+
+    """Functions meant for the client to call."""
+
+    def set_instructions(self, instructions):
+        """Reset the instructions to `instructions`."""
+        self.agent.set_instructions(instructions)
+
+    async def run(self):
+        """Run the agent."""
+        # The same namespace GPTSeleniumAgent runs generated code in.
+        namespace = dict(vars(gpt_selenium_agent))
+        namespace["env"] = self
+        self.executor = StatementExecutor(
+            namespace,
+            after_block=functools.partial(
+                self.limits.run_blocking, self.agent._finish_block
+            ),
+        )
+        # So that batched actions know which statement queued them.
+        self.agent.executor = self.executor
+
+        compiler = self.instruction_compiler
+        if compiler.use_compiled and compiler.compiled_instructions:
+            logger.info("Found cached instructions. Running...")
+            instructions = "\n".join(compiler.compiled_instructions)
+            instructions = instructions.replace("```", "")
+            await self._run_compiled_instructions(instructions)
+        else:
+            logger.info("No cached instructions found. Running...")
+            await self._step_through_instructions()
+
+    """Helper functions"""
+
+    async def _run_compiled_instructions(self, instructions):
+        instruction = "\n".join(self.instruction_compiler.instructions["instructions"])
+        await self._run_action(instruction, instructions)
+        await self.limits.run_blocking(self.agent._complete)
+
+    async def _step_through_instructions(self):
+        compiler = self.instruction_compiler
+        while compiler.instructions_queue:
+            async with self.limits.llm:
+                step = await compiler.astep()
+            if step is None:
+                continue
+
+            action = step["action_output"]
+            logger.info(f"\nInstruction: {step['instruction']}\n\nAction: {action}\n")
+            await self._run_action(step["instruction"], action)
+
+        if self.agent.instruction_output_file:
+            compiler.save_compiled_instructions(self.agent.instruction_output_file)
+
+        await self.limits.run_blocking(self.agent._complete)
+
+    async def _run_action(self, instruction, action):
+        """Like `GPTSeleniumAgent.__run_action`: run `action` statement by
+        statement, and resume from the failing statement if retrying."""
+        attempts = 0
+        while attempts < 3:
+            attempts = attempts + 1
+            action = action.replace("```", "")
+            self.agent._check_danger(action)
+            self.agent.current_instruction = instruction
+            self.agent.current_action = action
+            failure = await self.executor.arun(action, self.await_env_calls)
+            if failure is None:
+                return
+            action = await self._handle_agent_exception(failure)
+        logger.warning(f"Giving up on instruction after {attempts} attempts.")
+
+    async def _handle_agent_exception(self, failure):
+        """Handle a StatementFailure. Returns the code to resume with."""
+        stack_trace, problem_instruction = self.agent._report_failure(failure)
+        if not self.agent.should_retry or is_dead_session(failure.exception):
+            raise Exception("Failed to execute instruction.") from failure.exception
+
+        async with self.limits.llm:
+            step = await self.instruction_compiler.aresume(
+                failure.completed_code,
+                failure.remaining_code,
+                problem_instruction + stack_trace,
+            )
+        action = step["action_output"].replace("```", "")
+        logger.info("RETRYING FROM THE FAILED STATEMENT...")
+        logger.info(f"\nInstruction: {step['instruction']}\n\nAction: {action}\n")
+        return action
+
+    """Functions exposed to the agent via the text prompt."""
+
+    async def wait(self, seconds):
+        await self.limits.run_blocking(self.agent.wait, seconds)
+
+    async def get(self, url, load_profile=None):
+        """`GPTSeleniumAgent.get` on the executor, so that static fetches,
+        metrics and the flight recorder work as they do there. Counts against
+        the LLM limit if the page is added to memory."""
+        if self.agent.memory_folder:
+            return await self._run_llm_blocking(self.agent.get, url, load_profile)
+        return await self.limits.run_blocking(self.agent.get, url, load_profile)
+
+    async def iter_elements(
+        self, by="css selector", value=None, max_items=None, idle_timeout=5, poll_interval=0.5
+    ):
+        """Like `GPTSeleniumAgent.iter_elements`, as an async generator: each
+        round trip runs on the executor when the elements before it are used
+        up, and the wait between empty rounds is on the event loop. Generated
+        code loops over it with `async for` (see `_AwaitEnvCalls`)."""
+        rounds = self.agent._element_rounds(by, value, idle_timeout)
+        count = 0
+        try:
+            while max_items is None or count < max_items:
+                elements = await self.limits.run_blocking(next, rounds, None)
+                if elements is None:
+                    return
+                if not elements:
+                    record_sleep(self.agent.metrics, poll_interval, "iter_elements")
+                    await asyncio.sleep(poll_interval)
+                    continue
+                for element in elements:
+                    yield element
+                    count += 1
+                    if max_items is not None and count >= max_items:
+                        return
+        finally:
+            await self.limits.run_blocking(rounds.close)
+
+    async def map_pages(self, urls, fn, max_tabs=4, timeout=30, poll_interval=0.1):
+        """Like `GPTSeleniumAgent.map_pages`, but `fn` runs on the event loop
+        (and is awaited if it returns a coroutine, as functions that call
+        `env` do here) while its tab is current. Loading and polling the tabs
+        runs on the executor, and no worker thread is held while `fn` runs."""
+        pages = self.agent._load_pages(urls, max_tabs, timeout, poll_interval)
+        result = None
+        try:
+            while True:
+                done, value = await self.limits.run_blocking(_send, pages, result)
+                if done:
+                    return value
+                result = fn(value)
+                if inspect.isawaitable(result):
+                    result = await result
+        finally:
+            await self.limits.run_blocking(pages.close)
+
+    async def get_llm_response(self, prompt, temperature=0.7, model=None):
+        if model is None:
+            model = self.agent.model_for_responses
+
+        async with self.limits.llm:
+            return await self.instruction_compiler.aget_completion(
+                prompt,
+                model=model,
+                max_tokens=2048,  # Let it be expressive!
+                temperature=temperature,
+            )
+
+
+def _send(generator, value):
+    """`generator.send(value)`, as (whether it returned, what it yielded or
+    returned), since StopIteration can't be raised out of a future."""
+    try:
+        return False, generator.send(value)
+    except StopIteration as stop:
+        return True, stop.value
+
+
+async def run_agents(agents):
+    """Run several AsyncGPTSeleniumAgents concurrently and return their
+    results (or exceptions) in order."""
+    return await asyncio.gather(
+        *[agent.run() for agent in agents], return_exceptions=True
+    )
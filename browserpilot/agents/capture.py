@@ -0,0 +1,149 @@
+"""Background pipeline for screenshots and debug snapshots.
+
+The action thread only grabs raw bytes from the browser. Decoding, optional
+downscaling and re-encoding, compression and file I/O happen on a small
+worker pool behind a bounded queue.
+"""
+import base64
+import gzip
+import io
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    from PIL import Image
+except ImportError:  # Only needed to downscale or convert screenshots.
+    Image = None
+
+try:
+    import zstandard
+except ImportError:  # Only needed for "zstd" compression.
+    zstandard = None
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+COMPRESSIONS = [None, "gzip", "zstd"]
+# File extension => Pillow format.
+IMAGE_FORMATS = {"png": "PNG", "jpg": "JPEG", "jpeg": "JPEG", "webp": "WEBP"}
+
+
+def capture_full_page(driver):
+    """Returns a base64 PNG of the whole page, not just the viewport. Uses CDP
+    when the driver supports it, and the viewport screenshot otherwise."""
+    if hasattr(driver, "execute_cdp_cmd"):
+        metrics = driver.execute_cdp_cmd("Page.getLayoutMetrics", {})
+        size = metrics.get("cssContentSize") or metrics["contentSize"]
+        result = driver.execute_cdp_cmd(
+            "Page.captureScreenshot",
+            {
+                "format": "png",
+                "captureBeyondViewport": True,
+                "clip": {
+                    "x": 0,
+                    "y": 0,
+                    "width": size["width"],
+                    "height": size["height"],
+                    "scale": 1,
+                },
+            },
+        )
+        return result["data"]
+    return driver.get_screenshot_as_base64()
+
+
+class CapturePipeline:
+    def __init__(self, workers=2, max_pending=32, max_width=None, compression=None):
+        """Initialize the pipeline.
+
+        Args:
+            workers (int): Number of background threads.
+            max_pending (int): Maximum number of captures waiting to be
+                written. `submit_*` blocks when the queue is full.
+            max_width (int): Downscale images wider than this. Requires
+                Pillow.
+            compression (str): None, "gzip" or "zstd". Compressed files get
+                a ".gz" or ".zst" suffix. "zstd" requires zstandard.
+        """
+        assert compression in COMPRESSIONS, f"Invalid compression: {compression}"
+        if compression == "zstd" and zstandard is None:
+            logger.warning("zstandard is not installed. Using gzip instead.")
+            compression = "gzip"
+        self.max_width = max_width
+        self.compression = compression
+        self.executor = ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix="browserpilot-capture"
+        )
+        self.slots = threading.BoundedSemaphore(max_pending)
+        self.futures = []
+        self.lock = threading.Lock()
+
+    def submit_image(self, png_base64, filename):
+        """Queue a base64 PNG, as returned by WebDriver or CDP. The image is
+        re-encoded to match the extension of `filename`."""
+        self._submit(self._write_image, png_base64, filename)
+
+    def submit_text(self, text, filename):
+        """Queue a string, e.g. the HTML of a page."""
+        self._submit(self._write_text, text, filename)
+
+    def flush(self):
+        """Wait for every queued capture to be written. Errors are logged
+        rather than raised, since captures are a side channel."""
+        with self.lock:
+            futures, self.futures = self.futures, []
+        for future in futures:
+            exc = future.exception()
+            if exc is not None:
+                logger.warning(f"Failed to write capture: {exc}")
+
+    def close(self):
+        self.flush()
+        self.executor.shutdown(wait=True)
+
+    def _submit(self, func, *args):
+        self.slots.acquire()
+        future = self.executor.submit(func, *args)
+        future.add_done_callback(lambda _: self.slots.release())
+        with self.lock:
+            self.futures = [f for f in self.futures if not f.done()]
+            self.futures.append(future)
+
+    def _write_image(self, png_base64, filename):
+        data = base64.b64decode(png_base64)
+        extension = os.path.splitext(filename)[1].lower().lstrip(".")
+        image_format = IMAGE_FORMATS.get(extension, "PNG")
+        if image_format != "PNG" or self.max_width:
+            data = self._encode_image(data, image_format)
+        self._write(data, filename)
+
+    def _write_text(self, text, filename):
+        self._write(text.encode("utf-8"), filename)
+
+    def _encode_image(self, data, image_format):
+        if Image is None:
+            logger.warning("Pillow is not installed. Writing the PNG as is.")
+            return data
+        image = Image.open(io.BytesIO(data))
+        if self.max_width and image.width > self.max_width:
+            height = round(image.height * self.max_width / image.width)
+            image = image.resize((self.max_width, height))
+        if image_format == "JPEG":
+            image = image.convert("RGB")
+        buffer = io.BytesIO()
+        image.save(buffer, image_format)
+        return buffer.getvalue()
+
+    def _write(self, data, filename):
+        if self.compression == "gzip":
+            data, filename = gzip.compress(data), filename + ".gz"
+        elif self.compression == "zstd":
+            data = zstandard.ZstdCompressor().compress(data)
+            filename = filename + ".zst"
+        folder = os.path.dirname(filename)
+        if folder:
+            os.makedirs(folder, exist_ok=True)
+        with open(filename, "wb") as f:
+            f.write(data)
@@ -0,0 +1,192 @@
+"""Compile instruction files ahead of time, in parallel, without a browser."""
+import json
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from .instruction_compiler import InstructionCompiler
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+OUTPUT_FORMATS = ["yaml", "json"]
+
+
+class _MeteredCompiler(InstructionCompiler):
+    """Keeps the model, tokens and requests of the completions made by the
+    current thread, so that each block can be reported on its own."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.usage = threading.local()
+
+    def reset_usage(self):
+        self.usage.model = None
+        self.usage.requests = 0
+        self.usage.prompt_tokens = 0
+        self.usage.completion_tokens = 0
+
+    def _observe_response(self, model, seconds, response):
+        super()._observe_response(model, seconds, response)
+        self.usage.model = model
+        self.usage.requests += 1
+        usage = getattr(response, "usage", None)
+        if usage is not None:
+            self.usage.prompt_tokens += usage.prompt_tokens or 0
+            self.usage.completion_tokens += usage.completion_tokens or 0
+
+
+def output_path(path, output_dir=None, output_format="yaml"):
+    """Where the compiled version of `path` goes: `<name>.compiled.<format>`
+    next to it, or `<name>.<format>` in `output_dir`."""
+    name = os.path.splitext(os.path.basename(path))[0]
+    if output_dir is None:
+        return os.path.join(os.path.dirname(path), f"{name}.compiled.{output_format}")
+    return os.path.join(output_dir, f"{name}.{output_format}")
+
+
+def load_cache(cache_file):
+    if cache_file is None or not os.path.exists(cache_file):
+        return {}
+    with open(cache_file, "r") as f:
+        return json.load(f)
+
+
+def save_cache(cache_file, cache):
+    tmp_file = cache_file + ".tmp"
+    with open(tmp_file, "w") as f:
+        json.dump(cache, f)
+    os.replace(tmp_file, cache_file)
+
+
+def compile_files(
+    paths,
+    output_dir=None,
+    output_format="yaml",
+    model="gpt-4o-mini",
+    max_workers=8,
+    model_router=None,
+    cache_file=None,
+    force=False,
+    metrics=None,
+):
+    """Compile every instruction file in `paths` and write the compiled
+    version of each (see `output_path`), without launching a browser.
+
+    Each block of instructions is compiled on its own, so the blocks of all
+    files are sent to the LLM in parallel, up to `max_workers` at a time.
+    Blocks that appear in several files (e.g. a shared RUN_FUNCTION) are
+    only compiled once, and all files share one completion cache, which is
+    loaded from and saved to `cache_file` if given. Files that already have
+    compiled code are skipped, unless `force`.
+
+    A block that fails to compile (e.g. the API is down) doesn't stop the
+    others: its report has the `error`, and its file is not written, so it
+    is compiled again next time. The cache is saved either way.
+
+    Returns one report per block: the file, the index of the block, the
+    model, seconds, requests, prompt and completion tokens, whether it
+    came from the cache (no requests), and the error, if any.
+    """
+    assert output_format in OUTPUT_FORMATS, f"Invalid output format: {output_format}"
+    if output_dir is not None:
+        os.makedirs(output_dir, exist_ok=True)
+    cache = load_cache(cache_file)
+
+    compilers = {}  # Path => compiler, in the order of `paths`.
+    for path in paths:
+        with open(path, "r") as f:
+            instructions = f.read() if path.endswith(".txt") else f
+            compiler = _MeteredCompiler(
+                instructions=instructions,
+                model=model,
+                use_compiled=not force,
+                model_router=model_router,
+                metrics=metrics,
+            )
+        if compiler.compiled_instructions and not force:
+            logger.info(f"{path} is already compiled. Skipping.")
+            continue
+        if force:
+            compiler.history = []
+            compiler.finished_instructions = []
+        compiler.api_cache = cache  # Shared, so later files reuse answers.
+        compilers[path] = compiler
+
+    # Every distinct block, with the compiler that will compile it.
+    blocks = {}
+    for compiler in compilers.values():
+        for block in compiler.instructions_queue:
+            block = block.strip()
+            if block and block not in blocks:
+                blocks[block] = compiler
+
+    def compile_block(block):
+        compiler = blocks[block]
+        compiler.reset_usage()
+        start = time.time()
+        action_info, error = None, None
+        try:
+            action_info = compiler.get_action_output(block)
+        except Exception as exc:
+            logger.error(f"Could not compile block {block!r}: {exc}")
+            error = f"{type(exc).__name__}: {exc}"
+        usage = compiler.usage
+        return action_info, {
+            "model": usage.model,
+            "seconds": time.time() - start,
+            "requests": usage.requests,
+            "prompt_tokens": usage.prompt_tokens,
+            "completion_tokens": usage.completion_tokens,
+            "cached": error is None and usage.requests == 0,
+            "error": error,
+        }
+
+    try:
+        with ThreadPoolExecutor(max_workers=max_workers) as pool:
+            results = dict(zip(blocks, pool.map(compile_block, list(blocks))))
+        return _write_compiled_files(compilers, results, output_dir, output_format)
+    finally:
+        if cache_file is not None:
+            save_cache(cache_file, cache)
+
+
+def _write_compiled_files(compilers, results, output_dir, output_format):
+    """Write each file whose blocks all compiled, and return the reports."""
+    reports = []
+    reported = set()  # Blocks whose cost is reported already.
+    for path, compiler in compilers.items():
+        index = 0
+        failed = False
+        for block in compiler.instructions_queue:
+            block = block.strip()
+            if not block:
+                continue
+            action_info, report = results[block]
+            if report["error"] is None:
+                compiler._finish(block, dict(action_info))
+            else:
+                failed = True
+            if block in reported:
+                # Compiled once, for an earlier file or block.
+                report = dict(
+                    report,
+                    seconds=0.0,
+                    requests=0,
+                    prompt_tokens=0,
+                    completion_tokens=0,
+                    cached=report["error"] is None,
+                )
+            reported.add(block)
+            reports.append(dict(report, file=path, block=index))
+            index += 1
+        compiler.instructions_queue = []
+        if failed:
+            logger.error(f"Not writing {path}, since some of its blocks failed.")
+            continue
+        filename = output_path(path, output_dir, output_format)
+        compiler.save_compiled_instructions(filename)
+        logger.info(f"Compiled {path} into {filename}.")
+    return reports
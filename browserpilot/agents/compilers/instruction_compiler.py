@@ -1,22 +1,44 @@
 """InstructionCompiler class."""
+import asyncio
 import time
 import json
 import yaml
 import io
 import logging
-import traceback
 import os
 
 from typing import Dict, List, Union
 
-from openai import OpenAI
-from openai import RateLimitError, Timeout, APIError, APIConnectionError, OpenAIError
+from ..metrics import REGISTRY
+from .model_router import validate_action
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-# Instantiate OpenAI with OPENAI_API_KEY.
-client = OpenAI(api_key=os.environ.get("OPENAI_API_KEY"))
+# The OpenAI SDK is slow to import, so the clients are created on first use,
+# with OPENAI_API_KEY. See `get_client` and `get_async_client`.
+_client = None
+_async_client = None
+
+
+def get_client():
+    global _client
+    if _client is None:
+        from openai import OpenAI
+
+        _client = OpenAI(api_key=os.environ.get("OPENAI_API_KEY"))
+    return _client
+
+
+def get_async_client():
+    """Shared by every coroutine that awaits a completion, e.g. from
+    AsyncGPTSeleniumAgent."""
+    global _async_client
+    if _async_client is None:
+        from openai import AsyncOpenAI
+
+        _async_client = AsyncOpenAI(api_key=os.environ.get("OPENAI_API_KEY"))
+    return _async_client
 
 """Set up all the prompt variables."""
 
@@ -29,22 +51,27 @@ INJECT_FUNCTION_TOKEN = "INJECT_FUNCTION"
 # Suffixes to add to the base prompt.
 STACK_TRACE_SUFFIX = "\n\nThe code above failed. See stack trace: "
 RETRY_SUFFIX = "\n\nPlease try again keeping in mind the above stack trace. Only write code.\n\nOUTPUT: ```python"
+RESUME_SUFFIX = "\n\nThe code before the failing line already ran, and the variables it defined still exist. Keeping in mind the above stack trace, write the code to run from the failing line onward. Do not repeat code that already ran. Only write code.\n\nOUTPUT: ```python"
 
 # Prompts! The best part :).
 BASE_PROMPT = """You have an instance `env` with methods:
 - `env.driver`, the Selenium webdriver.
-- `env.get(url)` goes to url.
+- `env.get(url, load_profile=None)` goes to url. `load_profile` can be "text-only", "no-media" or "first-party-only" to skip loading images, media or trackers when only the text of a page matters.
+- `env.get_many(urls, max_tabs=4)` loads several pages at once in separate tabs and returns a list with the free text of each page, in order (None if a page did not load). It is much faster than calling `env.get` and `env.get_text_from_page` for each URL.
+- `env.map_pages(urls, fn, max_tabs=4)` loads several pages at once in separate tabs and calls `fn(url)` while on each page as soon as it loads, e.g. a function that uses `env.find_elements` or `env.get_text_from_page`. Returns a list with what `fn` returned for each URL, in order. Afterwards, `env` is back on the page it was on before.
 - `env.find_elements(by='class name', value=None)` finds and returns list `WebElement`. The argument `by` is a string that specifies the locator strategy. The argument `value` is a string that specifies the locator value. Use `xpath` for `by` and the xpath of the element for `value`.
 - `env.find_element(by='class name', value=None)` is like `env.find_elements()` but only returns the first element.
+- `env.iter_elements(by='css selector', value=None, max_items=None, idle_timeout=5)` yields matching WebElements one at a time, each only once, scrolling down as needed for more to load. It stops after `max_items`, or when nothing new loads for `idle_timeout` seconds. Use it in a `for` loop to collect items from feeds or infinitely scrolling pages, instead of calling `env.scroll` and `env.find_elements` repeatedly.
 - `env.find_nearest(e, xpath, direction="above")` can be used to locate a WebElement that matches the xpath near WebElement e. Direction is "above", "below", "left", or "right".
 - `env.send_keys(element, text)` sends `text` to element. Be mindful of special keys, like "enter" (use Keys.ENTER) and "tab" (use Keys.TAB).
 - `env.click(element)` clicks the WebElement. Use this instead of `element.click()`.
 - `env.wait(seconds)` waits for `seconds`.
 - `env.scroll(direction, iframe=None)` scrolls. Switches to `iframe` if given. `direction` can be "up", "down", "bottom", "top", "left", or "right".
 - `env.get_llm_response(text)` asks AI about a string `text`.
-- `env.query_memory(prompt)` asks AI to query its memory of ALL the web pages it has browsed so far. Invoked with something like "Query memory".
+- `env.query_memory(prompt, namespace=None)` asks AI to query its memory of ALL the web pages it has browsed so far. Pass `namespace` (e.g. a domain like "www.google.com") to only query part of it. Invoked with something like "Query memory".
 - `env.retrieve_information(prompt)` returns a string, information from a page given a prompt. Use prompt="Summarize:" for summaries. Invoked with commands like "retrieve", "find in the page", or similar.
 - `env.ask_llm_to_find_element(description)` asks AI to find an WebElement that matches the description. It returns None if it cannot find an element that matches the description, so you must check for that.
+- `env.ask_llm_to_find_elements(descriptions)` is like `env.ask_llm_to_find_element()` for a list of descriptions of elements on the same page, and is much faster than calling it several times. It returns a list with a WebElement or None for each description, in order.
 - `env.screenshot(element, filename)` takes a screenshot of the element and saves it to `filename`.
 - `env.save(text, filename)` saves the string `text` to a file `filename`.
 - `env.get_text_from_page()` returns the free text from the page.
@@ -79,6 +106,18 @@ HTML: {cleaned_html}
 
 OUTPUT:"""
 
+PROMPT_TO_FIND_ELEMENTS = """Below are candidate HTML elements from a web page, each with a number, and a numbered list of descriptions. For each description, pick the number of the candidate that matches it. If no candidate matches a description, use null.
+
+CANDIDATES:
+{candidates}
+
+DESCRIPTIONS:
+{descriptions}
+
+Respond with only a JSON list with one entry per description, in order, e.g. [3, null, 12].
+
+OUTPUT:"""
+
 
 class InstructionCompiler:
     def __init__(
@@ -87,6 +126,8 @@ class InstructionCompiler:
         base_prompt=BASE_PROMPT,
         model="gpt-4o-mini",
         use_compiled=True,
+        model_router=None,
+        metrics=None,
     ):
         """Initialize the compiler. The compiler handles the sequencing of
         each set of instructions which are injected into the base prompt.
@@ -104,6 +145,11 @@ class InstructionCompiler:
             base_prompt (str): The base prompt to use. Defaults to BASE_PROMPT.
             use_compiled (bool): Whether to use the compiled instructions, if
                 any.
+            model_router (ModelRouter): If given, picks the model for each
+                block instead of always using `model`, and escalates to a
+                stronger model when the compiled code fails.
+            metrics (MetricsRegistry): Where to count LLM calls, latency,
+                tokens and cache hits. Defaults to the shared registry.
         """
         # Assert that none of the parameters are None and that the
         # instructions are either of type string or file buffer.
@@ -117,9 +163,12 @@ class InstructionCompiler:
 
         # Instance variables.
         self.model = model
+        self.model_router = model_router
+        self.metrics = metrics or REGISTRY
         logger.info(f"Using model {self.model}.")
         self.base_prompt = BASE_PROMPT
         self.prompt_to_find_element = PROMPT_TO_FIND_ELEMENT
+        self.prompt_to_find_elements = PROMPT_TO_FIND_ELEMENTS
         self.use_compiled = use_compiled
         self.api_cache = {}  # Instruction string to API response.
         self.functions = {}  # Set in _parse_instructions_into_queue.
@@ -274,6 +323,36 @@ class InstructionCompiler:
 
         return final_queue
 
+    def _completion_request(self, prompt, model, temperature, max_tokens, stop):
+        """Returns whether `model` is a chat model and the keyword arguments
+        to send to the OpenAI API."""
+        kwargs = dict(
+            model=model,
+            max_tokens=max_tokens,
+            top_p=1,
+            frequency_penalty=0,
+            presence_penalty=0,
+            temperature=temperature,
+            stop=stop,
+        )
+        if "gpt-4" in model:
+            kwargs["messages"] = [{"role": "user", "content": prompt}]
+            return True, kwargs
+
+        kwargs.update(prompt=prompt, best_of=1)
+        return False, kwargs
+
+    def _completion_text(self, prompt, response, is_chat):
+        """Clean up the text of `response` and add it to the cache."""
+        if is_chat:
+            text = response.choices[0].message.content
+        else:
+            text = response.choices[0].text
+        text = text.replace("```python", "").replace("```", "").strip()
+        # Add to cache.
+        self.api_cache[prompt] = text
+        return text
+
     def get_completion(
         self, prompt, model=None, temperature=0, max_tokens=1024, stop=[], use_cache=True
     ):
@@ -282,60 +361,78 @@ class InstructionCompiler:
             model = self.model
 
         # Check if it's in the cache already.
-        if use_cache and prompt in self.api_cache:
+        if self._cache_lookup(prompt, use_cache):
             logger.info("Found prompt in API cache. Saving you money...")
             text = self.api_cache[prompt]
             return text
 
+        is_chat, kwargs = self._completion_request(
+            prompt, model, temperature, max_tokens, stop
+        )
+        client = get_client()
+        from openai import OpenAIError
+
+        start = time.time()
         try:
-            if "gpt-4" in model:
-                response = client.chat.completions.create(
-                    model=model,
-                    messages=[{"role": "user", "content": prompt}],
-                    max_tokens=max_tokens,
-                    top_p=1,
-                    frequency_penalty=0,
-                    presence_penalty=0,
-                    temperature=temperature,
-                    stop=stop,
-                )
-                text = response.choices[0].message.content
+            if is_chat:
+                response = client.chat.completions.create(**kwargs)
             else:
-                response = client.completions.create(
-                    model=model,
-                    prompt=prompt,
-                    max_tokens=max_tokens,
-                    top_p=1,
-                    frequency_penalty=0,
-                    presence_penalty=0,
-                    best_of=1,
-                    temperature=temperature,
-                    stop=stop,
-                )
-                text = response.choices[0].text
+                response = client.completions.create(**kwargs)
+            self._observe_response(model, time.time() - start, response)
         except OpenAIError as exc:
+            self._observe_error(model)
             logger.info(
                 "OpenAI error. Likely a rate limit error, API error, or timeout: {exc}. Sleeping for a few seconds.".format(
                     exc=str(exc)
                 )
             )
             time.sleep(5)
-            text = self.get_completion(
+            return self.get_completion(
                 prompt, temperature=temperature, max_tokens=max_tokens, model=model
             )
-        except Exception:
-            traceback.print_exc()
 
-        text = text.replace("```python", "").replace("```", "").strip()
-        # Add to cache.
-        self.api_cache[prompt] = text
+        return self._completion_text(prompt, response, is_chat)
 
-        return text
+    async def aget_completion(
+        self, prompt, model=None, temperature=0, max_tokens=1024, stop=[], use_cache=True
+    ):
+        """Like `get_completion`, but awaits the shared async OpenAI client."""
+        if model is None:
+            model = self.model
 
-    def get_action_output(self, instructions):
-        """Get the action output for the given instructions."""
-        prompt = self.base_prompt.format(instructions=instructions)
-        completion = self.get_completion(prompt).strip()
+        if self._cache_lookup(prompt, use_cache):
+            logger.info("Found prompt in API cache. Saving you money...")
+            return self.api_cache[prompt]
+
+        is_chat, kwargs = self._completion_request(
+            prompt, model, temperature, max_tokens, stop
+        )
+        async_client = get_async_client()
+        from openai import OpenAIError
+
+        start = time.time()
+        try:
+            if is_chat:
+                response = await async_client.chat.completions.create(**kwargs)
+            else:
+                response = await async_client.completions.create(**kwargs)
+            self._observe_response(model, time.time() - start, response)
+        except OpenAIError as exc:
+            self._observe_error(model)
+            logger.info(
+                "OpenAI error. Likely a rate limit error, API error, or timeout: {exc}. Sleeping for a few seconds.".format(
+                    exc=str(exc)
+                )
+            )
+            await asyncio.sleep(5)
+            return await self.aget_completion(
+                prompt, temperature=temperature, max_tokens=max_tokens, model=model
+            )
+
+        return self._completion_text(prompt, response, is_chat)
+
+    def _action_output(self, instructions, completion):
+        """Strip the completion for `instructions` of any imports."""
         action_output = completion.strip()
         lines = [line for line in action_output.split("\n") if not line.startswith("import ")]
         action_output = "\n".join(lines)
@@ -344,6 +441,89 @@ class InstructionCompiler:
             "action_output": action_output,
         }
 
+    def _cache_lookup(self, prompt, use_cache):
+        """Whether `prompt` can be answered from the cache. Counts hits and
+        misses."""
+        if not use_cache:
+            result = "bypass"
+        elif prompt in self.api_cache:
+            result = "hit"
+        else:
+            result = "miss"
+        self.metrics.counter(
+            "browserpilot_llm_cache_total", "Completion cache lookups by result."
+        ).inc(result=result)
+        return result == "hit"
+
+    def _observe_response(self, model, seconds, response):
+        if self.model_router is not None:
+            self.model_router.observe(model, seconds)
+        self.metrics.counter(
+            "browserpilot_llm_requests_total", "Completion requests by model."
+        ).inc(model=model)
+        self.metrics.histogram(
+            "browserpilot_llm_latency_seconds", "Completion latency by model."
+        ).observe(seconds, model=model)
+        usage = getattr(response, "usage", None)
+        if usage is not None:
+            tokens = self.metrics.counter(
+                "browserpilot_llm_tokens_total", "Tokens by model and kind."
+            )
+            tokens.inc(usage.prompt_tokens or 0, model=model, kind="prompt")
+            tokens.inc(usage.completion_tokens or 0, model=model, kind="completion")
+
+    def _observe_error(self, model):
+        self.metrics.counter(
+            "browserpilot_llm_errors_total", "Failed completion requests by model."
+        ).inc(model=model)
+
+    def _route(self, block):
+        """The model to compile `block` with."""
+        if self.model_router is None:
+            return self.model
+        return self.model_router.choose(block)
+
+    def _should_escalate(self, block, action_info):
+        """Whether the compiled code is invalid and a stronger model could be
+        tried."""
+        if self.model_router is None:
+            return False
+        error = validate_action(action_info["action_output"])
+        if error is None or not self.model_router.can_escalate(block):
+            return False
+        logger.info(f"Compiled code failed validation: {error}")
+        self.model_router.escalate(block)
+        return True
+
+    def get_action_output(self, instructions, block=None):
+        """Get the action output for the given instructions. `block` is the
+        block of instructions used for routing, if different."""
+        block = block or instructions
+        prompt = self.base_prompt.format(instructions=instructions)
+        use_cache = True
+        while True:
+            completion = self.get_completion(
+                prompt, model=self._route(block), use_cache=use_cache
+            )
+            action_info = self._action_output(instructions, completion)
+            if not self._should_escalate(block, action_info):
+                return action_info
+            use_cache = False  # The cache has the output that failed.
+
+    async def aget_action_output(self, instructions, block=None):
+        """Async version of `get_action_output`."""
+        block = block or instructions
+        prompt = self.base_prompt.format(instructions=instructions)
+        use_cache = True
+        while True:
+            completion = await self.aget_completion(
+                prompt, model=self._route(block), use_cache=use_cache
+            )
+            action_info = self._action_output(instructions, completion)
+            if not self._should_escalate(block, action_info):
+                return action_info
+            use_cache = False
+
     def step(self):
         """Run the compiler."""
         # For each instruction, give the base prompt the current instruction.
@@ -352,14 +532,25 @@ class InstructionCompiler:
         if instructions.strip():
             instructions = instructions.strip()
             action_info = self.get_action_output(instructions)
-            self.history.append(action_info)
+            return self._finish(instructions, action_info)
 
-            # Optimistically count the instruction as finished.
-            self.finished_instructions.append(instructions)
-            return action_info
+    async def astep(self):
+        """Async version of `step`."""
+        instructions = self.instructions_queue.pop(0)
+        if instructions.strip():
+            instructions = instructions.strip()
+            action_info = await self.aget_action_output(instructions)
+            return self._finish(instructions, action_info)
 
-    def retry(self, stack_trace_str):
-        """Revert the compiler to the previous state and run the instruction again."""
+    def _finish(self, instructions, action_info):
+        self.history.append(action_info)
+        # Optimistically count the instruction as finished.
+        self.finished_instructions.append(instructions)
+        return action_info
+
+    def _retry_prompt(self, stack_trace_str):
+        """Pop off the last instructions and action, and return them with the
+        prompt asking to fix them."""
         logger.info("Retrying...")
         # Pop off the last instruction and add it back to the queue.
         last_instructions = self.finished_instructions.pop()
@@ -367,20 +558,69 @@ class InstructionCompiler:
         # Get the last action to append to the prompt.
         last_action = self.history.pop()
 
+        # The code failed, so try a stronger model if there is one.
+        if self.model_router is not None:
+            self.model_router.escalate(last_instructions)
+
         # Append the failure suffixes to the prompt.
         prompt = self.base_prompt.format(instructions=last_instructions)
         prompt = prompt + "\n" + last_action["action_output"]
         prompt = prompt + STACK_TRACE_SUFFIX + " " + stack_trace_str
         prompt = prompt + RETRY_SUFFIX
+        return last_instructions, prompt
 
-        # Get the action output.
-        action_info = self.get_action_output(prompt)
-        self.history.append(action_info)
+    def retry(self, stack_trace_str):
+        """Revert the compiler to the previous state and run the instruction again."""
+        last_instructions, prompt = self._retry_prompt(stack_trace_str)
+        action_info = self.get_action_output(prompt, block=last_instructions)
+        return self._finish(last_instructions, action_info)
+
+    def _resume_prompt(self, completed_code, failed_code, stack_trace_str):
+        """Pop off the last instructions and action, and return them with the
+        prompt asking for the code from the failing statement onward."""
+        logger.info("Resuming from the failed statement...")
+        last_instructions = self.finished_instructions.pop()
+        self.history.pop()
+        if self.model_router is not None:
+            self.model_router.escalate(last_instructions)
 
-        # Optimistically count the instruction as finished.
-        self.finished_instructions.append(last_instructions)
+        prompt = self.base_prompt.format(instructions=last_instructions)
+        prompt = prompt + "\n" + completed_code + "\n" + failed_code
+        prompt = prompt + STACK_TRACE_SUFFIX + " " + stack_trace_str
+        prompt = prompt + RESUME_SUFFIX
+        return last_instructions, prompt
+
+    def _finish_resume(self, last_instructions, completed_code, completion):
+        action_info = self._action_output(last_instructions, completion)
+        full_action = "\n".join(
+            [code for code in [completed_code, action_info["action_output"]] if code]
+        )
+        self._finish(
+            last_instructions,
+            {"instruction": last_instructions, "action_output": full_action},
+        )
         return action_info
 
+    def resume(self, completed_code, failed_code, stack_trace_str):
+        """Like `retry`, but only asks for the code from the failing statement
+        onward, since the statements before it already ran. The history keeps
+        the full block, i.e. `completed_code` followed by the new code."""
+        last_instructions, prompt = self._resume_prompt(
+            completed_code, failed_code, stack_trace_str
+        )
+        completion = self.get_completion(prompt, model=self._route(last_instructions))
+        return self._finish_resume(last_instructions, completed_code, completion)
+
+    async def aresume(self, completed_code, failed_code, stack_trace_str):
+        """Async version of `resume`."""
+        last_instructions, prompt = self._resume_prompt(
+            completed_code, failed_code, stack_trace_str
+        )
+        completion = await self.aget_completion(
+            prompt, model=self._route(last_instructions)
+        )
+        return self._finish_resume(last_instructions, completed_code, completion)
+
     def save_compiled_instructions(self, filename):
         """Save the compiled instructions to a file."""
         assert filename.endswith(".yaml") or filename.endswith(
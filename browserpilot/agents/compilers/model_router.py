@@ -0,0 +1,180 @@
+"""ModelRouter class, which picks the model to compile each block with."""
+import ast
+import logging
+import re
+from collections import OrderedDict
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Cheapest first. A block goes to the first tier whose `max_complexity` is at
+# least the complexity of the block, and moves up one tier every time code
+# compiled for it fails validation or execution. A tier may also have a
+# `max_latency` in seconds, past which blocks skip it while it is slow.
+DEFAULT_TIERS = [
+    {"name": "fast", "models": ["gpt-4o-mini"], "max_complexity": 4},
+    {"name": "strong", "models": ["gpt-4o"], "max_complexity": None},
+]
+
+# Lines that map to a single obvious call, e.g. "Go to Google.com" or
+# "Wait 2 seconds".
+TRIVIAL_LINE_PATTERNS = [
+    re.compile(pattern, re.IGNORECASE)
+    for pattern in [
+        r"^(go to|open|navigate to|visit)\s+\S+\.?$",
+        r"^wait( for)?\s+\d+(\.\d+)?\s*(s|sec|secs|seconds?)?\.?$",
+        r"^scroll (up|down|to the top|to the bottom|top|bottom|left|right)\.?$",
+        r"^(press|hit) (enter|tab|escape)\.?$",
+    ]
+]
+# Words that tend to need a stronger model: control flow, and calls into the
+# LLM or memory whose results have to be checked.
+COMPLEX_MARKERS = [
+    r"\bif\b",
+    r"\bfor (each|every|all)\b",
+    r"\beach\b",
+    r"\buntil\b",
+    r"\bloop\b",
+    r"\bunless\b",
+    r"\botherwise\b",
+    r"\bask (the )?(llm|ai)\b",
+    r"\bretrieve\b",
+    r"\bquery memory\b",
+    r"\bsummar",
+    r"\bcompare\b",
+    r"\biframe\b",
+]
+COMPLEX_MARKER_WEIGHT = 2
+LATENCY_SMOOTHING = 0.3  # Weight of the newest sample in the moving average.
+# Every this many blocks that skip a slow tier, one goes to it anyway, so
+# that its latency is measured again.
+LATENCY_PROBE_INTERVAL = 10
+MAX_FAILED_BLOCKS = 1000  # Blocks whose failures are remembered, most recent.
+
+
+def validate_action(action_output):
+    """Returns an error message if the compiled code can't be run, or None."""
+    if not action_output.strip():
+        return "Empty output."
+    try:
+        ast.parse(action_output)
+    except SyntaxError as exc:
+        return f"Syntax error: {exc}"
+    return None
+
+
+class ModelRouter:
+    def __init__(self, tiers=DEFAULT_TIERS):
+        """Route blocks of instructions to tiers of models.
+
+        Args:
+            tiers (list): Dicts with a `name`, a list of `models` (any of which
+                may serve the tier; the one with the lowest measured latency
+                is used), a `max_complexity` (None for no limit), and
+                optionally a `max_latency` in seconds (blocks go to the next
+                tier while even the fastest model is slower). Cheapest first.
+        """
+        assert tiers, "Need at least one tier."
+        self.tiers = tiers
+        self.latency = {}  # Model => moving average of seconds per call.
+        self.failures = OrderedDict()  # Block => failures, the last MAX_FAILED_BLOCKS.
+        self.stats = {
+            tier["name"]: {"calls": 0, "seconds": 0.0, "escalations": 0, "skips": 0}
+            for tier in tiers
+        }
+
+    def complexity(self, block):
+        """Rough cost of compiling `block`: one point per line that is not
+        trivial, and more for words that need reasoning."""
+        lines = [line.strip() for line in block.split("\n") if line.strip()]
+        score = 0
+        for line in lines:
+            if not any(pattern.match(line) for pattern in TRIVIAL_LINE_PATTERNS):
+                score += 1
+            for marker in COMPLEX_MARKERS:
+                if re.search(marker, line, re.IGNORECASE):
+                    score += COMPLEX_MARKER_WEIGHT
+        return score
+
+    def tier_index(self, block):
+        complexity = self.complexity(block)
+        index = len(self.tiers) - 1
+        for i, tier in enumerate(self.tiers):
+            max_complexity = tier.get("max_complexity")
+            if max_complexity is None or complexity <= max_complexity:
+                index = i
+                break
+        index = min(index + self.failures.get(block, 0), len(self.tiers) - 1)
+        return index
+
+    def choose(self, block):
+        """Returns the model to compile `block` with."""
+        index = self.tier_index(block)
+        while index < len(self.tiers) - 1 and self._is_slow(self.tiers[index]):
+            index += 1
+        tier = self.tiers[index]
+        # Unmeasured models go first, so that every model gets measured.
+        model = min(tier["models"], key=lambda m: self.latency.get(m, 0.0))
+        logger.info(f"Routing block to {tier['name']} tier ({model}).")
+        return model
+
+    def _is_slow(self, tier):
+        """Whether even the fastest model of `tier` is over its `max_latency`.
+        Counts a skip, and every LATENCY_PROBE_INTERVAL-th time says no
+        anyway, so that the tier gets measured again."""
+        max_latency = tier.get("max_latency")
+        if max_latency is None:
+            return False
+        if min(self.latency.get(m, 0.0) for m in tier["models"]) <= max_latency:
+            return False
+        stats = self.stats[tier["name"]]
+        stats["skips"] += 1
+        if stats["skips"] % LATENCY_PROBE_INTERVAL == 0:
+            return False
+        logger.info(f"Skipping {tier['name']} tier, which is over {max_latency}s.")
+        return True
+
+    def can_escalate(self, block):
+        return self.tier_index(block) < len(self.tiers) - 1
+
+    def escalate(self, block):
+        """Record a failure of `block`, so it goes to the next tier."""
+        tier = self.tiers[self.tier_index(block)]
+        if self.can_escalate(block):
+            self.stats[tier["name"]]["escalations"] += 1
+            logger.info(f"Escalating block from {tier['name']} tier.")
+        self.failures[block] = self.failures.get(block, 0) + 1
+        self.failures.move_to_end(block)
+        while len(self.failures) > MAX_FAILED_BLOCKS:
+            self.failures.popitem(last=False)
+
+    def observe(self, model, seconds):
+        """Record the latency of an API call to `model`."""
+        previous = self.latency.get(model)
+        if previous is None:
+            self.latency[model] = seconds
+        else:
+            self.latency[model] = (
+                LATENCY_SMOOTHING * seconds + (1 - LATENCY_SMOOTHING) * previous
+            )
+        for tier in self.tiers:
+            if model in tier["models"]:
+                self.stats[tier["name"]]["calls"] += 1
+                self.stats[tier["name"]]["seconds"] += seconds
+                break
+
+    def report(self):
+        """Per tier: calls, mean latency, the share of calls that were
+        escalated to the next tier, and how many blocks skipped it for being
+        slow."""
+        report = {}
+        for name, stats in self.stats.items():
+            calls = stats["calls"]
+            report[name] = {
+                "calls": calls,
+                "mean_latency": stats["seconds"] / calls if calls else None,
+                "escalations": stats["escalations"],
+                "escalation_rate": stats["escalations"] / calls if calls else None,
+                "latency_skips": stats["skips"],
+            }
+        return report
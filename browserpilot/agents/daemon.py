@@ -0,0 +1,465 @@
+"""Long-running daemon that keeps a pool of warm browsers and runs jobs
+submitted over a local HTTP API (on a TCP port or a Unix socket).
+
+Imports, the OpenAI client, the compiler's response cache and the browsers
+themselves are set up once, so a job starts in milliseconds. Between jobs,
+each browser is reset (extra tabs closed, cookies and storage cleared)
+instead of relaunched.
+
+API:
+    POST /jobs                {"instructions": str, list or dict,
+                              "output_file": name in the jobs folder}
+                              => {"id": ...}. Needs a JSON body, an
+                              `Authorization: Bearer <token>` header if the
+                              daemon has a token, and no Origin other than
+                              localhost, so web pages can't submit jobs.
+    GET  /jobs                All jobs.
+    GET  /jobs/<id>           The job.
+    GET  /jobs/<id>/events    Newline-delimited JSON events until it ends.
+    GET  /status              The pool.
+    GET  /metrics             Metrics in the Prometheus text format, or as
+                              JSON with ?format=json.
+
+Finished jobs are forgotten after `job_ttl` seconds, or sooner once there
+are more than `max_jobs`.
+"""
+import itertools
+import json
+import logging
+import os
+import queue
+import secrets
+import socketserver
+import threading
+import time
+import traceback
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit
+
+from .execution import is_dead_session
+from .gpt_selenium_agent import GPTSeleniumAgent
+from .metrics import REGISTRY
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+EVENT_POLL_INTERVAL = 0.2  # Seconds between checks for the current block.
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+LOCAL_HOSTNAMES = ["localhost", "127.0.0.1", "::1"]
+
+
+def _origin(url):
+    parts = urlsplit(url)
+    if parts.scheme not in ["http", "https"] or not parts.netloc:
+        return None
+    return f"{parts.scheme}://{parts.netloc}"
+
+
+def visited_origins(driver):
+    """The origins in the history of every tab, and those of every cookie
+    (both schemes), which is where a job can have left storage behind.
+    Needs CDP."""
+    origins = set()
+    current = driver.current_window_handle
+    for handle in driver.window_handles:
+        driver.switch_to.window(handle)
+        history = driver.execute_cdp_cmd("Page.getNavigationHistory", {})
+        origins.update(_origin(entry["url"]) for entry in history["entries"])
+    driver.switch_to.window(current)
+    for cookie in driver.execute_cdp_cmd("Network.getAllCookies", {})["cookies"]:
+        domain = cookie["domain"].lstrip(".")
+        origins.update([f"http://{domain}", f"https://{domain}"])
+    origins.discard(None)
+    return origins
+
+
+def reset_browser(driver):
+    """Return the browser to a blank state: one tab, no cookies, no storage."""
+    try:
+        origins = visited_origins(driver)
+    except Exception:
+        origins = None  # No CDP, e.g. a remote driver.
+    handles = driver.window_handles
+    for handle in handles[1:]:
+        driver.switch_to.window(handle)
+        driver.close()
+    driver.switch_to.window(handles[0])
+    driver.get("about:blank")
+    if origins is None:
+        # Cookies of the current origin only, and storage stays.
+        driver.delete_all_cookies()
+        return
+    driver.execute_cdp_cmd("Network.clearBrowserCookies", {})
+    for origin in sorted(origins):
+        driver.execute_cdp_cmd(
+            "Storage.clearDataForOrigin", {"origin": origin, "storageTypes": "all"}
+        )
+    driver.execute_cdp_cmd("Page.resetNavigationHistory", {})
+
+
+class DaemonJob:
+    def __init__(self, job_id, instructions, output_file=None):
+        self.id = job_id
+        self.instructions = instructions
+        self.output_file = output_file
+        self.status = "queued"  # "queued", "running", "done" or "failed".
+        self.events = []
+        self.submitted = time.time()
+        self.started = None
+        self.finished = None
+        self.error = None
+        self._changed = threading.Condition(threading.RLock())
+        self.emit("queued")
+
+    def emit(self, event, **data):
+        with self._changed:
+            self.events.append(dict(data, event=event, time=time.time()))
+            self._changed.notify_all()
+
+    def wait_for_events(self, seen, timeout):
+        """Returns the events after the first `seen`, waiting up to `timeout`
+        for one if there are none yet."""
+        with self._changed:
+            if len(self.events) <= seen and not self.done:
+                self._changed.wait(timeout)
+            return self.events[seen:]
+
+    def finish(self, status, error=None):
+        with self._changed:
+            self.status = status
+            self.error = error
+            self.finished = time.time()
+            self.emit(status, error=error, seconds=self.finished - self.started)
+
+    @property
+    def done(self):
+        return self.status in ["done", "failed"]
+
+    def to_dict(self):
+        return {
+            "id": self.id,
+            "status": self.status,
+            "submitted": self.submitted,
+            "started": self.started,
+            "finished": self.finished,
+            "error": self.error,
+        }
+
+
+class AgentDaemon:
+    def __init__(
+        self,
+        browsers=2,
+        user_data_dir="user_data",
+        jobs_dir="daemon_jobs",
+        token=None,
+        job_ttl=3600,
+        max_jobs=1000,
+        **agent_kwargs,
+    ):
+        """Keep `browsers` warm agents and run queued jobs on them.
+
+        Args:
+            browsers (int): Number of browsers, i.e. of jobs run at once.
+            user_data_dir (str): Each browser gets a profile in a subfolder.
+            jobs_dir (str): Folder that jobs' `output_file` must be in.
+            token (str): If set, `POST /jobs` needs it as a bearer token.
+            job_ttl (float): Seconds to keep a finished job around.
+            max_jobs (int): How many jobs to keep at most; the oldest
+                finished jobs are forgotten first.
+            agent_kwargs: Passed to every GPTSeleniumAgent, e.g.
+                `chromedriver_path` or `model_for_instructions`.
+        """
+        self.size = browsers
+        self.user_data_dir = user_data_dir
+        self.jobs_dir = jobs_dir
+        self.token = token
+        self.job_ttl = job_ttl
+        self.max_jobs = max_jobs
+        self.agent_kwargs = dict(agent_kwargs, close_after_completion=False)
+        self.metrics = self.agent_kwargs.setdefault("metrics", REGISTRY)
+        self.agents = [None] * browsers
+        self.jobs = {}  # Job id => job, in the order they were submitted.
+        self._jobs_lock = threading.Lock()
+        self.queue = queue.Queue()
+        self._ids = itertools.count()
+        self._workers = []
+
+    def start(self):
+        """Launch the browsers, in parallel, and start taking jobs."""
+        launchers = [
+            threading.Thread(target=self._launch, args=(slot,))
+            for slot in range(self.size)
+        ]
+        for thread in launchers:
+            thread.start()
+        for thread in launchers:
+            thread.join()
+        for slot in range(self.size):
+            worker = threading.Thread(target=self._work, args=(slot,), daemon=True)
+            worker.start()
+            self._workers.append(worker)
+
+    def submit(self, instructions, output_file=None):
+        """Queue a job. `output_file` is a path relative to `jobs_dir`;
+        raises ValueError if it points outside of it."""
+        if output_file is not None:
+            output_file = self._output_path(output_file)
+        job = DaemonJob(str(next(self._ids)), instructions, output_file)
+        with self._jobs_lock:
+            self._prune()
+            self.jobs[job.id] = job
+        self.queue.put(job)
+        return job
+
+    def shutdown(self):
+        for _ in self._workers:
+            self.queue.put(None)
+        for worker in self._workers:
+            worker.join()
+        for agent in self.agents:
+            if agent is not None:
+                agent.driver.quit()
+
+    def status(self):
+        return {
+            "browsers": self.size,
+            "busy": sum(
+                job.status == "running" for job in list(self.jobs.values())
+            ),
+            "queued": self.queue.qsize(),
+            "jobs": len(self.jobs),
+        }
+
+    def serve(self, host="127.0.0.1", port=8765, socket_path=None):
+        """Serve the API until interrupted."""
+        if socket_path:
+            if os.path.exists(socket_path):
+                os.remove(socket_path)
+            server = ThreadingUnixHTTPServer(socket_path, DaemonRequestHandler)
+            logger.info(f"Serving on {socket_path}.")
+        else:
+            server = ThreadingHTTPServer((host, port), DaemonRequestHandler)
+            logger.info(f"Serving on http://{host}:{server.server_port}.")
+        server.daemon_threads = True
+        server.agent_daemon = self
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+            self.shutdown()
+
+    """Helper functions"""
+
+    def _launch(self, slot):
+        kwargs = dict(self.agent_kwargs)
+        kwargs["user_data_dir"] = os.path.join(self.user_data_dir, f"daemon-{slot}")
+        agent = GPTSeleniumAgent("", **kwargs)
+        agent.driver.get("about:blank")
+        self.agents[slot] = agent
+        logger.info(f"Browser {slot} is ready.")
+
+    def _output_path(self, output_file):
+        jobs_dir = os.path.realpath(self.jobs_dir)
+        path = os.path.realpath(os.path.join(jobs_dir, output_file))
+        if os.path.commonpath([jobs_dir, path]) != jobs_dir or path == jobs_dir:
+            raise ValueError(f"output_file must be a file in {self.jobs_dir}.")
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        return path
+
+    def _prune(self):
+        """Forget the finished jobs that are past `job_ttl`, then the oldest
+        finished jobs while there are more than `max_jobs`, counting the one
+        about to be added. Jobs that are queued or running are kept."""
+        expired = time.time() - self.job_ttl
+        finished = [job for job in self.jobs.values() if job.done]
+        excess = len(self.jobs) + 1 - self.max_jobs
+        for job in finished:
+            if job.finished < expired or excess > 0:
+                del self.jobs[job.id]
+                excess -= 1
+
+    def _prepare(self, agent, job):
+        # Nothing of the last job may leak into this one's events.
+        agent.current_instruction = None
+        agent.current_action = None
+        compiler = agent.instruction_compiler
+        compiler.history = []
+        compiler.finished_instructions = []
+        instructions = job.instructions
+        if isinstance(instructions, list):
+            instructions = "\n".join(instructions)
+        agent.set_instructions(instructions)
+        agent.instruction_output_file = job.output_file
+        agent.element_store.reset()
+        agent.action_batch.clear()
+        agent.static_page = None
+        agent.flight_recorder.entries.clear()
+        agent.flight_recorder.bytes = 0
+
+    def _work(self, slot):
+        while True:
+            job = self.queue.get()
+            if job is None:
+                return
+            job.status = "running"
+            job.started = time.time()
+            job.emit("started", browser=slot)
+            watcher = None
+            status, error = "done", None
+            try:
+                agent = self.agents[slot]
+                if agent is None:
+                    # The last relaunch failed, so try again.
+                    agent = self._relaunch(slot)
+                if agent is None:
+                    raise RuntimeError(f"Browser {slot} could not be launched.")
+                self._prepare(agent, job)
+                watcher = threading.Thread(target=self._watch, args=(job, agent), daemon=True)
+                watcher.start()
+                agent.run()
+            except BaseException as exc:
+                # SystemExit included: the agent exits on dangerous code.
+                status = "failed"
+                error = "".join(traceback.format_exception_only(type(exc), exc))
+                if self.agents[slot] is not None and is_dead_session(exc):
+                    logger.warning(f"Browser {slot} died. Relaunching.")
+                    self._relaunch(slot)
+            job.finish(status, error)
+            if watcher is not None:
+                watcher.join()
+            if self.agents[slot] is None:
+                continue
+            try:
+                reset_browser(self.agents[slot].driver)
+            except Exception:
+                logger.warning(f"Could not reset browser {slot}. Relaunching.")
+                self._relaunch(slot)
+
+    def _watch(self, job, agent):
+        """Emit an event whenever the agent moves on to a new block."""
+        current = None
+        while not job.done:
+            instruction = agent.current_instruction
+            if instruction is not None and instruction != current:
+                current = instruction
+                job.emit("instruction", instruction=instruction)
+            time.sleep(EVENT_POLL_INTERVAL)
+
+    def _relaunch(self, slot):
+        """Replace the browser in `slot`. Returns the new agent, or None if it
+        could not be launched, in which case the next job tries again."""
+        agent, self.agents[slot] = self.agents[slot], None
+        if agent is not None:
+            try:
+                agent.driver.quit()
+            except Exception:
+                pass
+        try:
+            self._launch(slot)
+        except Exception as exc:
+            logger.error(f"Could not relaunch browser {slot}: {exc}")
+        return self.agents[slot]
+
+
+class ThreadingUnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    pass
+
+
+class DaemonRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    @property
+    def agent_daemon(self):
+        return self.server.agent_daemon
+
+    def do_GET(self):
+        path, _, query = self.path.partition("?")
+        parts = [part for part in path.split("/") if part]
+        if parts == ["status"]:
+            return self._send_json(self.agent_daemon.status())
+        if parts == ["metrics"]:
+            metrics = self.agent_daemon.metrics
+            if "format=json" in query:
+                return self._send_json(metrics.to_dict())
+            return self._send_text(metrics.to_prometheus(), PROMETHEUS_CONTENT_TYPE)
+        if parts == ["jobs"]:
+            jobs = list(self.agent_daemon.jobs.values())
+            return self._send_json([job.to_dict() for job in jobs])
+        if len(parts) in [2, 3] and parts[0] == "jobs":
+            job = self.agent_daemon.jobs.get(parts[1])
+            if job is None:
+                return self._send_json({"error": "No such job."}, status=404)
+            if len(parts) == 2:
+                return self._send_json(job.to_dict())
+            if parts[2] == "events":
+                return self._stream_events(job)
+        self._send_json({"error": "Not found."}, status=404)
+
+    def do_POST(self):
+        if self.path.rstrip("/") != "/jobs":
+            return self._send_json({"error": "Not found."}, status=404)
+        length = int(self.headers.get("Content-Length", 0))
+        body = self.rfile.read(length)  # Always, to keep the connection usable.
+        # Browsers can't send JSON to another site without a CORS preflight,
+        # which this server fails, and they always send an Origin with it.
+        content_type = self.headers.get("Content-Type", "").split(";")[0].strip()
+        if content_type != "application/json":
+            return self._send_json({"error": "Expected application/json."}, status=415)
+        origin = self.headers.get("Origin")
+        if origin is not None and urlsplit(origin).hostname not in LOCAL_HOSTNAMES:
+            return self._send_json({"error": "Cross-origin requests are not allowed."}, status=403)
+        token = self.agent_daemon.token
+        authorization = self.headers.get("Authorization", "")
+        expected = f"Bearer {token}".encode("utf-8")
+        if token and not secrets.compare_digest(authorization.encode("utf-8"), expected):
+            return self._send_json({"error": "Invalid or missing token."}, status=401)
+        try:
+            body = json.loads(body or b"{}")
+            instructions = body["instructions"]
+        except (ValueError, KeyError, TypeError):
+            return self._send_json({"error": "Expected {\"instructions\": ...}."}, status=400)
+        try:
+            job = self.agent_daemon.submit(instructions, output_file=body.get("output_file"))
+        except ValueError as exc:
+            return self._send_json({"error": str(exc)}, status=400)
+        self._send_json(job.to_dict(), status=202)
+
+    def _send_json(self, data, status=200):
+        self._send_text(json.dumps(data), "application/json", status=status)
+
+    def _send_text(self, text, content_type, status=200):
+        body = text.encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _stream_events(self, job):
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-ndjson")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        seen = 0
+        while True:
+            events = job.wait_for_events(seen, timeout=1)
+            seen += len(events)
+            for event in events:
+                self._write_chunk(json.dumps(event).encode("utf-8") + b"\n")
+            if job.done and seen == len(job.events):
+                break
+        self._write_chunk(b"")
+
+    def _write_chunk(self, data):
+        self.wfile.write(f"{len(data):x}\r\n".encode("ascii") + data + b"\r\n")
+        self.wfile.flush()
+
+    def address_string(self):
+        # Unix sockets have no client address.
+        return str(self.client_address[0]) if self.client_address else "unix"
+
+    def log_message(self, format, *args):
+        logger.debug(format % args)
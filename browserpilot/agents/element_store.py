@@ -0,0 +1,468 @@
+"""Incremental store of cleaned page elements used for element lookup."""
+import re
+import logging
+from selenium.common.exceptions import WebDriverException
+from selenium.webdriver.common.by import By
+
+from .metrics import REGISTRY, count_embeddings
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Attribute stamped onto every element we have snapshotted, so that the
+# store can recognize an element across snapshots.
+BP_ID_ATTRIBUTE = "data-bp-id"
+TOP_FRAME_KEY = "top"
+
+BLACKLISTED_ELEMENTS = set(
+    [
+        "head",
+        "title",
+        "meta",
+        "script",
+        "style",
+        "path",
+        "svg",
+        "br",
+        "::marker",
+    ]
+)
+BLACKLISTED_ATTRIBUTES = set(
+    ["style", "ping", "src", "item*", "aria*", "js*", "data-*"]
+)
+
+# Attributes kept in an element's encoding, in the order they are written.
+ENCODED_ATTRIBUTES = [
+    "id",
+    "name",
+    "type",
+    "role",
+    "for",
+    "href",
+    "action",
+    "placeholder",
+    "value",
+    "title",
+    "alt",
+    "label",
+    "checked",
+    "selected",
+    "disabled",
+    "class",
+]
+MAX_ATTRIBUTE_LENGTH = 60  # Characters of an attribute value.
+MAX_TEXT_LENGTH = 80  # Characters of an element's own text.
+MAX_ELEMENT_TOKENS = 48  # Per encoded element.
+MAX_PAGE_TOKENS = 32000  # Per page, across frames.
+CHARS_PER_TOKEN = 4  # Rough, but good enough for a budget.
+
+# Installs a MutationObserver in the current document (if there isn't one
+# already) and returns everything that changed since the last call. The first
+# call in a document returns the entire (stamped) document with `full` set.
+# Changes to an element's attributes or own text (text nodes added, removed
+# or edited in place) only dirty the element itself, so it is serialized
+# shallowly, with its text; added elements are serialized with their subtree;
+# removed elements report the ids of everything underneath them.
+OBSERVER_SCRIPT = """
+var BP_ATTR = arguments[0];
+var state = window.__bpState;
+var full = !state || state.doc !== document;
+if (full) {
+    if (state && state.observer) {
+        state.observer.disconnect();
+    }
+    state = window.__bpState = {
+        doc: document,
+        ids: new WeakMap(),
+        next: 0,
+        changed: new Set(),
+        added: new Set(),
+        removed: []
+    };
+    state.observer = new MutationObserver(function (records) {
+        for (var i = 0; i < records.length; i++) {
+            var r = records[i];
+            if (r.type === 'attributes') {
+                if (r.attributeName !== BP_ATTR) {
+                    state.changed.add(r.target);
+                }
+                continue;
+            }
+            if (r.type === 'characterData') {
+                if (r.target.parentElement) {
+                    state.changed.add(r.target.parentElement);
+                }
+                continue;
+            }
+            r.addedNodes.forEach(function (n) {
+                if (n.nodeType === 1) {
+                    state.added.add(n);
+                } else if (n.nodeType === 3) {
+                    state.changed.add(r.target);
+                }
+            });
+            r.removedNodes.forEach(function (n) {
+                if (n.nodeType === 3) {
+                    state.changed.add(r.target);
+                }
+                if (n.nodeType !== 1) {
+                    return;
+                }
+                [n].concat(Array.prototype.slice.call(
+                    n.querySelectorAll('[' + BP_ATTR + ']')
+                )).forEach(function (c) {
+                    if (isStamped(c)) {
+                        state.removed.push(c.getAttribute(BP_ATTR));
+                    }
+                });
+            });
+        }
+    });
+    state.observer.observe(document.documentElement, {
+        subtree: true, childList: true, attributes: true, characterData: true
+    });
+}
+function stamp(root) {
+    var nodes = [root].concat(Array.prototype.slice.call(root.querySelectorAll('*')));
+    for (var i = 0; i < nodes.length; i++) {
+        if (!isStamped(nodes[i])) {
+            var id = String(state.next++);
+            nodes[i].setAttribute(BP_ATTR, id);
+            state.ids.set(nodes[i], id);
+        }
+    }
+}
+// Whether we stamped `n` ourselves. Clones of stamped elements, or elements
+// the page gave the attribute, carry an id that isn't theirs.
+function isStamped(n) {
+    return n.hasAttribute(BP_ATTR) && state.ids.get(n) === n.getAttribute(BP_ATTR);
+}
+// The element without its children, except for its own text.
+function shallowHTML(n) {
+    var clone = n.cloneNode(false);
+    n.childNodes.forEach(function (c) {
+        if (c.nodeType === 3) {
+            clone.appendChild(c.cloneNode(false));
+        }
+    });
+    return clone.outerHTML;
+}
+function hasAddedAncestor(n) {
+    for (var p = n.parentElement; p; p = p.parentElement) {
+        if (state.added.has(p)) {
+            return true;
+        }
+    }
+    return false;
+}
+var result = {full: full, url: location.href, removed: [], subtrees: [], shallow: []};
+if (full) {
+    stamp(document.documentElement);
+    result.subtrees.push(document.documentElement.outerHTML);
+} else {
+    result.removed = state.removed;
+    state.added.forEach(function (n) {
+        if (n.isConnected && !hasAddedAncestor(n)) {
+            stamp(n);
+            result.subtrees.push(n.outerHTML);
+        }
+    });
+    state.changed.forEach(function (n) {
+        if (n.isConnected && !state.added.has(n) && !hasAddedAncestor(n)) {
+            stamp(n);
+            result.shallow.push(shallowHTML(n));
+        }
+    });
+}
+state.changed = new Set();
+state.added = new Set();
+state.removed = [];
+return result;
+"""
+
+
+def clean_html(html_string, keep_bp_id=False) -> "BeautifulSoup":
+    """Clean HTML to remove blacklisted elements and attributes. Returns
+    BeautifulSoup object."""
+    from bs4 import BeautifulSoup
+
+    soup = BeautifulSoup(html_string, "html.parser")
+
+    # Remove blacklisted items and attributes in it.
+    for blacklisted in BLACKLISTED_ELEMENTS:
+        for tag in soup.find_all(blacklisted):
+            tag.decompose()
+
+    # Delete the blacklisted attributes from each tag, as long as the
+    # attribute name matches the regex.
+    for tag in soup.find_all(True):
+        for attr in tag.attrs.copy():
+            if keep_bp_id and attr == BP_ID_ATTRIBUTE:
+                continue
+            for pattern in BLACKLISTED_ATTRIBUTES:
+                if re.match(pattern, attr):
+                    del tag[attr]
+                    break
+
+    return soup
+
+
+def estimate_tokens(text):
+    return -(-len(text) // CHARS_PER_TOKEN)
+
+
+def _truncate(text, length):
+    text = " ".join(text.split())
+    return text if len(text) <= length else text[: max(length - 3, 0)] + "..."
+
+
+def encode_element(tag, attrs, text="", max_tokens=MAX_ELEMENT_TOKENS):
+    """One line for an element, e.g. `<a id="login" href="/login">Sign in</a>`.
+
+    Only ENCODED_ATTRIBUTES are kept, values and text are truncated, and
+    attributes are dropped from the end (so `class` goes first) once the line
+    would be over `max_tokens`. Returns None if there is nothing left to say,
+    e.g. for a bare <div>.
+    """
+    budget = max_tokens * CHARS_PER_TOKEN - len(f"<{tag}></{tag}>")
+    parts = []
+    for attr in ENCODED_ATTRIBUTES:
+        value = attrs.get(attr)
+        if value is None:
+            continue
+        if isinstance(value, list):
+            value = " ".join(value)  # E.g. class.
+        value = _truncate(value, MAX_ATTRIBUTE_LENGTH).replace('"', "&quot;")
+        part = f'{attr}="{value}"' if value else attr
+        if len(part) + 1 > budget:
+            break
+        parts.append(part)
+        budget -= len(part) + 1
+    text = _truncate(text, min(MAX_TEXT_LENGTH, budget)) if budget > 3 else ""
+    if not parts and not text:
+        return None
+    opening = "<" + " ".join([tag] + parts) + ">"
+    return f"{opening}{text}</{tag}>" if text else opening
+
+
+def get_elements_for_llm(soup, max_tokens=MAX_ELEMENT_TOKENS):
+    """Returns a list of (bp_id, encoding) tuples from a cleaned soup, with
+    each element encoded once by `encode_element` from its tag, attributes
+    and own text (not its children's).
+
+    `bp_id` is None if the element was never stamped. Elements with nothing
+    to encode, e.g., <p></p>, come back with None, so that callers can tell
+    when an element stops being interesting.
+    """
+    from bs4 import NavigableString
+
+    elements = []
+    for ele in soup.find_all():
+        bp_id = ele.attrs.pop(BP_ID_ATTRIBUTE, None)
+        text = " ".join(
+            child
+            for child in ele.children
+            if type(child) is NavigableString  # Not comments or CDATA.
+        )
+        elements.append((bp_id, encode_element(ele.name, ele.attrs, text, max_tokens)))
+    return elements
+
+
+class ElementStore:
+    """Keeps cleaned, embedded elements for every frame of the current page.
+
+    Every element is stamped with a `data-bp-id`, so that a hit in the index
+    maps straight back to a live element. Elements are kept as the one-line
+    encoding from `encode_element`, which is what gets compared, embedded and
+    shown to the LLM, and the page as a whole is capped at `max_page_tokens`
+    (elements past it are kept in `pending` and added once others go away).
+    The first sync in a document serializes the whole document. After that,
+    an injected MutationObserver tracks which subtrees are dirty, and only
+    those are re-cleaned, re-hashed and re-embedded. Everything else is kept
+    as is. A navigation gives the frame a fresh document, which resets its
+    entries.
+    """
+
+    def __init__(
+        self,
+        metrics=None,
+        max_element_tokens=MAX_ELEMENT_TOKENS,
+        max_page_tokens=MAX_PAGE_TOKENS,
+    ):
+        self.metrics = metrics or REGISTRY
+        self.max_element_tokens = max_element_tokens
+        self.max_page_tokens = max_page_tokens
+        self.tokens = 0  # Estimated tokens of all entries.
+        self.pending = {}  # Node id => node left out by the page budget.
+        self._index = None  # Built on first use, to defer llama_index.
+        self.entries = {}  # Frame key => {bp_id: element string}.
+        self.iframes = {}  # Frame key => iframe WebElement (None for top).
+
+    @property
+    def index(self):
+        if self._index is None:
+            from llama_index.core import GPTVectorStoreIndex
+
+            self._index = GPTVectorStoreIndex(nodes=[])
+        return self._index
+
+    def __len__(self):
+        return sum(len(entries) for entries in self.entries.values())
+
+    def reset(self):
+        """Forget everything, e.g. when the driver is pointed elsewhere."""
+        for key in list(self.entries):
+            self._drop_frame(key)
+
+    def sync(self, driver):
+        """Bring the store up to date with the page in `driver`."""
+        seen = set([TOP_FRAME_KEY])
+        self._sync_frame(driver, TOP_FRAME_KEY, None)
+        iframes = driver.find_elements(by=By.TAG_NAME, value="iframe")
+        for iframe in iframes:
+            key = iframe.id
+            seen.add(key)
+            driver.switch_to.frame(iframe)
+            self._sync_frame(driver, key, iframe)
+            driver.switch_to.default_content()
+
+        # Drop iframes which are gone.
+        for key in list(self.entries):
+            if key not in seen:
+                self._drop_frame(key)
+
+    def retrieve(self, description, similarity_top_k=5):
+        """Returns the ids of the nodes most similar to `description`, using
+        embeddings only (no LLM call)."""
+        if not len(self):
+            return []
+        retriever = self.index.as_retriever(similarity_top_k=similarity_top_k)
+        count_embeddings(self.metrics, "element_query")
+        return [result.node.node_id for result in retriever.retrieve(description)]
+
+    def locate(self, driver, node_id):
+        """Returns the live WebElement and its iframe for a node returned by
+        the index, using the id we stamped on it. The element is None if it
+        is gone from the page."""
+        key, bp_id = node_id.rsplit(":", 1)
+        iframe = self.iframes[key]
+        try:
+            if iframe is not None:
+                driver.switch_to.frame(iframe)
+            elements = driver.find_elements(
+                By.CSS_SELECTOR, f'[{BP_ID_ATTRIBUTE}="{bp_id}"]'
+            )
+        except WebDriverException:
+            elements = []  # E.g. the iframe is stale.
+        finally:
+            driver.switch_to.default_content()
+        return (elements[0] if elements else None), iframe
+
+    def get(self, node_id):
+        """Returns the element string and the iframe it came from for a node
+        returned by the index."""
+        key, bp_id = node_id.rsplit(":", 1)
+        return self.entries[key][bp_id], self.iframes[key]
+
+    def _sync_frame(self, driver, key, iframe):
+        snapshot = driver.execute_script(OBSERVER_SCRIPT, BP_ID_ATTRIBUTE)
+        if snapshot["full"]:
+            logger.debug(f"Full snapshot of frame {key}.")
+            self._drop_frame(key)
+        self.iframes[key] = iframe
+
+        entries = self.entries.setdefault(key, {})
+        # Pending elements that are gone must not be added later either.
+        self._remove(key, snapshot["removed"])
+
+        html_fragments = snapshot["subtrees"] + snapshot["shallow"]
+        if not html_fragments and not self.pending:
+            return
+
+        updated = {}
+        for html_string in html_fragments:
+            soup = clean_html(html_string, keep_bp_id=True)
+            for bp_id, text in get_elements_for_llm(soup, self.max_element_tokens):
+                if bp_id is not None:
+                    updated[bp_id] = text
+
+        from llama_index.core.schema import TextNode
+
+        stale, nodes = [], []
+        for bp_id, text in updated.items():
+            self.pending.pop(f"{key}:{bp_id}", None)  # Superseded.
+            if entries.get(bp_id) == text:
+                continue  # Unchanged, no need to re-embed.
+            if bp_id in entries:
+                stale.append(bp_id)
+            if text is not None:
+                nodes.append(TextNode(text=text, id_=f"{key}:{bp_id}"))
+
+        self._remove(key, stale)
+        self._insert(self._within_budget(nodes), "element_store")
+        logger.debug(
+            f"Frame {key}: {len(nodes)} elements embedded, {len(entries)} total."
+        )
+
+    def _within_budget(self, nodes):
+        """The nodes left out before, then `nodes`, that fit in what is left
+        of the page budget. The rest are kept in `pending`, to be tried again
+        on the next sync, e.g. once other elements are gone."""
+        candidates = dict(self.pending)
+        candidates.update((node.node_id, node) for node in nodes)
+        kept, left_out = [], {}
+        tokens = self.tokens
+        for node_id, node in candidates.items():
+            if self.max_page_tokens is not None:
+                if tokens + estimate_tokens(node.text) > self.max_page_tokens:
+                    left_out[node_id] = node
+                    continue
+            tokens += estimate_tokens(node.text)
+            kept.append(node)
+        new = len([node_id for node_id in left_out if node_id not in self.pending])
+        self.pending = left_out
+        if new:
+            logger.info(
+                f"Page is over {self.max_page_tokens} tokens. Leaving out "
+                f"{new} more elements until there is room."
+            )
+            self.metrics.counter(
+                "browserpilot_elements_over_budget_total",
+                "Elements left out of the element store by the page token budget.",
+            ).inc(new)
+        return kept
+
+    def _insert(self, nodes, source):
+        if not nodes:
+            return
+        self.index.insert_nodes(nodes)
+        count_embeddings(self.metrics, source, len(nodes))
+        for node in nodes:
+            key, bp_id = node.node_id.rsplit(":", 1)
+            self.entries.setdefault(key, {})[bp_id] = node.text
+            self.tokens += estimate_tokens(node.text)
+
+    def _pending_bp_ids(self, key):
+        return [
+            node_id.rsplit(":", 1)[1]
+            for node_id in self.pending
+            if node_id.rsplit(":", 1)[0] == key
+        ]
+
+    def _remove(self, key, bp_ids):
+        for bp_id in bp_ids:
+            self.pending.pop(f"{key}:{bp_id}", None)
+        entries = self.entries.get(key, {})
+        bp_ids = [bp_id for bp_id in set(bp_ids) if bp_id in entries]
+        if not bp_ids:
+            return
+        self.index.delete_nodes(
+            [f"{key}:{bp_id}" for bp_id in bp_ids], delete_from_docstore=True
+        )
+        for bp_id in bp_ids:
+            self.tokens -= estimate_tokens(entries.pop(bp_id))
+
+    def _drop_frame(self, key):
+        self._remove(key, list(self.entries.get(key, {})) + self._pending_bp_ids(key))
+        self.entries.pop(key, None)
+        self.iframes.pop(key, None)
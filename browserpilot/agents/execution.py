@@ -0,0 +1,196 @@
+"""Statement-level execution of generated code, so that a failed block can be
+resumed from the failing statement instead of replayed from the top."""
+import ast
+import inspect
+import traceback
+
+from selenium.common.exceptions import (
+    InvalidSessionIdException,
+    NoSuchWindowException,
+    SessionNotCreatedException,
+    WebDriverException,
+)
+from urllib3.exceptions import HTTPError as Urllib3HTTPError
+
+EXEC_FILENAME = "<string>"  # Same as `exec` on a string.
+# Exceptions that mean the session (or the node) died, rather than the code.
+DEAD_SESSION_EXCEPTIONS = (
+    InvalidSessionIdException,
+    NoSuchWindowException,
+    SessionNotCreatedException,
+    ConnectionError,
+    Urllib3HTTPError,
+)
+DEAD_SESSION_MESSAGES = [
+    "invalid session id",
+    "session deleted",
+    "no such session",
+    "chrome not reachable",
+    "disconnected",
+]
+
+
+def is_dead_session(exc):
+    """Whether `exc`, or any exception it was raised from or while handling,
+    means that the browser session went away."""
+    seen = set()
+    while exc is not None and id(exc) not in seen:
+        seen.add(id(exc))
+        if isinstance(exc, DEAD_SESSION_EXCEPTIONS):
+            return True
+        if isinstance(exc, WebDriverException):
+            message = str(exc).lower()
+            if any(dead in message for dead in DEAD_SESSION_MESSAGES):
+                return True
+        exc = exc.__cause__ or exc.__context__
+    return False
+
+
+class StatementFailure:
+    """What we know about the statement that failed."""
+
+    def __init__(self, code, statements, index, exc):
+        self.code = code
+        self.index = index
+        self.exception = exc
+        self.statement = statements[index] if statements else code
+        self.completed_code = "\n".join(statements[:index])
+        self.remaining_code = "\n".join(statements[index:]) if statements else code
+
+        # Only keep the part of the trace from the generated code down.
+        frames = traceback.extract_tb(exc.__traceback__)
+        filenames = [frame.filename for frame in frames]
+        if EXEC_FILENAME in filenames:
+            frames = frames[filenames.index(EXEC_FILENAME):]
+        else:
+            frames = []  # E.g. a SyntaxError, which carries its own location.
+        self.line_num = frames[0].lineno if frames else None
+        self.traceback = "".join(
+            traceback.format_list(frames)
+            + traceback.format_exception_only(type(exc), exc)
+        )
+
+
+class StatementExecutor:
+    """Runs generated code one top-level statement at a time in a persistent
+    `namespace`, which holds `env` and everything the code defines.
+
+    The code runs with `namespace` as both its globals and its locals, like a
+    module, so that functions and lambdas it defines can see `env` and each
+    other. `namespace` is checkpointed before each statement and restored if
+    the statement raises, so that it always reflects the statements that
+    finished. On failure, `run` returns a StatementFailure with the code that
+    completed and the code that is left, rather than raising.
+
+    `after_block` is called (and awaited, in `arun`, if it returns a
+    coroutine) at the end of every block, e.g. to perform batched actions,
+    with the index of the statement that failed, or None. While a statement
+    runs, its index in the block is `index`. An exception with a
+    `statement_index` (e.g. an ActionBatchError, raised by a later
+    statement or by `after_block`) is blamed on that earlier statement.
+    """
+
+    def __init__(self, namespace, after_block=None):
+        self.namespace = namespace
+        self.after_block = after_block
+        self.index = None  # Of the statement being run, in its block.
+        self.completed = []  # Statements that finished, across blocks.
+
+    def run(self, code):
+        tree, statements, failure = self._parse(code)
+        if failure is not None:
+            return failure
+
+        checkpoints = []
+        failed, error = None, None
+        for index, node in enumerate(tree.body):
+            checkpoints.append(dict(self.namespace))
+            self.index = index
+            try:
+                exec(self._compile(node), self.namespace)
+            except Exception as exc:
+                failed, error = _blame(exc, index), exc
+                break
+        self.index = None
+
+        if self.after_block is not None:
+            try:
+                self.after_block(failed)
+            except Exception as exc:
+                failed, error = _blame(exc, _last(failed, checkpoints)), exc
+        return self._finish(code, statements, checkpoints, failed, error)
+
+    async def arun(self, code, transformer=None):
+        """Like `run`, but statements may `await`, e.g. at the top level.
+        `transformer` (an ast.NodeTransformer) rewrites each statement
+        before it is compiled."""
+        tree, statements, failure = self._parse(code)
+        if failure is not None:
+            return failure
+
+        checkpoints = []
+        failed, error = None, None
+        for index, node in enumerate(tree.body):
+            checkpoints.append(dict(self.namespace))
+            self.index = index
+            try:
+                if transformer is not None:
+                    node = ast.fix_missing_locations(transformer.visit(node))
+                compiled = self._compile(node, flags=ast.PyCF_ALLOW_TOP_LEVEL_AWAIT)
+                result = eval(compiled, self.namespace)
+                if inspect.iscoroutine(result):
+                    await result
+            except Exception as exc:
+                failed, error = _blame(exc, index), exc
+                break
+        self.index = None
+
+        if self.after_block is not None:
+            try:
+                result = self.after_block(failed)
+                if inspect.iscoroutine(result):
+                    await result
+            except Exception as exc:
+                failed, error = _blame(exc, _last(failed, checkpoints)), exc
+        return self._finish(code, statements, checkpoints, failed, error)
+
+    def _finish(self, code, statements, checkpoints, failed, error):
+        if failed is None:
+            self.completed.extend(statements)
+            return None
+        if checkpoints:
+            self.namespace.clear()
+            self.namespace.update(checkpoints[failed])
+        self.completed.extend(statements[:failed])
+        return StatementFailure(code, statements, failed, error)
+
+    def _parse(self, code):
+        """Returns the tree of `code` and the source of each top-level
+        statement, or a StatementFailure if it doesn't parse."""
+        try:
+            tree = ast.parse(code, filename=EXEC_FILENAME)
+        except SyntaxError as exc:
+            return None, [], StatementFailure(code, [], 0, exc)
+        statements = [ast.get_source_segment(code, node) for node in tree.body]
+        return tree, statements, None
+
+    def _compile(self, node, flags=0):
+        # Keep the original line numbers, so that the line in a trace matches
+        # the line in `code`.
+        return compile(
+            ast.Module(body=[node], type_ignores=[]), EXEC_FILENAME, "exec", flags=flags
+        )
+
+
+def _blame(exc, index):
+    """The index of the statement to blame `exc` on, raised while statement
+    `index` ran."""
+    blamed = getattr(exc, "statement_index", None)
+    if isinstance(blamed, int) and 0 <= blamed < index:
+        return blamed
+    return index
+
+
+def _last(failed, checkpoints):
+    """The statement that failed, or else the last one of the block."""
+    return failed if failed is not None else max(len(checkpoints) - 1, 0)
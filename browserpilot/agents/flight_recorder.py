@@ -0,0 +1,174 @@
+"""Always-on, bounded record of the agent's recent actions, dumped to disk
+when something goes wrong."""
+import json
+import logging
+import os
+import tempfile
+import time
+import uuid
+import zlib
+from collections import deque
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+MAX_TEXT_LENGTH = 500  # Of instructions, statements and arguments.
+MAX_MUTATIONS = 100  # Per action.
+MAX_PAGE_MUTATIONS = 1000  # Per page, when only drained on dumps.
+DEFAULT_FOLDER = os.path.join(tempfile.gettempdir(), "browserpilot_flight_recorder")
+
+# Installs a MutationObserver that keeps a compact summary of every DOM change
+# (kind, target, and attribute or number of nodes added/removed), and drains
+# it. Much cheaper than serializing the page after every action.
+RECORDER_SCRIPT = """
+var MAX = arguments[0];
+var rec = window.__bpRecorder;
+var navigated = !rec || rec.doc !== document;
+if (navigated) {
+    rec = window.__bpRecorder = {doc: document, log: [], dropped: 0};
+    var describe = function (n) {
+        if (!n || n.nodeType !== 1) {
+            return n ? n.nodeName : '';
+        }
+        var s = n.tagName.toLowerCase();
+        if (n.id) {
+            s += '#' + n.id;
+        } else if (typeof n.className === 'string' && n.className) {
+            s += '.' + n.className.trim().split(/\\s+/)[0];
+        }
+        return s;
+    };
+    new MutationObserver(function (records) {
+        for (var i = 0; i < records.length; i++) {
+            if (rec.log.length >= MAX) {
+                rec.dropped += records.length - i;
+                return;
+            }
+            var r = records[i];
+            if (r.type === 'attributes') {
+                if (r.attributeName === 'data-bp-id') {
+                    continue;
+                }
+                rec.log.push(['a', describe(r.target), r.attributeName]);
+            } else if (r.type === 'childList') {
+                rec.log.push(['c', describe(r.target), r.addedNodes.length, r.removedNodes.length]);
+            } else {
+                rec.log.push(['t', describe(r.target.parentNode)]);
+            }
+        }
+    }).observe(document.documentElement, {
+        subtree: true, childList: true, attributes: true, characterData: true
+    });
+}
+var result = {url: location.href, navigated: navigated, mutations: rec.log, dropped: rec.dropped};
+rec.log = [];
+rec.dropped = 0;
+return result;
+"""
+
+
+def _truncate(text, length=MAX_TEXT_LENGTH):
+    text = str(text)
+    return text if len(text) <= length else text[:length] + "..."
+
+
+class FlightRecorder:
+    """Ring buffer of the last `capacity` actions.
+
+    Each entry holds the instruction block, the statement being executed, the
+    action and its arguments, its duration and the URL. Memory is capped
+    both by the number of entries and by the total size of the compressed
+    DOM diffs.
+
+    Recording an action costs no round trip to the browser. With
+    `dom_diffs`, each action that changes the page also gets a
+    zlib-compressed summary of the DOM mutations it caused, which costs one
+    round trip per such action. Without it, the mutation observer is only
+    installed when a page is loaded (`watch`), and drained once when the
+    recorder is dumped (`drain_page`).
+    """
+
+    def __init__(self, capacity=50, max_bytes=1_000_000, dom_diffs=False):
+        self.capacity = capacity
+        self.max_bytes = max_bytes
+        self.dom_diffs = dom_diffs
+        self.entries = deque()
+        self.bytes = 0
+        self.depth = 0  # To only record the outermost action.
+        self.url = None
+
+    def __len__(self):
+        return len(self.entries)
+
+    @property
+    def enabled(self):
+        return self.capacity > 0
+
+    def drain_dom(self, driver, max_mutations=MAX_MUTATIONS):
+        """Returns the URL and the compressed DOM mutations since the last
+        call. Costs one round trip."""
+        result = driver.execute_script(RECORDER_SCRIPT, max_mutations)
+        self.url = result["url"]
+        diff = {
+            "navigated": result["navigated"],
+            "mutations": result["mutations"],
+            "dropped": result["dropped"],
+        }
+        return self.url, zlib.compress(json.dumps(diff).encode("utf-8"))
+
+    def watch(self, driver):
+        """Start observing the page that was just loaded, without per-action
+        DOM diffs. Returns its URL."""
+        url, _ = self.drain_dom(driver, MAX_PAGE_MUTATIONS)
+        return url
+
+    def drain_page(self, driver):
+        """The DOM mutations since the page was loaded (or last drained), for
+        a dump without per-action DOM diffs."""
+        _, dom_diff = self.drain_dom(driver, MAX_PAGE_MUTATIONS)
+        return json.loads(zlib.decompress(dom_diff))
+
+    def record(
+        self,
+        action,
+        args,
+        duration,
+        instruction=None,
+        statement=None,
+        url=None,
+        dom_diff=None,
+        error=None,
+    ):
+        entry = {
+            "time": time.time(),
+            "instruction": _truncate(instruction) if instruction else None,
+            "statement": _truncate(statement) if statement else None,
+            "action": action,
+            "args": [_truncate(repr(arg), 100) for arg in args],
+            "duration": duration,
+            "url": url or self.url,
+            "dom_diff": dom_diff,
+            "error": _truncate(error) if error else None,
+        }
+        self.entries.append(entry)
+        self.bytes += len(dom_diff or b"")
+        while self.entries and (
+            len(self.entries) > self.capacity or self.bytes > self.max_bytes
+        ):
+            evicted = self.entries.popleft()
+            self.bytes -= len(evicted["dom_diff"] or b"")
+
+    def to_json(self, **extra):
+        """Serialize the entries, decompressing the DOM diffs."""
+        entries = []
+        for entry in self.entries:
+            entry = dict(entry)
+            if entry["dom_diff"] is not None:
+                entry["dom_diff"] = json.loads(zlib.decompress(entry["dom_diff"]))
+            entries.append(entry)
+        return json.dumps(dict(extra, entries=entries), indent=2)
+
+    def dump_filename(self, folder):
+        timestamp = time.strftime("%Y%m%d-%H%M%S")
+        suffix = uuid.uuid4().hex[:8]  # Several dumps can happen in a second.
+        return os.path.join(folder, f"flight_recorder_{timestamp}_{suffix}.json")
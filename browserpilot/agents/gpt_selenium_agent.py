@@ -1,25 +1,58 @@
 """GPT Selenium Agent abstraction."""
-import pdb
+import functools
+import json
 import os
-import re
 import sys
 import time
-import traceback
-from bs4 import BeautifulSoup
-from bs4.element import NavigableString
-from bs4.element import Tag
-from llama_index.core import Document, GPTVectorStoreIndex
+import uuid
 from selenium import webdriver
+from selenium.common.exceptions import WebDriverException
 from selenium.webdriver.chrome.service import Service
 from selenium.webdriver.common.by import By
 from selenium.webdriver.common.keys import Keys
 from selenium.webdriver.common.action_chains import ActionChains
 from selenium.webdriver.support.relative_locator import locate_with
 from .compilers.instruction_compiler import InstructionCompiler
-from .memories import Memory
+from .compilers.model_router import ModelRouter
+from .element_store import ElementStore, clean_html
+from .accessibility import PAGE_REPRESENTATIONS, AccessibilityStore
+from .action_batch import ActionBatch
+from .static_fetch import StaticFetcher
+from .page_models import make_page_model
+from .execution import StatementExecutor, is_dead_session
+from .flight_recorder import DEFAULT_FOLDER, FlightRecorder
+from .capture import CapturePipeline, capture_full_page
+from .metrics import (
+    COUNT_BUCKETS,
+    REGISTRY,
+    instrument_driver,
+    record_sleep,
+)
+from .load_profiles import NetworkController, configure_chrome_options
 
 
 TIME_BETWEEN_ACTIONS = 0.01
+# Actions that are queued instead of performed when batching.
+BATCHED_ACTIONS = ["click", "send_keys"]
+
+# Actions that can run on a page fetched without the browser. Any other
+# action loads the page in the browser first.
+STATIC_ACTIONS = [
+    "get",
+    "get_many",
+    "map_pages",
+    "get_text_from_page",
+    "retrieve_information",
+    "get_llm_response",
+    "query_memory",
+    "wait",
+    "save",
+]
+
+# Starts loading a URL in the current tab without waiting for it. The flag
+# tells the old document, which is still there for a while, from the new one.
+NAVIGATE_SCRIPT = "window.__bpNavigating = true; window.location.href = arguments[0];"
+IS_LOADED_SCRIPT = "return !window.__bpNavigating && document.readyState === 'complete';"
 
 import logging
 
@@ -57,6 +90,25 @@ class GPTSeleniumAgent:
         instruction_output_file=None,
         close_after_completion=True,
         remote_url=None, 
+        page_model="auto",
+        load_profile="default",
+        capture_workers=2,
+        capture_max_width=None,
+        capture_compression=None,
+        flight_recorder_size=50,
+        flight_recorder_folder=None,
+        flight_recorder_dom_diffs=False,
+        model_tiers=None,
+        memory_namespace=None,
+        memory_capacity=None,
+        memory_eviction="lru",
+        memory_ttl=None,
+        memory_max_namespaces=None,
+        metrics=None,
+        metrics_output_file=None,
+        page_representation="html",
+        batch_actions=False,
+        static_fetch=False,
     ):
         """Initialize the agent.
 
@@ -83,6 +135,66 @@ class GPTSeleniumAgent:
                 instructions should be saved.
             close_after_completion (bool): Whether to close the browser after
                 the instructions have been executed.
+            remote_url (str): URL of a Selenium Grid to run the browser on,
+                instead of a local chromedriver.
+            page_model (str): How to read the page. "cdp" uses the Chrome
+                DevTools Protocol to snapshot all frames at once, "webdriver"
+                uses plain WebDriver commands, and "auto" picks "cdp" when the
+                driver supports it.
+            load_profile (str): Which resources to block while loading pages,
+                one of "default", "no-media", "text-only" or
+                "first-party-only". Can be overridden per `get`.
+            capture_workers (int): Number of background threads that encode
+                and write screenshots and debug snapshots.
+            capture_max_width (int): Downscale screenshots wider than this.
+            capture_compression (str): Compress screenshots and debug
+                snapshots with "gzip" or "zstd".
+            flight_recorder_size (int): How many recent actions to keep in
+                memory, to be dumped when an action fails. 0 disables it.
+            flight_recorder_folder (str): Path to the folder where the
+                recent actions are dumped when an action fails. Defaults to
+                a folder in the system's temporary directory.
+            flight_recorder_dom_diffs (bool): Whether to record the DOM
+                mutations of each action that changes the page, which costs
+                a round trip per action. By default, the mutations since the
+                last page load are only read when dumping.
+            model_tiers (list): If given, route each block of instructions to
+                a tier of models based on its complexity and measured
+                latency, instead of always using `model_for_instructions`.
+                See `DEFAULT_TIERS` in `compilers/model_router.py`.
+            memory_namespace (str or callable): Which memory namespace a page
+                goes into. "domain" for the domain of the page, a callable
+                that takes the URL, or any other string for a single named
+                namespace (e.g. per job). None for one shared namespace.
+            memory_capacity (int): Maximum number of pages per namespace.
+            memory_eviction (str): "lru" (least recently retrieved), "fifo"
+                (oldest first) or "ttl" (older than `memory_ttl` seconds).
+            memory_ttl (float): Seconds to keep pages for, with "ttl".
+            memory_max_namespaces (int): Maximum number of namespaces; the
+                least recently used is deleted.
+            metrics (MetricsRegistry): Where to count LLM calls, embeddings,
+                WebDriver commands and sleeps. Defaults to the registry shared
+                by the whole process.
+            metrics_output_file (str): Path to dump the metrics to when the
+                agent is done, as JSON if it ends with .json, else in the
+                Prometheus text format.
+            page_representation (str): What `ask_llm_to_find_element` and
+                `retrieve_information` see of the page. "html" uses cleaned
+                HTML elements, "accessibility" uses the accessibility tree
+                (role, name and state per node), which is much smaller but
+                needs CDP; it falls back to "html" without it.
+            batch_actions (bool): Whether to queue consecutive `click` and
+                `send_keys` calls on elements in the same frame and perform
+                them as one Actions request, with one frame switch. The
+                queue is performed at the end of every block of generated
+                code and before anything else touches the browser. An error
+                in it is blamed on the statement that queued the action.
+            static_fetch (bool): Whether `get` should first try fetching the
+                page over plain HTTP, with the browser's cookies. If the page
+                doesn't look like it needs JavaScript, reading its text
+                (`get_text_from_page`, `retrieve_information`, memory) skips
+                the browser. The page is loaded in the browser when anything
+                else needs it, e.g. the first `find_element` or `click`.
         """
         """Helpful instance variables."""
         assert (
@@ -90,6 +202,9 @@ class GPTSeleniumAgent:
             or instruction_output_file.endswith(".yaml")
             or instruction_output_file.endswith(".json")
         ), "Instruction output file must be a YAML or JSON file or None."
+        assert (
+            page_representation in PAGE_REPRESENTATIONS
+        ), f"Invalid page representation: {page_representation}"
         assert (
             (chromedriver_path is not None) ^ (remote_url is not None) # XOR
         ), "Please provide a path to the chromedriver executable or Selenium Grid target"
@@ -104,18 +219,51 @@ class GPTSeleniumAgent:
         self.memory_folder = memory_folder
         self.close_after_completion = close_after_completion
         self.remote_url = remote_url
+        self.flight_recorder_folder = flight_recorder_folder or DEFAULT_FOLDER
+        self.metrics = metrics or REGISTRY
+        self.metrics_output_file = metrics_output_file
+        self.batch_actions = batch_actions
+        self.webdriver_commands = 0  # Sent by this agent, for per-action counts.
+        self.tabs = []  # Window handles kept for `get_many` and `map_pages`.
+        self.current_instruction = None  # The block being executed.
+        self.current_action = None  # The code being executed.
+        self.executor = None  # Running the generated code, if any.
 
         """Fire up the compiler."""
         self.instruction_compiler = InstructionCompiler(
             instructions=instructions,
             model=self.model_for_instructions,
+            model_router=ModelRouter(model_tiers) if model_tiers else None,
+            metrics=self.metrics,
         )
 
         """Set up the memory."""
         self.memory = None
         if self.memory_folder:
             logger.info("Enabling memory.")
-            self.memory = Memory(memory_folder=self.memory_folder)
+            from .memories import NamespacedMemory
+
+            self.memory = NamespacedMemory(
+                memory_folder=self.memory_folder,
+                namespace=memory_namespace,
+                capacity=memory_capacity,
+                eviction=memory_eviction,
+                ttl=memory_ttl,
+                max_namespaces=memory_max_namespaces,
+                metrics=self.metrics,
+            )
+
+        """Set up the pipeline that writes screenshots and snapshots."""
+        self.capture = CapturePipeline(
+            workers=capture_workers,
+            max_width=capture_max_width,
+            compression=capture_compression,
+        )
+
+        """Set up the flight recorder."""
+        self.flight_recorder = FlightRecorder(
+            capacity=flight_recorder_size, dom_diffs=flight_recorder_dom_diffs
+        )
 
         """Set up the driver."""
         _chrome_options = webdriver.ChromeOptions()
@@ -133,6 +281,7 @@ class GPTSeleniumAgent:
                 _chrome_options.add_argument(f"{option}")
             else: 
                 _chrome_options.add_argument(f"{option}={chrome_options[option]}")
+        configure_chrome_options(_chrome_options, load_profile, cdp=not remote_url)
 
         # Check if remote_url is set and conditionally set the driver to a remote endpoint
         if remote_url:
@@ -141,11 +290,38 @@ class GPTSeleniumAgent:
             # Instantiate Service with the path to the chromedriver and the options.
             service = Service(chromedriver_path)
             self.driver = webdriver.Chrome(service=service, options=_chrome_options )
+        self.action_batch = ActionBatch(self.driver, pause=TIME_BETWEEN_ACTIONS)
+        self.static_fetcher = None
+        if static_fetch:
+            self.static_fetcher = StaticFetcher(self.driver, metrics=self.metrics)
+        self.static_page = None  # Fetched by `get`, not in the browser yet.
+        self.static_load_profile = None
+        instrument_driver(self.driver, self.__count_command)
         # 🤫 Evade detection.
         self.driver.execute_script("Object.defineProperty(navigator, 'webdriver', {get: () => undefined})")
 
+        """Set up the page model."""
+        self.page_model = make_page_model(self.driver, page_model)
+
+        """Set up the network load profile."""
+        self.network = NetworkController(self.driver, load_profile)
+
+        """Set up the store of page elements for `ask_llm_to_find_element`."""
+        if page_representation == "accessibility" and not hasattr(
+            self.driver, "execute_cdp_cmd"
+        ):
+            logger.warning("The accessibility tree needs CDP. Using HTML instead.")
+            page_representation = "html"
+        self.page_representation = page_representation
+        self.element_store = self.__make_element_store()
+
     """Helper functions"""
 
+    def __make_element_store(self):
+        if self.page_representation == "accessibility":
+            return AccessibilityStore(metrics=self.metrics)
+        return ElementStore(metrics=self.metrics)
+
     def _check_danger(self, action_str):
         """Check that the action is not dangerous. If so, just quit."""
         if self._is_potentially_dangerous(action_str):
@@ -173,81 +349,72 @@ class GPTSeleniumAgent:
 
         return False
 
-    def _remove_blacklisted_elements_and_attributes(self) -> BeautifulSoup:
+    def _remove_blacklisted_elements_and_attributes(self) -> "BeautifulSoup":
         """Clean HTML to remove blacklisted elements and attributes. Returns
         BeautifulSoup object."""
-        blacklisted_elements = set(
-            [
-                "head",
-                "title",
-                "meta",
-                "script",
-                "style",
-                "path",
-                "svg",
-                "br",
-                "::marker",
-            ]
-        )
-        blacklisted_attributes = set(
-            ["style", "ping", "src", "item*", "aria*", "js*", "data-*"]
-        )
-
         # Get the HTML tag for the entire page, convert into BeautifulSoup.
         html = self.driver.find_element(By.TAG_NAME, "html")
         html_string = html.get_attribute("outerHTML")
-        soup = BeautifulSoup(html_string, "html.parser")
-
-        # Remove blacklisted items and attributes in it.
-        for blacklisted in blacklisted_elements:
-            for tag in soup.find_all(blacklisted):
-                tag.decompose()
+        return clean_html(html_string)
 
-        # Set up a helper function to delete the blacklisted attributes from
-        # a tag, as long as the attribute name matches the regex.
-        def remove_blacklisted_attributes(tag, blacklisted_attributes):
-            for attr in tag.attrs.copy():
-                for pattern in blacklisted_attributes:
-                    if re.match(pattern, attr):
-                        del tag[attr]
-
-        for tag in soup.find_all(True):
-            remove_blacklisted_attributes(tag, blacklisted_attributes)
-
-        return soup
-
-    def __get_html_elements_for_llm(self):
-        """Returns list of BeautifulSoup elements for use in GPT Index.
-
-        First removes blacklisted elements and attributes, then removes any
-        children of elements. Finally, removes any elements with no attrs.
-        """
-        soup = self._remove_blacklisted_elements_and_attributes()
-        # Remove children of elements that have children.
-        elements = soup.find_all()
-        [ele.clear() if ele.contents else ele for ele in elements if ele.contents]
-        # Then remove any elements that do not have attributes, e.g., <p></p>.
-        elements = [ele for ele in elements if ele.attrs]
-        return elements
-
-    def __complete(self):
+    def _complete(self):
         """What to run when the agent is done."""
+        self.static_page = None  # Nothing is going to need it in the browser.
+        self.flush_actions()
+        self.capture.flush()
+        if self.instruction_compiler.model_router is not None:
+            logger.info(
+                f"Model routing: {self.instruction_compiler.model_router.report()}"
+            )
+
         if self.memory_folder:
             self.memory.save(self.memory_folder)
 
+        if self.metrics_output_file:
+            self.metrics.dump(self.metrics_output_file)
+
         if self.close_after_completion:
             self.driver.quit()
 
     def __run_compiled_instructions(self, instructions):
         """Runs Python code previously compiled by InstructionCompiler."""
-        ldict = {"env": self}
-        self._check_danger(instructions)
-        try:
-            exec(instructions, globals(), ldict)
-        except:
-            self.__handle_agent_exception(instructions)
+        executor = self.__make_executor()
+        instruction = "\n".join(self.instruction_compiler.instructions["instructions"])
+        self.__run_action(executor, instruction, instructions)
 
-        self.__complete()
+        self._complete()
+
+    def __make_executor(self):
+        """A StatementExecutor for generated code, which performs the batched
+        actions at the end of each block."""
+        self.executor = StatementExecutor(
+            self.__namespace(), after_block=self._finish_block
+        )
+        return self.executor
+
+    def __namespace(self):
+        """The namespace generated code runs in: this module's globals (e.g.
+        `By`, `Keys`) and `env`."""
+        namespace = dict(globals())
+        namespace["env"] = self
+        return namespace
+
+    def __run_action(self, executor, instruction, action):
+        """Run `action` statement by statement. If a statement fails, ask the
+        LLM for the code from that statement onward (if retrying) and resume
+        from there, without repeating the statements that succeeded."""
+        attempts = 0
+        while attempts < 3:
+            attempts = attempts + 1
+            action = action.replace("```", "")
+            self._check_danger(action)
+            self.current_instruction = instruction
+            self.current_action = action
+            failure = executor.run(action)
+            if failure is None:
+                return
+            action = self.__handle_agent_exception(failure)
+        logger.warning(f"Giving up on instruction after {attempts} attempts.")
 
     def __print_instruction_and_action(self, instruction, action):
         """Logging the instruction and action."""
@@ -255,122 +422,167 @@ class GPTSeleniumAgent:
         info_str = info_str + f"\nAction: {action}\n"
         logger.info(info_str)
 
-    def __get_relevant_part_of_stack_trace(self):
-        """Get the relevant part of the stack trace."""
-        original_stack_trace = traceback.format_exc()
-        stack_trace = original_stack_trace.split("\n")[3:5]
-        stack_trace = "\n".join(stack_trace)
-        # Get the name of this class (GPTSeleniumAgent) and
-        # replace it with "env".
-        class_name = self.__class__.__name__
-        stack_trace = stack_trace.replace(class_name, "env")
-        # Get the number after the word "line " in the stack trace.
-        everything_after_line = stack_trace.split("line ")[1]
-        everything_before_rest = everything_after_line.split(",")[0]
-        line_num_str = everything_before_rest.split()[0].strip()
-        line_num = int(line_num_str)
-        return {"stack_trace": stack_trace, "line_num": line_num}
-
     def __save_html_snapshot(self):
-        """Helpful for debugging."""
-        # Check if the folder exists, and if not, create it.
-        if not os.path.exists(self.debug_html_folder):
-            os.makedirs(self.debug_html_folder)
-
+        """Helpful for debugging. The HTML and screenshots are grabbed here,
+        and written in the background by the capture pipeline."""
         # Save an HTML of the entire page.
         debug_name = "debug.html"
         debug_name = os.path.join(self.debug_html_folder, debug_name)
-
-        html = self.driver.page_source
-        with open(debug_name, "w+") as f:
-            f.write(html)
+        self.capture.submit_text(self.driver.page_source, debug_name)
 
         # Save a screenshot of the entire page.
         screenshot_name = "debug.png"
         screenshot_name = os.path.join(self.debug_html_folder, screenshot_name)
-        self.driver.save_screenshot(screenshot_name)
+        self.capture.submit_image(capture_full_page(self.driver), screenshot_name)
 
-        # Save screenshots and HTML from each iframe.
+        # Save HTML from each iframe.
         iframes = self.driver.find_elements(by=By.TAG_NAME, value="iframe")
         for i, iframe in enumerate(iframes):
-            screenshot_name = f"debug_{i}.png"
-            screenshot_name = os.path.join(self.debug_html_folder, screenshot_name)
-            # iframe.screenshot(screenshot_name)
             iframe_debug_name = f"debug_{i}.html"
             iframe_debug_name = os.path.join(self.debug_html_folder, iframe_debug_name)
-            with open(iframe_debug_name, "w+") as f:
-                self.driver.switch_to.frame(iframe)
-                f.write(self.driver.page_source)
+            self.driver.switch_to.frame(iframe)
+            self.capture.submit_text(self.driver.page_source, iframe_debug_name)
             self.driver.switch_to.default_content()
         self.driver.switch_to.default_content()
 
-    def __handle_agent_exception(self, action):
-        """To be used in a try/except block to handle exceptions."""
-        stack_trace_result = self.__get_relevant_part_of_stack_trace()
-        stack_trace = stack_trace_result["stack_trace"]
-        line_num = stack_trace_result["line_num"]
+    def __dump_flight_recorder(self, stack_trace):
+        """Write the recent actions to disk, in the background."""
+        recorder = self.flight_recorder
+        if not (recorder.enabled and len(recorder)):
+            return
+        extra = {"traceback": stack_trace}
+        if not recorder.dom_diffs and self.static_page is None:
+            try:
+                extra["page_dom_diff"] = recorder.drain_page(self.driver)
+            except Exception as exc:  # E.g. the browser is gone.
+                logger.debug(f"Could not read the DOM mutations: {exc}")
+        filename = recorder.dump_filename(self.flight_recorder_folder)
+        self.capture.submit_text(recorder.to_json(**extra), filename)
+        logger.info(f"Saving the last {len(recorder)} actions to {filename}.")
+
+    def __observe_action(self, action, seconds, commands, error):
+        self.metrics.counter(
+            "browserpilot_actions_total", "Actions by name and outcome."
+        ).inc(action=action, outcome="error" if error else "ok")
+        self.metrics.histogram(
+            "browserpilot_action_seconds", "Action latency by name."
+        ).observe(seconds, action=action)
+        self.metrics.histogram(
+            "browserpilot_webdriver_commands_per_action",
+            "WebDriver commands sent per action.",
+            buckets=COUNT_BUCKETS,
+        ).observe(commands, action=action)
+
+    def __count_command(self, command):
+        """Called for every WebDriver command the agent sends."""
+        self.webdriver_commands += 1
+        self.metrics.counter(
+            "browserpilot_webdriver_commands_total", "WebDriver commands by name."
+        ).inc(command=command)
+        if command in ["switchToFrame", "switchToParentFrame"]:
+            self.metrics.counter(
+                "browserpilot_frame_switches_total", "Frame switches."
+            ).inc()
+        if self.static_page is not None:
+            # E.g. `env.driver` used directly in generated code.
+            self.__load_static_page()
+        if self.action_batch.pending:
+            # Anything else that touches the browser, e.g. a GPTWebElement
+            # read in generated code, must see the batched actions done.
+            self.flush_actions()
+
+    def __sleep(self, seconds, action):
+        record_sleep(self.metrics, seconds, action)
+        time.sleep(seconds)
+
+    def __current_statement(self):
+        """The line of generated code being executed, if any."""
+        if not self.current_action:
+            return None
+        frame = sys._getframe(1)
+        while frame is not None and frame.f_code.co_filename != "<string>":
+            frame = frame.f_back
+        if frame is None:
+            return None
+        lines = self.current_action.split("\n")
+        if 0 < frame.f_lineno <= len(lines):
+            return lines[frame.f_lineno - 1]
+        return None
+
+    def _report_failure(self, failure):
+        """Log a StatementFailure and dump the flight recorder. Returns the
+        stack trace and the failing line, as shown to the LLM."""
+        # Replace the name of this class (GPTSeleniumAgent) with "env".
+        stack_trace = failure.traceback.replace(self.__class__.__name__, "env")
         problem_instruction = "\nFailed on line: {line}\n".format(
-            line=action.split("\n")[line_num - 1]
+            line=failure.statement
         )
         logger.info("\n\n" + stack_trace)
         logger.info(problem_instruction)
+        self.__dump_flight_recorder(failure.traceback)
+        return stack_trace, problem_instruction
+
+    def __handle_agent_exception(self, failure):
+        """Handle a StatementFailure. Returns the code to resume with."""
+        stack_trace, problem_instruction = self._report_failure(failure)
 
         if self.debug:
             if self.debug_html_folder:
                 self.__save_html_snapshot()
+                self.capture.flush()  # So the files are there to inspect.
 
-            logger.info(traceback.print_exc())
+            logger.info(failure.traceback)
             logger.info(
                 "Starting interactive debugger. Type `env` for the Agent object."
             )
+            import pdb
+
             env = self  # For the interactive debugger.
             pdb.set_trace()
 
-        if self.should_retry:
-            step = self.instruction_compiler.retry(problem_instruction + stack_trace)
+        # No fix to the code brings a dead browser back, so let the caller
+        # (e.g. GridScheduler) start a new session instead.
+        if self.should_retry and not is_dead_session(failure.exception):
+            step = self.instruction_compiler.resume(
+                failure.completed_code,
+                failure.remaining_code,
+                problem_instruction + stack_trace,
+            )
             instruction = step["instruction"]
             action = step["action_output"].replace("```", "")
-            logger.info("RETRYING...")
+            logger.info("RETRYING FROM THE FAILED STATEMENT...")
             self.__print_instruction_and_action(instruction, action)
             return action
         else:
-            raise Exception("Failed to execute instruction.")
+            raise Exception("Failed to execute instruction.") from failure.exception
 
     def __step_through_instructions(self):
         """In contrast to `__run_compiled_instructions`, this function will
         step through the instructions queue one at a time, calling the LLM for
         each instruction."""
-        ldict = {"env": self}
+        executor = self.__make_executor()
         while self.instruction_compiler.instructions_queue:
             # `step` will try the instruction for the first time.
             step = self.instruction_compiler.step()
+            if step is None:
+                continue
 
             instruction = step["instruction"]
             action = step["action_output"]
             self.__print_instruction_and_action(instruction, action)
-
-            # Attempt evals.
-            attempts = 0
-            while attempts < 3:
-                attempts = attempts + 1
-                action = action.replace("```", "")
-                self._check_danger(action)
-                try:
-                    exec(action, globals(), ldict)
-                    break
-                except:
-                    action = self.__handle_agent_exception(action)
+            self.__run_action(executor, instruction, action)
 
         if self.instruction_output_file:
             self.instruction_compiler.save_compiled_instructions(
                 self.instruction_output_file
             )
 
-        self.__complete()
+        self._complete()
 
     def __switch_to_element_iframe(func):
         """Decorator function to switch to the iframe of the element."""
 
+        @functools.wraps(func)
         def wrapper(*args, **kwargs):
             self = args[0]
             element = args[1]
@@ -378,21 +590,146 @@ class GPTSeleniumAgent:
                 iframe = element.iframe
                 if iframe is not None:
                     self.driver.switch_to.frame(iframe)
-                result = func(*args)
+                result = func(*args, **kwargs)
                 self.driver.switch_to.default_content()
             else:
-                result = func(*args)
+                result = func(*args, **kwargs)
 
             return result
 
         return wrapper
 
+    def __record_action(mutates=False, name=None):
+        """Decorator factory to record the action in the flight recorder. If
+        the action `mutates` the page, the URL and a summary of the DOM
+        mutations are recorded too. The action is recorded as `name`, which
+        defaults to the name of the function."""
+
+        def decorator(func):
+            action = name or func.__name__
+
+            @functools.wraps(func)
+            def wrapper(self, *args, **kwargs):
+                recorder = self.flight_recorder
+                if recorder.depth > 0:
+                    return func(self, *args, **kwargs)
+
+                recorder.depth += 1
+                start = time.time()
+                commands = self.webdriver_commands
+                error = None
+                try:
+                    if self.static_page is not None and action not in STATIC_ACTIONS:
+                        self.__load_static_page()
+                    if action not in BATCHED_ACTIONS:
+                        self.flush_actions()  # E.g. before a `wait`.
+                    return func(self, *args, **kwargs)
+                except Exception as exc:
+                    error = repr(exc)
+                    raise
+                finally:
+                    recorder.depth -= 1
+                    duration = time.time() - start
+                    self.__observe_action(
+                        action, duration, self.webdriver_commands - commands, error
+                    )
+                    if recorder.enabled:
+                        url, dom_diff = None, None
+                        browser = (
+                            not self.action_batch.pending and self.static_page is None
+                        )
+                        try:
+                            if mutates and browser and recorder.dom_diffs:
+                                url, dom_diff = recorder.drain_dom(self.driver)
+                            elif action == "get" and browser and error is None:
+                                url = recorder.watch(self.driver)
+                        except WebDriverException:
+                            pass  # E.g. the window was closed.
+                        recorder.record(
+                            action,
+                            list(args) + list(kwargs.values()),
+                            duration,
+                            instruction=self.current_instruction,
+                            statement=self.__current_statement(),
+                            url=url,
+                            dom_diff=dom_diff,
+                            error=error,
+                        )
+
+            return wrapper
+
+        return decorator
+
     """Functions meant for the client to call."""
 
     def set_instructions(self, instructions):
         """Reset the instructions to `instructions`."""
         self.instruction_compiler.set_instructions(instructions)
 
+    def flush_actions(self):
+        """Perform the batched clicks and key presses, if any. This happens
+        on its own before anything else touches the browser."""
+        batch = self.action_batch
+        if not batch.pending:
+            return
+        url_before = batch.url
+        clicks = len([step for step in batch.steps if step[0] == "click"])
+        size = batch.flush()
+        record_sleep(self.metrics, 2 * TIME_BETWEEN_ACTIONS * clicks, "click")
+        self.metrics.histogram(
+            "browserpilot_action_batch_size",
+            "Actions performed per batch.",
+            buckets=COUNT_BUCKETS,
+        ).observe(size)
+
+        # Only check for a navigation once, at the end of the batch.
+        if url_before is not None and self.driver.current_url != url_before:
+            self.__sleep(TIME_BETWEEN_ACTIONS, "click")
+            self.__remember_page()
+
+    def _finish_block(self, failed=None):
+        """Called at the end of each block of generated code. Performs the
+        batched actions, except those queued by statement `failed` or later,
+        which is going to be run again."""
+        if failed is not None:
+            self.action_batch.discard(failed)
+        self.flush_actions()
+
+    def __batch_action(self, action, element, keys=None):
+        """Queue `action` if batching, along with the statement that queued
+        it. Returns whether it was queued."""
+        if not self.batch_actions:
+            return False
+        if not self.action_batch.accepts(element):
+            self.flush_actions()  # The batch is for another frame.
+        url = None
+        if self.memory_folder and not len(self.action_batch):
+            url = self.driver.current_url
+        statement_index = self.executor.index if self.executor is not None else None
+        self.action_batch.add(
+            action, element, keys, url=url, statement_index=statement_index
+        )
+        return True
+
+    def __load_static_page(self):
+        """Load the page that `get` fetched without the browser into the
+        browser, e.g. before the first interaction with it."""
+        page, self.static_page = self.static_page, None
+        logger.info(f"Loading {page.url} in the browser.")
+        self.metrics.counter(
+            "browserpilot_static_page_loads_total",
+            "Pages fetched over plain HTTP that were later loaded in the browser.",
+        ).inc()
+        self.network.apply(self.static_load_profile)
+        self.driver.get(page.url)
+        self.network.collect()
+        self.__sleep(1, "get")
+
+    def __remember_page(self):
+        """Add all the visible text from the page to the memory."""
+        text = self.get_text_from_page()
+        self.memory.add(text, url=self.driver.current_url)
+
     def run(self):
         """Run the agent."""
         should_use_compiled = self.instruction_compiler.use_compiled
@@ -408,36 +745,134 @@ class GPTSeleniumAgent:
 
     """Functions exposed to the agent via the text prompt."""
 
+    @__record_action()
     def wait(self, seconds):
-        time.sleep(seconds)
+        self.__sleep(seconds, "wait")
 
-    def get(self, url):
+    @__record_action(mutates=True)
+    def get(self, url, load_profile=None):
         if not url.startswith("http"):
             url = "http://" + url
+        self.static_page = None  # Never needed in the browser after all.
+        if self.static_fetcher is not None:
+            page = self.static_fetcher.fetch(url)
+            if page is not None:
+                self.static_page = page
+                self.static_load_profile = load_profile
+                if self.memory_folder:
+                    self.memory.add(page.text, url=page.url)
+                return
+        self.network.apply(load_profile)
         self.driver.get(url)
-        time.sleep(1)
+        self.network.collect()
+        self.__sleep(1, "get")
         if self.memory_folder:
-            # Get all the visible text from the page and add it to the memory.
-            text = self.get_text_from_page()
-            self.memory.add(text)
+            self.__remember_page()
+
+    @__record_action()
+    def get_many(self, urls, max_tabs=4, timeout=30):
+        """Loads `urls` in up to `max_tabs` tabs at once, and returns the
+        text of each page, in order (None if it did not load within
+        `timeout` seconds). Pages are added to memory as they load."""
 
+        def read_page(url):
+            text = self.get_text_from_page()
+            if self.memory_folder:
+                self.memory.add(text, url=self.driver.current_url)
+            return text
+
+        return self.map_pages(urls, read_page, max_tabs=max_tabs, timeout=timeout)
+
+    @__record_action()
+    def map_pages(self, urls, fn, max_tabs=4, timeout=30, poll_interval=0.1):
+        """Loads `urls` in up to `max_tabs` tabs at once, and calls `fn(url)`
+        in each tab as soon as its page has loaded, e.g. to read it with
+        `env.get_text_from_page` or `env.find_elements`. Returns the results
+        of `fn` in the order of `urls` (None for pages that did not load
+        within `timeout` seconds).
+
+        Tabs come from a pool that is reused across calls. Each page only
+        costs its own load time plus the polling, rather than a `get` with
+        its fixed wait. `fn` gets a fresh element store for each page, since
+        every tab stamps its own `data-bp-id`s. The agent is back on its
+        original tab and page state afterwards.
+        """
+        pages = self._load_pages(urls, max_tabs, timeout, poll_interval)
+        result = None
+        try:
+            while True:
+                try:
+                    url = pages.send(result)
+                except StopIteration as stop:
+                    return stop.value
+                result = fn(url)
+        finally:
+            pages.close()
+
+    def _load_pages(self, urls, max_tabs, timeout, poll_interval):
+        """Generator behind `map_pages`: loads `urls` in the tab pool, and
+        yields each URL while its tab is current and its page has loaded.
+        What is sent back is its result. Returns the results, in order."""
+        # The tabs are on their own pages, and the agent's page stays as is.
+        static_page, self.static_page = self.static_page, None
+        element_store = self.element_store
+        urls = list(urls)
+        results = [None for _ in urls]
+        pending = list(enumerate(urls))
+        loading = {}  # Window handle => (index, url, started).
+        original = self.driver.current_window_handle
+        free = self.__tab_pool(min(max_tabs, len(urls)))
+        try:
+            while pending or loading:
+                while free and pending:
+                    handle = free.pop()
+                    index, url = pending.pop(0)
+                    if not url.startswith("http"):
+                        url = "http://" + url
+                    self.driver.switch_to.window(handle)
+                    self.driver.execute_script(NAVIGATE_SCRIPT, url)
+                    loading[handle] = (index, url, time.time())
+
+                ready = False
+                for handle, (index, url, started) in list(loading.items()):
+                    self.driver.switch_to.window(handle)
+                    if self.driver.execute_script(IS_LOADED_SCRIPT):
+                        ready = True
+                        self.element_store = self.__make_element_store()
+                        results[index] = yield url
+                    elif time.time() - started > timeout:
+                        logger.info(f"Timed out loading {url}.")
+                        self.driver.execute_script("window.stop();")
+                    else:
+                        continue
+                    del loading[handle]
+                    free.append(handle)
+                if loading and not ready:
+                    self.__sleep(poll_interval, "map_pages")
+        finally:
+            self.driver.switch_to.window(original)
+            self.static_page = static_page
+            self.element_store = element_store
+        return results
+
+    def __tab_pool(self, count):
+        """Returns `count` tabs other than the current one, opening more if
+        the pool is too small."""
+        current = self.driver.current_window_handle
+        handles = self.driver.window_handles
+        self.tabs = [tab for tab in self.tabs if tab in handles and tab != current]
+        while len(self.tabs) < count:
+            self.driver.switch_to.new_window("tab")
+            self.tabs.append(self.driver.current_window_handle)
+        self.driver.switch_to.window(current)
+        return self.tabs[:count]
+
+    @__record_action()
     @__switch_to_element_iframe
     def is_element_visible_in_viewport(self, element: GPTWebElement) -> bool:
-        is_visible = self.driver.execute_script(
-            "var elem = arguments[0],                 "
-            "  box = elem.getBoundingClientRect(),    "
-            "  cx = box.left + box.width / 2,         "
-            "  cy = box.top + box.height / 2,         "
-            "  e = document.elementFromPoint(cx, cy); "
-            "for (; e; e = e.parentElement) {         "
-            "  if (e === elem)                        "
-            "    return true;                         "
-            "}                                        "
-            "return false;                            ",
-            element,
-        )
-        return is_visible
+        return self.page_model.is_visible_in_viewport(element)
 
+    @__record_action(mutates=True)
     def scroll(self, direction=None, iframe=None):
         allowed_dirs = ["up", "down", "top", "bottom", "left", "right"]
         assert direction in allowed_dirs, f"Invalid direction: {direction}"
@@ -467,16 +902,16 @@ class GPTSeleniumAgent:
         # Switch back to the default frame.
         self.driver.switch_to.default_content()
 
+    @__record_action()
     def find_element(self, by="id", value=None):
         found_elements = self.find_elements(by, value)
         if len(found_elements) == 0:
             raise Exception("No elements found.")
 
-        # Iterate through until the first displayed one is found, then return that one.
-        for element in found_elements:
-            if element.is_displayed():
-                return element
+        # `find_elements` only returns displayed elements.
+        return found_elements[0]
 
+    @__record_action()
     def find_elements(self, by="id", value=None):
         """Wrapper over `driver.find_elements` which also scans iframes.
 
@@ -489,27 +924,68 @@ class GPTSeleniumAgent:
         Finally, it returns the list of all elements found on the page
         and in all iframes. Returns a list of GPTWebElement objects.
         """
-        elements = self.driver.find_elements(by, value)
-        # Screen for elements that are not displayed.
-        elements = [element for element in elements if element.is_displayed()]
-        elements = [GPTWebElement(element) for element in elements]
-        # Find all iframes on the page and switch to each one to find
-        # their elements.
-        iframes = self.driver.find_elements(by=By.TAG_NAME, value="iframe")
-        logger.debug(f"Found {len(iframes)} iframes.")
-        for iframe in iframes:
-            self.driver.switch_to.frame(iframe)
-            iframe_elements = self.driver.find_elements(by, value)
-            iframe_elements = [
-                element for element in iframe_elements if element.is_displayed()
-            ]
-            iframe_elements = [
-                GPTWebElement(element, iframe=iframe) for element in iframe_elements
-            ]
-            elements.extend(iframe_elements)
-            self.driver.switch_to.default_content()
-        return elements
+        elements = self.page_model.find_elements(by, value)
+        return [GPTWebElement(element, iframe=iframe) for element, iframe in elements]
 
+    def iter_elements(
+        self, by="css selector", value=None, max_items=None, idle_timeout=5, poll_interval=0.5
+    ):
+        """Yields the displayed elements that match `by` and `value`, each
+        once, as they appear, scrolling down whenever the ones already on the
+        page are used up. Stops after `max_items`, or once nothing new has
+        shown up for `idle_timeout` seconds.
+
+        Meant for feeds and infinite scroll: each round trip only returns
+        elements that were not returned before (tracked in the page by
+        element identity), so collecting n items is linear in n, and neither
+        side holds on to the ones already yielded. Only searches the top
+        frame. Each round trip is recorded as an `iter_elements` action.
+        """
+        rounds = self._element_rounds(by, value, idle_timeout)
+        count = 0
+        try:
+            while max_items is None or count < max_items:
+                elements = next(rounds, None)
+                if elements is None:
+                    return
+                if not elements:
+                    self.__sleep(poll_interval, "iter_elements")
+                    continue
+                for element in elements:
+                    yield element
+                    count += 1
+                    if max_items is not None and count >= max_items:
+                        return
+        finally:
+            rounds.close()
+
+    def _element_rounds(self, by, value, idle_timeout):
+        """Generator behind `iter_elements`: yields the new elements of each
+        round trip, or an empty list if there were none and the caller should
+        wait before the next. Returns once nothing new has shown up for
+        `idle_timeout` seconds."""
+        token = uuid.uuid4().hex
+        last_new = time.time()
+        try:
+            while True:
+                elements = self.__new_elements(token, by, value)
+                if elements:
+                    last_new = time.time()
+                elif time.time() - last_new > idle_timeout:
+                    return
+                yield [GPTWebElement(element) for element in elements]
+        finally:
+            try:
+                self.page_model.forget(token)
+            except WebDriverException:
+                pass  # E.g. the window was closed.
+
+    @__record_action(mutates=True, name="iter_elements")
+    def __new_elements(self, token, by, value):
+        # Scrolls when there is nothing new.
+        return self.page_model.new_elements(token, by, value)
+
+    @__record_action()
     @__switch_to_element_iframe
     def find_nearest(self, element: GPTWebElement, xpath=None, direction="above"):
         assert direction in ["near", "above", "below", "left", "right"], (
@@ -530,50 +1006,60 @@ class GPTSeleniumAgent:
         nearest_element = GPTWebElement(nearest_elem, iframe=element.iframe)
         return nearest_element
 
-    @__switch_to_element_iframe
+    @__record_action(mutates=True)
     def send_keys(self, element: GPTWebElement, keys):
+        if not self.__batch_action("send_keys", element, keys):
+            self.__send_keys(element, keys)
+
+    @__switch_to_element_iframe
+    def __send_keys(self, element: GPTWebElement, keys):
         element.send_keys(keys)
 
+    @__record_action()
     @__switch_to_element_iframe
     def get_text_of_element(self, element):
         return element.text
 
-    @__switch_to_element_iframe
+    @__record_action(mutates=True)
     def click(self, element: GPTWebElement):
+        if not self.__batch_action("click", element):
+            self.__click(element)
+
+    @__switch_to_element_iframe
+    def __click(self, element: GPTWebElement):
         wait_time = TIME_BETWEEN_ACTIONS
 
-        url_before_click = self.driver.current_url
+        # The URL is only needed to tell whether to add the page to memory.
+        url_before_click = self.driver.current_url if self.memory_folder else None
         ActionChains(self.driver).pause(wait_time).move_to_element(element).pause(
             wait_time
         ).click(element).perform()
-        url_after_click = self.driver.current_url
+        record_sleep(self.metrics, 2 * wait_time, "click")  # The two pauses.
 
         # If the URL changed, then add the page to memory.
-        if self.memory_folder and (url_before_click != url_after_click):
-            time.sleep(wait_time)
-            # Get all the visible text from the page and add it to the memory.
-            text = self.get_text_from_page()
-            self.memory.add(text)
+        if self.memory_folder and (url_before_click != self.driver.current_url):
+            self.__sleep(wait_time, "click")
+            self.__remember_page()
 
+    @__record_action()
     def get_text_from_page(self):
         """Returns the text from the page."""
-        text = self.driver.find_element(by=By.TAG_NAME, value="body").text
-
-        # Check for iframes too.
-        iframes = self.driver.find_elements(by=By.TAG_NAME, value="iframe")
-        for iframe in iframes:
-            self.driver.switch_to.frame(iframe)
-            visible_text = self.driver.find_element(
-                by=By.TAG_NAME, value="body"
-            ).text
-            text = text + "\n" + visible_text
-            self.driver.switch_to.default_content()
-
-        return text
+        if self.static_page is not None:
+            return self.static_page.text
+        return self.page_model.get_text()
 
+    @__record_action()
     def retrieve_information(self, prompt):
         """Retrieves information using using GPT-Index embeddings from a page."""
-        text = self.get_text_from_page()
+        from llama_index.core import Document, GPTVectorStoreIndex
+
+        if self.static_page is not None:
+            text = self.static_page.text
+        elif self.page_representation == "accessibility":
+            self.element_store.sync(self.driver)
+            text = self.element_store.page_text()
+        else:
+            text = self.get_text_from_page()
         chatgpt_kwargs = {"temperature": 0, "model_name": self.model_for_instructions}
         index = GPTVectorStoreIndex.from_documents([Document(text=text)])
         logger.info(
@@ -583,6 +1069,7 @@ class GPTSeleniumAgent:
         resp = query_engine.query(prompt)
         return resp.response.strip()
 
+    @__record_action()
     def get_llm_response(self, prompt, temperature=0.7, model=None):
         if model is None:
             model = self.model_for_responses
@@ -594,53 +1081,37 @@ class GPTSeleniumAgent:
             temperature=temperature,
         )
 
-    def query_memory(self, prompt):
-        """Queries the memory of the LLM."""
+    @__record_action()
+    def query_memory(self, prompt, namespace=None):
+        """Queries the memory of the LLM. `namespace` is a namespace or list
+        of namespaces to query; None queries all of them."""
         if self.memory_folder:
-            resp = self.memory.query(prompt)
+            resp = self.memory.query(prompt, namespace=namespace)
             return resp
         logger.error("Memory is disabled.")
 
+    @__record_action()
     def ask_llm_to_find_element(self, element_description):
         """Clean the HTML from self.driver, ask GPT-Index to find the element,
         and return Selenium code to access it. Return a GPTWebElement."""
 
-        # Set up a dict that maps an element string to its object and its
-        # source iframe. Shape looks like:
-        # element_string => {"iframe": iframe, "element": element_obj}.
-        elements_tagged_by_iframe = {}
+        # Bring the element store up to date with the page. Only elements
+        # that changed since the last lookup are cleaned and embedded again.
+        self.element_store.sync(self.driver)
 
-        # First, get and clean elements from the main page.
-        elements = self.__get_html_elements_for_llm()
-        elements_tagged_by_iframe.update(
-            {ele.prettify(): {"iframe": None, "element": ele} for ele in elements}
-        )
-        # Then do it for the iframes.
-        iframes = self.driver.find_elements(by=By.TAG_NAME, value="iframe")
-        for iframe in iframes:
-            self.driver.switch_to.frame(iframe)
-            elements = self.__get_html_elements_for_llm()
-            elements_tagged_by_iframe.update(
-                {ele.prettify(): {"iframe": iframe, "element": ele} for ele in elements}
-            )
-
-        # Create the docs and a dict of doc_id to element, which will help
-        # us find the element that GPT Index returns.
-        docs = [Document(text=element.prettify()) for element in elements]
-        doc_id_to_element = {doc.get_doc_id(): elements[i].prettify() for i, doc in enumerate(docs)}
-
-        # Construct and query index.
-        chatgpt_kwargs = {"temperature": 0, "model_name": self.model_for_instructions}
-        index = GPTVectorStoreIndex.from_documents(docs)
+        # Query the index.
         query = "Find element that matches description: {element_description}. If no element matches, return {no_resp_token}.".format(
             element_description=element_description, no_resp_token=NO_RESPONSE_TOKEN
         )
         query = (
             query + " Please be as succinct as possible, with no additional commentary."
         )
-        query_engine = index.as_query_engine()
+        query_engine = self.element_store.index.as_query_engine()
         resp = query_engine.query(query)
-        doc_id = resp.source_nodes[0].node.ref_doc_id
+        if not resp.source_nodes:
+            logger.info("No elements on the page. Returning None.")
+            return None
+        node_id = resp.source_nodes[0].node.node_id
 
         resp_text = resp.response.strip()
         if NO_RESPONSE_TOKEN in resp_text:
@@ -651,9 +1122,20 @@ class GPTSeleniumAgent:
             f"Asked Llama Index to find element. Response: {resp_text}"
         )
 
-        # Find the iframe that the element is from.
-        found_element = doc_id_to_element[doc_id]
-        iframe_of_element = elements_tagged_by_iframe[found_element]["iframe"]
+        return self.__element_for_node(node_id)
+
+    def __element_for_node(self, node_id):
+        """Map a node of the element store back to a live GPTWebElement. The
+        stamped `data-bp-id` usually finds it directly; if the page replaced
+        the element since the last sync, fall back to asking the LLM for its
+        XPath."""
+        element, iframe_of_element = self.element_store.locate(self.driver, node_id)
+        if element is not None:
+            return GPTWebElement(element, iframe=iframe_of_element)
+
+        logger.info("Element is gone from the page. Asking the LLM for its XPath.")
+        # Find the element string and the iframe that the element is from.
+        found_element, iframe_of_element = self.element_store.get(node_id)
 
         # Get the argument to the find_element_by_xpath function.
         prompt = self.instruction_compiler.prompt_to_find_element.format(
@@ -662,36 +1144,94 @@ class GPTSeleniumAgent:
         llm_output = (
             self.get_llm_response(prompt, temperature=0).strip().replace('"', "")
         )
+        return self.__find_element_by_xpath(llm_output, iframe_of_element)
+
+    @__record_action()
+    def ask_llm_to_find_elements(self, element_descriptions, candidates_per_description=5):
+        """Like `ask_llm_to_find_element`, but for several elements on the
+        same page. The page is synced once, the candidates for every
+        description are pooled, and a single LLM request picks the element
+        for all of them. Returns a list with a GPTWebElement, or None
+        if not found, for each description."""
+        self.element_store.sync(self.driver)
+
+        # Pool the candidates for all descriptions, keeping their order.
+        node_ids = []
+        for description in element_descriptions:
+            for node_id in self.element_store.retrieve(
+                description, similarity_top_k=candidates_per_description
+            ):
+                if node_id not in node_ids:
+                    node_ids.append(node_id)
+        if not node_ids:
+            logger.info("No elements on the page. Returning None.")
+            return [None for _ in element_descriptions]
+
+        candidates = [self.element_store.get(node_id) for node_id in node_ids]
+        prompt = self.instruction_compiler.prompt_to_find_elements.format(
+            candidates="\n".join(
+                f"[{i}] {html}" for i, (html, _) in enumerate(candidates)
+            ),
+            descriptions="\n".join(
+                f"{i + 1}. {description}"
+                for i, description in enumerate(element_descriptions)
+            ),
+        )
+        llm_output = self.get_llm_response(prompt, temperature=0)
+        try:
+            results = json.loads(llm_output[llm_output.index("[") : llm_output.rindex("]") + 1])
+        except ValueError:
+            logger.info(f"Could not parse LLM response: {llm_output}")
+            results = []
+
+        elements = []
+        for i, description in enumerate(element_descriptions):
+            index = results[i] if i < len(results) else None
+            if not isinstance(index, int) or not (0 <= index < len(node_ids)):
+                logger.info(f'Could not find element "{description}".')
+                elements.append(None)
+                continue
+            try:
+                elements.append(self.__element_for_node(node_ids[index]))
+            except WebDriverException as exc:
+                logger.info(f'Could not locate element "{description}": {exc}')
+                elements.append(None)
+        return elements
 
+    def __find_element_by_xpath(self, xpath, iframe=None):
+        """Find the element at `xpath` in `iframe`. Returns a GPTWebElement."""
         # Switch to the iframe that the element is in.
-        if iframe_of_element is not None:
-            self.driver.switch_to.frame(iframe_of_element)
-        element = self.driver.find_element(by="xpath", value=llm_output)
-        # Switch back to default_content.
-        self.driver.switch_to.default_content()
+        if iframe is not None:
+            self.driver.switch_to.frame(iframe)
+        try:
+            element = self.driver.find_element(by="xpath", value=xpath)
+        finally:
+            # Switch back to default_content.
+            self.driver.switch_to.default_content()
 
-        return GPTWebElement(element, iframe=iframe_of_element)
+        return GPTWebElement(element, iframe=iframe)
 
+    @__record_action()
     def save(self, text, filename):
         """Save the text to a file."""
         with open(filename, "w") as f:
             f.write(text)
 
+    @__record_action()
     def screenshot(self, element: GPTWebElement, filename):
-        """Take a screenshot of the element."""
-        with open(filename, "wb") as f:
-            # Check the width and height of the element and make sure it's
-            # above 0.
-            width = element.size["width"]
-            height = element.size["height"]
-            if width == 0 or height == 0:
-                logger.info(
-                    "Skipping screenshot of file {}: element with width or height 0.".format(
-                        filename
-                    )
+        """Take a screenshot of the element. The file is encoded and written
+        in the background; the format follows the extension of `filename`."""
+        # Check the width and height of the element and make sure it's
+        # above 0.
+        size = element.size
+        if size["width"] == 0 or size["height"] == 0:
+            logger.info(
+                "Skipping screenshot of file {}: element with width or height 0.".format(
+                    filename
                 )
-                return
-            f.write(element.screenshot_as_png)
+            )
+            return
+        self.capture.submit_image(element.screenshot_as_base64, filename)
 
 
 if __name__ == "__main__":
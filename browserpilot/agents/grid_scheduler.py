@@ -0,0 +1,282 @@
+"""GridScheduler class, which shards agent runs across Selenium Grid nodes."""
+import itertools
+import json
+import logging
+import os
+import statistics
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+from collections import deque
+
+from .execution import is_dead_session
+from .gpt_selenium_agent import GPTSeleniumAgent
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+HEALTH_TIMEOUT = 5  # Seconds to wait for a node's /status.
+
+
+def check_health(url, timeout=HEALTH_TIMEOUT):
+    """Whether the node at `url` is up and ready for new sessions. Both Grid
+    and a bare chromedriver answer `GET /status` with `value.ready`."""
+    try:
+        with urllib.request.urlopen(f"{url.rstrip('/')}/status", timeout=timeout) as resp:
+            status = json.loads(resp.read())
+    except (OSError, ValueError, urllib.error.URLError):
+        return False
+    return bool(status.get("value", {}).get("ready", False))
+
+
+class GridNode:
+    """A remote endpoint, its capacity and its counters."""
+
+    def __init__(self, url, capacity=1):
+        self.url = url
+        self.capacity = capacity
+        self.active = 0
+        self.healthy = True
+        self.completed = 0
+        self.failed = 0
+        self.requeued = 0
+        self.busy_seconds = 0.0
+
+    @property
+    def load(self):
+        return self.active / self.capacity
+
+    @property
+    def available(self):
+        return self.healthy and self.active < self.capacity
+
+
+class GridJob:
+    """A queued run of `GPTSeleniumAgent`."""
+
+    def __init__(self, job_id, instructions, agent_kwargs):
+        self.id = job_id
+        self.instructions = instructions
+        self.agent_kwargs = agent_kwargs
+        self.status = "queued"  # "queued", "running", "done" or "failed".
+        self.attempts = 0
+        self.node = None
+        self.error = None
+        self.submitted = time.time()
+        self.queued = self.submitted  # When it was last (re)queued.
+        self.queue_seconds = 0.0  # Total time spent waiting for a node.
+        self.started = None
+        self.finished = None
+        self._done = threading.Event()
+
+    def wait(self, timeout=None):
+        return self._done.wait(timeout)
+
+
+class GridScheduler:
+    def __init__(
+        self,
+        endpoints,
+        max_attempts=3,
+        health_interval=10,
+        agent_factory=GPTSeleniumAgent,
+        **agent_kwargs,
+    ):
+        """Schedule agent runs on the least-loaded healthy node of a grid.
+
+        Args:
+            endpoints (list): Remote URLs, or dicts with a `url` and a
+                `capacity` (concurrent sessions; 1 by default).
+            max_attempts (int): How many times to run a job whose session
+                dies before giving up on it.
+            health_interval (float): Seconds between health checks.
+            agent_factory (callable): Creates the agent for a job, given the
+                instructions and `remote_url`. Defaults to GPTSeleniumAgent.
+            agent_kwargs: Passed to every agent, e.g. `model_for_instructions`.
+        """
+        assert endpoints, "Need at least one endpoint."
+        self.nodes = [
+            GridNode(endpoint) if isinstance(endpoint, str) else GridNode(**endpoint)
+            for endpoint in endpoints
+        ]
+        self.max_attempts = max_attempts
+        self.health_interval = health_interval
+        self.agent_factory = agent_factory
+        self.agent_kwargs = agent_kwargs
+        self.queue = deque()
+        self.jobs = []
+        self._ids = itertools.count()
+        self._lock = threading.Condition()
+        self._running = False
+        self._threads = []
+        self.started_at = None
+
+    """Functions meant for the client to call."""
+
+    def submit(self, instructions, **agent_kwargs):
+        """Queue a job. Returns a GridJob to `wait` on."""
+        job = GridJob(next(self._ids), instructions, agent_kwargs)
+        with self._lock:
+            self.jobs.append(job)
+            self.queue.append(job)
+            self._lock.notify_all()
+        return job
+
+    def start(self):
+        with self._lock:
+            if self._running:
+                return
+            self._running = True
+            self.started_at = time.time()
+        self.check_health()
+        for target in [self._dispatch, self._monitor_health]:
+            thread = threading.Thread(target=target, daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def join(self, timeout=None):
+        """Wait for every submitted job to finish."""
+        deadline = None if timeout is None else time.time() + timeout
+        for job in list(self.jobs):
+            remaining = None if deadline is None else max(0, deadline - time.time())
+            if not job.wait(remaining):
+                return False
+        return True
+
+    def shutdown(self, wait=True):
+        if wait:
+            self.join()
+        with self._lock:
+            self._running = False
+            self._lock.notify_all()
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+
+    def check_health(self):
+        """Check every node, and wake up the dispatcher if one recovered."""
+        for node in self.nodes:
+            healthy = check_health(node.url)
+            with self._lock:
+                if healthy != node.healthy:
+                    logger.info(
+                        f"Node {node.url} is {'healthy' if healthy else 'unhealthy'}."
+                    )
+                node.healthy = healthy
+                self._lock.notify_all()
+
+    def stats(self):
+        """Per node: jobs completed, failed and requeued, throughput (jobs
+        per minute) and utilization. Overall: queue latency of started jobs."""
+        with self._lock:
+            elapsed = max(time.time() - (self.started_at or time.time()), 1e-9)
+            nodes = {
+                node.url: {
+                    "healthy": node.healthy,
+                    "active": node.active,
+                    "completed": node.completed,
+                    "failed": node.failed,
+                    "requeued": node.requeued,
+                    "jobs_per_minute": 60 * node.completed / elapsed,
+                    "utilization": node.busy_seconds / (elapsed * node.capacity),
+                }
+                for node in self.nodes
+            }
+            latencies = sorted(
+                job.queue_seconds for job in self.jobs if job.started is not None
+            )
+            queued = len(self.queue)
+        queue = {"queued": queued, "started": len(latencies)}
+        if latencies:
+            queue.update(
+                {
+                    "mean_seconds": statistics.mean(latencies),
+                    "p50_seconds": latencies[len(latencies) // 2],
+                    "p95_seconds": latencies[int(0.95 * (len(latencies) - 1))],
+                    "max_seconds": latencies[-1],
+                }
+            )
+        return {"nodes": nodes, "queue": queue}
+
+    """Helper functions"""
+
+    def _pick_node(self):
+        """The least-loaded healthy node with a free slot, or None."""
+        available = [node for node in self.nodes if node.available]
+        if not available:
+            return None
+        return min(available, key=lambda node: node.load)
+
+    def _dispatch(self):
+        with self._lock:
+            while self._running:
+                node = self._pick_node() if self.queue else None
+                if node is None:
+                    self._lock.wait()
+                    continue
+                job = self.queue.popleft()
+                job.status = "running"
+                job.node = node.url
+                job.attempts += 1
+                job.started = time.time()
+                job.queue_seconds += job.started - job.queued
+                node.active += 1
+                threading.Thread(target=self._run, args=(job, node), daemon=True).start()
+
+    def _monitor_health(self):
+        while True:
+            with self._lock:
+                self._lock.wait(self.health_interval)
+                if not self._running:
+                    return
+            self.check_health()
+
+    def _run(self, job, node):
+        kwargs = dict(self.agent_kwargs, **job.agent_kwargs)
+        # Concurrent sessions on a node can't share a Chrome profile.
+        kwargs.setdefault(
+            "user_data_dir",
+            os.path.join(tempfile.gettempdir(), f"browserpilot-grid-{job.id}"),
+        )
+        start = time.time()
+        agent = None
+        error = None
+        try:
+            agent = self.agent_factory(job.instructions, remote_url=node.url, **kwargs)
+            agent.run()
+        except Exception as exc:
+            error = exc
+            if agent is not None:
+                # Free the slot on the node, if the session is still there.
+                try:
+                    agent.driver.quit()
+                except Exception:
+                    pass
+
+        dead = error is not None and is_dead_session(error)
+        healthy = check_health(node.url) if dead else node.healthy
+        with self._lock:
+            node.active -= 1
+            node.busy_seconds += time.time() - start
+            if dead:
+                node.healthy = healthy
+            if dead and job.attempts < self.max_attempts:
+                logger.warning(f"Session for job {job.id} died on {node.url}. Requeueing.")
+                node.requeued += 1
+                job.status = "queued"
+                job.queued = time.time()
+                self.queue.appendleft(job)
+            else:
+                if error is None:
+                    node.completed += 1
+                    job.status = "done"
+                else:
+                    logger.error(f"Job {job.id} failed on {node.url}: {error}")
+                    node.failed += 1
+                    job.status = "failed"
+                    job.error = error
+                job.finished = time.time()
+                job._done.set()
+            self._lock.notify_all()
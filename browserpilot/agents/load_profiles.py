@@ -0,0 +1,222 @@
+"""Named network load profiles, which block resources the agent doesn't need
+(images, media, fonts, trackers) to cut page-load time."""
+import json
+import logging
+from collections import OrderedDict
+
+from selenium.common.exceptions import WebDriverException
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+IMAGE_PATTERNS = [
+    f"*.{ext}{suffix}"
+    for ext in ["png", "jpg", "jpeg", "gif", "webp", "avif", "bmp", "ico"]
+    for suffix in ["", "?*"]
+]
+MEDIA_PATTERNS = [
+    f"*.{ext}{suffix}"
+    for ext in ["mp4", "webm", "ogg", "ogv", "mov", "m3u8", "mp3", "wav", "m4a"]
+    for suffix in ["", "?*"]
+]
+FONT_PATTERNS = [
+    f"*.{ext}{suffix}"
+    for ext in ["woff", "woff2", "ttf", "otf", "eot"]
+    for suffix in ["", "?*"]
+] + ["*fonts.googleapis.com*", "*fonts.gstatic.com*", "*use.typekit.net*"]
+MAX_KNOWN_SIZES = 10000  # URLs (and open requests) kept, to estimate bytes saved.
+THIRD_PARTY_PATTERNS = [
+    "*google-analytics.com*",
+    "*googletagmanager.com*",
+    "*googlesyndication.com*",
+    "*googleadservices.com*",
+    "*doubleclick.net*",
+    "*adservice.google.*",
+    "*connect.facebook.net*",
+    "*facebook.com/tr*",
+    "*analytics.twitter.com*",
+    "*ads-twitter.com*",
+    "*bat.bing.com*",
+    "*scorecardresearch.com*",
+    "*quantserve.com*",
+    "*hotjar.com*",
+    "*segment.io*",
+    "*cdn.segment.com*",
+    "*mixpanel.com*",
+    "*amplitude.com*",
+    "*fullstory.com*",
+    "*newrelic.com*",
+    "*nr-data.net*",
+    "*optimizely.com*",
+    "*criteo.com*",
+    "*taboola.com*",
+    "*outbrain.com*",
+    "*amazon-adsystem.com*",
+    "*adnxs.com*",
+    "*moatads.com*",
+]
+
+# Profile name => URL patterns for `Network.setBlockedURLs`, and whether to
+# fall back to Chrome's content settings to block images when CDP is not
+# available (e.g. on Selenium Grid). Stylesheets are never blocked, since
+# the agent relies on them to tell which elements are displayed.
+#
+# NOTE: `Network.setBlockedURLs` can't express "everything except this
+# host", so "first-party-only" blocks a list of well-known third-party
+# trackers and ad networks rather than every third-party request.
+LOAD_PROFILES = {
+    "default": {"blocked_urls": [], "block_images": False},
+    "no-media": {
+        "blocked_urls": IMAGE_PATTERNS + MEDIA_PATTERNS,
+        "block_images": True,
+    },
+    "text-only": {
+        "blocked_urls": IMAGE_PATTERNS
+        + MEDIA_PATTERNS
+        + FONT_PATTERNS
+        + THIRD_PARTY_PATTERNS,
+        "block_images": True,
+    },
+    "first-party-only": {
+        "blocked_urls": THIRD_PARTY_PATTERNS,
+        "block_images": False,
+    },
+}
+
+
+def configure_chrome_options(chrome_options, load_profile="default", cdp=True):
+    """Set the Chrome options needed for `load_profile` before launch: the
+    performance log, which is used to count requests, and, if the driver
+    won't have CDP (`cdp` is False, e.g. on Selenium Grid), the image content
+    setting. That setting holds for the whole session, so `get` can't turn
+    images back on with another profile; with CDP, images are blocked per
+    call by `NetworkController` instead.
+
+    With CDP, `get` may switch to another profile on any call, so the
+    performance log is enabled even for "default"."""
+    assert load_profile in LOAD_PROFILES, f"Invalid load profile: {load_profile}"
+    if load_profile == "default" and not cdp:
+        return
+    chrome_options.set_capability("goog:loggingPrefs", {"performance": "ALL"})
+    if not cdp and LOAD_PROFILES[load_profile]["block_images"]:
+        chrome_options.add_experimental_option(
+            "prefs", {"profile.managed_default_content_settings.images": 2}
+        )
+
+
+class NetworkController:
+    """Applies load profiles to a driver with `Network.setBlockedURLs` and
+    counts requests, blocked requests, bytes loaded and bytes saved from the
+    performance log.
+
+    A blocked request is never sent, so its response headers (and
+    Content-Length) are never seen either, and the bytes it saved are
+    estimated: the size of the same URL when it was last loaded, or else the
+    mean size of the resources of the same type (image, font, ...) loaded so
+    far. Sizes are only learned from pages loaded without blocking that type,
+    so `bytes_saved` is a lower bound, and stays at zero for an agent that
+    has always blocked it; `blocked_requests` is the reliable figure.
+
+    Requests are counted whenever the driver has CDP, since `get` can switch
+    profiles per call, or when the agent's profile is not "default".
+    """
+
+    def __init__(self, driver, load_profile="default"):
+        assert load_profile in LOAD_PROFILES, f"Invalid load profile: {load_profile}"
+        self.driver = driver
+        self.load_profile = load_profile
+        self.active_profile = None
+        self.cdp_available = hasattr(driver, "execute_cdp_cmd")
+        self.track = self.cdp_available or load_profile != "default"
+        self.stats = {
+            "requests": 0,
+            "blocked_requests": 0,
+            "bytes_loaded": 0,
+            "bytes_saved": 0,
+        }
+        self.requests = {}  # Request id => (URL, type), until it is done.
+        self.sizes = OrderedDict()  # URL => bytes, the last MAX_KNOWN_SIZES.
+        self.type_sizes = {}  # Resource type => [bytes, count].
+        self.apply()
+
+    def apply(self, load_profile=None):
+        """Switch to `load_profile`, or to the profile the agent was created
+        with if None."""
+        load_profile = load_profile or self.load_profile
+        assert load_profile in LOAD_PROFILES, f"Invalid load profile: {load_profile}"
+        if load_profile == self.active_profile or not self.cdp_available:
+            return
+
+        try:
+            self.driver.execute_cdp_cmd("Network.enable", {})
+            self.driver.execute_cdp_cmd(
+                "Network.setBlockedURLs",
+                {"urls": LOAD_PROFILES[load_profile]["blocked_urls"]},
+            )
+        except WebDriverException as exc:
+            logger.warning(f"Could not apply load profile {load_profile}: {exc}")
+            self.cdp_available = False
+            return
+        logger.debug(f"Applied load profile {load_profile}.")
+        self.active_profile = load_profile
+
+    def collect(self):
+        """Drain the performance log into `stats` and return the counts for
+        the requests since the last call."""
+        collected = {key: 0 for key in self.stats}
+        if not self.track:
+            return collected
+
+        try:
+            entries = self.driver.get_log("performance")
+        except WebDriverException:
+            self.track = False
+            return collected
+
+        for entry in entries:
+            message = json.loads(entry["message"])["message"]
+            method = message.get("method")
+            params = message.get("params", {})
+            request_id = params.get("requestId")
+            if method == "Network.requestWillBeSent":
+                collected["requests"] += 1
+                url = params.get("request", {}).get("url")
+                self.requests[request_id] = (url, params.get("type"))
+                if len(self.requests) > MAX_KNOWN_SIZES:
+                    del self.requests[next(iter(self.requests))]  # Never finished.
+            elif method == "Network.loadingFinished":
+                size = int(params.get("encodedDataLength", 0))
+                collected["bytes_loaded"] += size
+                self._remember_size(self.requests.pop(request_id, None), size)
+            elif method == "Network.loadingFailed":
+                request = self.requests.pop(request_id, None)
+                if params.get("blockedReason"):
+                    collected["blocked_requests"] += 1
+                    collected["bytes_saved"] += self._estimate_size(
+                        request, params.get("type")
+                    )
+
+        for key in collected:
+            self.stats[key] += collected[key]
+        return collected
+
+    def _remember_size(self, request, size):
+        if request is None:
+            return
+        url, resource_type = request
+        self.sizes[url] = size
+        self.sizes.move_to_end(url)
+        while len(self.sizes) > MAX_KNOWN_SIZES:
+            self.sizes.popitem(last=False)
+        total = self.type_sizes.setdefault(resource_type, [0, 0])
+        total[0] += size
+        total[1] += 1
+
+    def _estimate_size(self, request, resource_type):
+        url = None
+        if request is not None:
+            url, resource_type = request[0], request[1] or resource_type
+        if url in self.sizes:
+            return self.sizes[url]
+        total, count = self.type_sizes.get(resource_type, [0, 0])
+        return total // count if count else 0
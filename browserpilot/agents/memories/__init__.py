@@ -1,9 +1,19 @@
 """Memory for agents."""
+import hashlib
+import json
 import os
+import re
+import shutil
+import time
+from urllib.parse import urlparse
 from llama_index.core import GPTVectorStoreIndex, GPTListIndex
-from llama_index.core import Document
+from llama_index.core import Document, Settings, get_response_synthesizer
 from llama_index.core import StorageContext, load_index_from_storage
-from langchain_openai import ChatOpenAI
+from llama_index.core.query_engine import RetrieverQueryEngine
+from llama_index.core.retrievers import BaseRetriever
+from llama_index.core.schema import MetadataMode, NodeWithScore
+from ..metrics import REGISTRY, count_embeddings
+from .vector_search import VectorSearch
 
 import logging
 
@@ -17,31 +27,363 @@ INDEX_TYPES = {
     # Good for aggregate summaries, but slow.
     "list": GPTListIndex,
 }
+# What to drop when a memory is over capacity. "lru" drops the page that was
+# least recently retrieved, "fifo" the one that was added first, and "ttl"
+# drops pages older than `ttl` seconds (then the oldest, if still over).
+EVICTION_POLICIES = ["lru", "fifo", "ttl"]
+DOCUMENTS_FILENAME = "memory_documents.json"
+NAMESPACES_FILENAME = "memory_namespaces.json"
+DEFAULT_NAMESPACE = "default"
+
+
+class MatrixRetriever(BaseRetriever):
+    """Retrieves the top k nodes of a Memory with one matrix-vector product,
+    instead of llama_index's per-embedding Python loop."""
+
+    def __init__(self, memory, similarity_top_k=3):
+        super().__init__()
+        self.memory = memory
+        self.similarity_top_k = similarity_top_k
+
+    def _retrieve(self, query_bundle):
+        return self.memory.retrieve(
+            query_bundle.query_str,
+            similarity_top_k=self.similarity_top_k,
+            query_embedding=query_bundle.embedding,
+        )
 
 
 class Memory:
-    def __init__(self, memory_folder=None, index_type="vector"):
+    def __init__(
+        self,
+        memory_folder=None,
+        index_type="vector",
+        mmap=False,
+        capacity=None,
+        eviction="lru",
+        ttl=None,
+        metrics=None,
+    ):
+        """Initialize the memory.
+
+        Args:
+            memory_folder (str): Folder to load the memory from, if it exists.
+            index_type (str): "vector" or "list".
+            mmap (bool): Memory-map the saved embedding matrix instead of
+                reading it into memory. The matrix is the only copy of the
+                embeddings: llama_index's vector store is left empty.
+            capacity (int): Maximum number of pages to keep. None for no limit.
+            eviction (str): Which pages to drop first, one of
+                `EVICTION_POLICIES`.
+            ttl (float): With the "ttl" policy, seconds a page is kept for.
+            metrics (MetricsRegistry): Where to count embeddings, queries and
+                evictions. Defaults to the shared registry.
+        """
         assert index_type in INDEX_TYPES, f"Invalid index type: {index_type}"
+        assert eviction in EVICTION_POLICIES, f"Invalid eviction policy: {eviction}"
+        assert eviction != "ttl" or ttl, "The ttl policy needs a ttl."
 
-        self.texts = []
+        self.index_type = index_type
+        self.capacity = capacity
+        self.eviction = eviction
+        self.ttl = ttl
+        self.metrics = metrics or REGISTRY
+        self.query_engines = {}  # similarity_top_k => query engine.
+        # Document id => node ids, and when it was added and last retrieved.
+        self.documents = {}
 
         if memory_folder and os.path.exists(memory_folder):
             logger.info("Loading memory from disk.")
             storage_context = StorageContext.from_defaults(persist_dir=memory_folder)
             self.index = load_index_from_storage(storage_context)
+            if VectorSearch.exists(memory_folder):
+                self.search = VectorSearch.load(memory_folder, mmap=mmap)
+            else:
+                self.search = self._search_from_vector_store()
+            self.documents = self._load_documents(memory_folder)
         else:
             self.index = INDEX_TYPES[index_type].from_documents([])
+            self.search = VectorSearch()
+
+    def __len__(self):
+        return len(self.documents)
 
     def query(self, prompt, similarity_top_k=3):
-        query_engine = self.index.as_query_engine(similarity_top_k=similarity_top_k)
-        return query_engine.query(prompt)
+        self.evict()
+        self.metrics.counter(
+            "browserpilot_memory_queries_total", "Memory queries."
+        ).inc()
+        if similarity_top_k not in self.query_engines:
+            if self.index_type == "vector":
+                retriever = MatrixRetriever(self, similarity_top_k=similarity_top_k)
+                query_engine = RetrieverQueryEngine.from_args(retriever)
+            else:
+                query_engine = self.index.as_query_engine(
+                    similarity_top_k=similarity_top_k
+                )
+            self.query_engines[similarity_top_k] = query_engine
+        with self.metrics.histogram(
+            "browserpilot_memory_query_seconds", "Memory query latency."
+        ).time():
+            resp = self.query_engines[similarity_top_k].query(prompt)
+        if self.index_type != "vector":
+            self.touch(resp.source_nodes)
+        return resp
+
+    def retrieve(self, prompt, similarity_top_k=3, query_embedding=None):
+        """Returns the nodes that best match `prompt`, without synthesizing a
+        response. Pass `query_embedding` to avoid embedding `prompt` again."""
+        self.evict()
+        if self.index_type != "vector":
+            nodes = self.index.as_retriever().retrieve(prompt)
+            self.touch(nodes)
+            return nodes
+        if query_embedding is None:
+            query_embedding = Settings.embed_model.get_query_embedding(prompt)
+            count_embeddings(self.metrics, "memory_query")
+        hits = self.search.top_k(query_embedding, similarity_top_k)
+        nodes = [
+            NodeWithScore(node=self.index.docstore.get_node(node_id), score=score)
+            for node_id, score in hits
+        ]
+        self.touch(nodes)
+        return nodes
+
+    def touch(self, nodes):
+        """Mark the documents of retrieved `nodes` as just used."""
+        now = time.time()
+        for node in nodes:
+            document = self.documents.get(node.node.ref_doc_id)
+            if document is not None:
+                document["last_retrieved"] = now
 
     def add(self, text):
-        if text in self.texts:
+        doc_id = hashlib.sha1(text.encode("utf-8")).hexdigest()
+        if doc_id in self.documents:
             logger.info("Skipping duplicate text.")
             return
-        self.texts.append(text)
-        self.index.insert(Document(text=text))
+        document = Document(text=text, id_=doc_id)
+        self.metrics.counter(
+            "browserpilot_memory_pages_total", "Pages added to memory."
+        ).inc()
+        now = time.time()
+        self.documents[doc_id] = {
+            "node_ids": [],
+            "added": now,
+            "last_retrieved": now,
+        }
+        if self.index_type != "vector":
+            self.index.insert(document)
+            self.documents[doc_id]["node_ids"] = list(
+                self.index.ref_doc_info[doc_id].node_ids
+            )
+            self.evict()
+            return
+
+        # Embed the chunks ourselves, in one batch. The embeddings only go
+        # into the matrix, and the nodes only into the docstore, which is
+        # all `retrieve` reads; the vector store would keep a second copy.
+        nodes = Settings.node_parser.get_nodes_from_documents([document])
+        embeddings = Settings.embed_model.get_text_embedding_batch(
+            [node.get_content(metadata_mode=MetadataMode.EMBED) for node in nodes]
+        )
+        count_embeddings(self.metrics, "memory", len(nodes))
+        self.index.docstore.add_documents(nodes)
+        self.search.add([node.node_id for node in nodes], embeddings)
+        self.documents[doc_id]["node_ids"] = [node.node_id for node in nodes]
+        self.evict()
+
+    def remove(self, doc_id):
+        """Drop a page from the index, the docstore and the matrix."""
+        document = self.documents.pop(doc_id)
+        self.metrics.counter(
+            "browserpilot_memory_evictions_total", "Pages evicted by policy."
+        ).inc(policy=self.eviction)
+        self.index.delete_ref_doc(doc_id, delete_from_docstore=True)
+        self.search.remove(document["node_ids"])
+
+    def evict(self):
+        """Drop pages until the memory is within its TTL and capacity."""
+        if self.eviction == "ttl":
+            cutoff = time.time() - self.ttl
+            for doc_id, document in list(self.documents.items()):
+                if document["added"] < cutoff:
+                    self.remove(doc_id)
+        if self.capacity is None or len(self) <= self.capacity:
+            return
+        key = "last_retrieved" if self.eviction == "lru" else "added"
+        by_age = sorted(self.documents, key=lambda doc_id: self.documents[doc_id][key])
+        for doc_id in by_age[: len(self) - self.capacity]:
+            logger.info(f"Evicting page {doc_id} from memory.")
+            self.remove(doc_id)
 
     def save(self, path):
-        self.index.storage_context.persist(path)
\ No newline at end of file
+        self.index.storage_context.persist(path)
+        if self.index_type == "vector":
+            self.search.save(path)
+        with open(os.path.join(path, DOCUMENTS_FILENAME), "w") as f:
+            json.dump(self.documents, f)
+
+    def _load_documents(self, memory_folder):
+        path = os.path.join(memory_folder, DOCUMENTS_FILENAME)
+        if os.path.exists(path):
+            with open(path) as f:
+                return json.load(f)
+        # Saved before documents were tracked, so age them all the same.
+        now = time.time()
+        return {
+            doc_id: {"node_ids": info.node_ids, "added": now, "last_retrieved": now}
+            for doc_id, info in self.index.ref_doc_info.items()
+        }
+
+    def _search_from_vector_store(self):
+        """Build the matrix from a memory saved before it existed, and empty
+        the vector store, which is saved without them next time."""
+        search = VectorSearch()
+        if self.index_type == "vector":
+            embedding_dict = self.index.vector_store.data.embedding_dict
+            search.add(list(embedding_dict), list(embedding_dict.values()))
+            embedding_dict.clear()
+        return search
+
+
+class NamespacedMemory:
+    """Memory split into namespaces, each its own `Memory` in a subfolder of
+    `memory_folder`, so that a query only scans the namespaces it targets.
+
+    Namespaces are loaded from disk the first time they are used. Each is
+    bounded by `capacity` and `eviction`, and the number of namespaces by
+    `max_namespaces` (the least recently used is deleted, from disk too).
+    """
+
+    def __init__(
+        self,
+        memory_folder=None,
+        namespace=None,
+        index_type="vector",
+        mmap=False,
+        capacity=None,
+        eviction="lru",
+        ttl=None,
+        max_namespaces=None,
+        metrics=None,
+    ):
+        """Initialize the namespaces.
+
+        Args:
+            memory_folder (str): Folder to load the namespaces from and save
+                them to.
+            namespace (str or callable): Which namespace a page goes into.
+                "domain" uses the domain of its URL, a callable is called
+                with its URL, any other string names a single namespace (e.g.
+                a job), and None puts everything in "default".
+            index_type, mmap, capacity, eviction, ttl, metrics: Passed to
+                each `Memory`.
+            max_namespaces (int): Maximum number of namespaces to keep. None
+                for no limit.
+        """
+        self.memory_folder = memory_folder
+        self.namespace = namespace
+        self.max_namespaces = max_namespaces
+        self.metrics = metrics or REGISTRY
+        self.memory_kwargs = {
+            "metrics": self.metrics,
+            "index_type": index_type,
+            "mmap": mmap,
+            "capacity": capacity,
+            "eviction": eviction,
+            "ttl": ttl,
+        }
+        self.memories = {}  # Namespace => loaded Memory.
+        self.namespaces = {}  # Namespace => {"folder", "last_used"}.
+        if memory_folder and os.path.exists(self._namespaces_path()):
+            with open(self._namespaces_path()) as f:
+                self.namespaces = json.load(f)
+        elif memory_folder and os.path.exists(os.path.join(memory_folder, "docstore.json")):
+            # Saved before namespaces existed.
+            self.namespaces[DEFAULT_NAMESPACE] = {"folder": ".", "last_used": time.time()}
+
+    def namespace_for(self, url=None):
+        if self.namespace is None:
+            return DEFAULT_NAMESPACE
+        if callable(self.namespace):
+            return self.namespace(url)
+        if self.namespace == "domain":
+            return urlparse(url or "").netloc or DEFAULT_NAMESPACE
+        return self.namespace
+
+    def add(self, text, url=None, namespace=None):
+        """Add a page to `namespace`, or to the namespace of `url`."""
+        if namespace is None:
+            namespace = self.namespace_for(url)
+        self._memory(namespace, create=True).add(text)
+
+    def query(self, prompt, namespace=None, similarity_top_k=3):
+        """Query one namespace, a list of them, or all of them (None). When
+        several are queried, their best nodes are merged before a single
+        response is synthesized."""
+        if namespace is None:
+            namespaces = list(self.namespaces)
+        elif isinstance(namespace, str):
+            namespaces = [namespace]
+        else:
+            namespaces = list(namespace)
+        memories = [self._memory(name) for name in namespaces]
+        memories = [memory for memory in memories if memory is not None]
+        if not memories:
+            logger.error(f"No memory for namespace {namespace}.")
+            return None
+        if len(memories) == 1:
+            return memories[0].query(prompt, similarity_top_k=similarity_top_k)
+
+        query_embedding = None
+        if self.memory_kwargs["index_type"] == "vector":
+            query_embedding = Settings.embed_model.get_query_embedding(prompt)
+            count_embeddings(self.metrics, "memory_query")
+        nodes = []
+        for memory in memories:
+            nodes += memory.retrieve(
+                prompt,
+                similarity_top_k=similarity_top_k,
+                query_embedding=query_embedding,
+            )
+        if query_embedding is not None:
+            nodes = sorted(nodes, key=lambda node: -node.score)[:similarity_top_k]
+        return get_response_synthesizer().synthesize(prompt, nodes)
+
+    def save(self, path=None):
+        path = path or self.memory_folder
+        for name, memory in self.memories.items():
+            memory.save(os.path.join(path, self.namespaces[name]["folder"]))
+        os.makedirs(path, exist_ok=True)
+        with open(os.path.join(path, NAMESPACES_FILENAME), "w") as f:
+            json.dump(self.namespaces, f)
+
+    def _namespaces_path(self):
+        return os.path.join(self.memory_folder, NAMESPACES_FILENAME)
+
+    def _memory(self, name, create=False):
+        if name not in self.namespaces:
+            if not create:
+                return None
+            folder = re.sub(r"[^\w.-]", "_", name)
+            self.namespaces[name] = {"folder": folder, "last_used": None}
+        self.namespaces[name]["last_used"] = time.time()
+        if name not in self.memories:
+            folder = None
+            if self.memory_folder:
+                folder = os.path.join(self.memory_folder, self.namespaces[name]["folder"])
+            self.memories[name] = Memory(memory_folder=folder, **self.memory_kwargs)
+        self._evict_namespaces()
+        return self.memories[name]
+
+    def _evict_namespaces(self):
+        if self.max_namespaces is None or len(self.namespaces) <= self.max_namespaces:
+            return
+        by_age = sorted(self.namespaces, key=lambda name: self.namespaces[name]["last_used"])
+        for name in by_age[: len(self.namespaces) - self.max_namespaces]:
+            logger.info(f"Evicting memory namespace {name}.")
+            folder = self.namespaces.pop(name)["folder"]
+            self.memories.pop(name, None)
+            if self.memory_folder and folder != ".":
+                shutil.rmtree(os.path.join(self.memory_folder, folder), ignore_errors=True)
@@ -0,0 +1,126 @@
+"""Brute-force cosine similarity search over a contiguous NumPy matrix."""
+import json
+import os
+import numpy as np
+
+EMBEDDINGS_FILENAME = "embeddings.npy"
+NORMS_FILENAME = "embedding_norms.npy"
+NODE_IDS_FILENAME = "embedding_node_ids.json"
+
+
+class VectorSearch:
+    """Keeps embeddings as rows of a float32 matrix, normalized up front, so
+    that a query is a single matrix-vector product plus `argpartition`.
+
+    The matrix grows by doubling, so adding rows is amortized O(1). The
+    norms are kept alongside, so the raw embeddings can be recovered.
+    """
+
+    def __init__(self):
+        self.node_ids = []
+        self.positions = {}  # Node id => row.
+        self._matrix = None  # Normalized rows; capacity >= len(self).
+        self._norms = None
+
+    def __len__(self):
+        return len(self.node_ids)
+
+    @property
+    def matrix(self):
+        """The normalized embeddings, one row per node."""
+        if self._matrix is None:
+            return np.zeros((0, 0), dtype=np.float32)
+        return self._matrix[: len(self)]
+
+    def add(self, node_ids, embeddings):
+        embeddings = np.asarray(embeddings, dtype=np.float32)
+        if embeddings.ndim != 2 or not len(embeddings):
+            return
+        norms = np.linalg.norm(embeddings, axis=1)
+        normalized = embeddings / np.maximum(norms, 1e-12)[:, None]
+
+        size = len(self)
+        self._reserve(size + len(embeddings), embeddings.shape[1])
+        self._matrix[size : size + len(embeddings)] = normalized
+        self._norms[size : size + len(embeddings)] = norms
+        for i, node_id in enumerate(node_ids):
+            self.positions[node_id] = size + i
+        self.node_ids.extend(node_ids)
+
+    def remove(self, node_ids):
+        """Remove rows, compacting the matrix."""
+        rows = [
+            self.positions[node_id] for node_id in node_ids if node_id in self.positions
+        ]
+        if not rows:
+            return
+        keep = np.ones(len(self), dtype=bool)
+        keep[rows] = False
+        self._matrix = np.ascontiguousarray(self.matrix[keep])
+        self._norms = np.ascontiguousarray(self._norms[: len(self)][keep])
+        self.node_ids = [node_id for node_id, kept in zip(self.node_ids, keep) if kept]
+        self.positions = {node_id: i for i, node_id in enumerate(self.node_ids)}
+
+    def top_k(self, query_embedding, k=3):
+        """Returns up to `k` (node_id, cosine similarity) tuples, best first."""
+        if not len(self):
+            return []
+        query = np.asarray(query_embedding, dtype=np.float32)
+        query = query / max(float(np.linalg.norm(query)), 1e-12)
+        scores = self.matrix @ query
+        k = min(k, len(scores))
+        if k < len(scores):
+            candidates = np.argpartition(-scores, k - 1)[:k]
+        else:
+            candidates = np.arange(len(scores))
+        best = candidates[np.argsort(-scores[candidates])]
+        return [(self.node_ids[i], float(scores[i])) for i in best]
+
+    def save(self, folder):
+        os.makedirs(folder, exist_ok=True)
+        norms = self._norms[: len(self)] if len(self) else np.zeros(0, np.float32)
+        np.save(os.path.join(folder, EMBEDDINGS_FILENAME), self.matrix)
+        np.save(os.path.join(folder, NORMS_FILENAME), norms)
+        with open(os.path.join(folder, NODE_IDS_FILENAME), "w") as f:
+            json.dump(self.node_ids, f)
+
+    @classmethod
+    def exists(cls, folder):
+        return os.path.exists(os.path.join(folder, NODE_IDS_FILENAME))
+
+    @classmethod
+    def load(cls, folder, mmap=False):
+        """Load from `folder`. With `mmap`, the matrix is memory-mapped
+        read-only, and only copied into memory once rows are added."""
+        search = cls()
+        mmap_mode = "r" if mmap else None
+        with open(os.path.join(folder, NODE_IDS_FILENAME)) as f:
+            node_ids = json.load(f)
+        if node_ids:
+            search._matrix = np.load(
+                os.path.join(folder, EMBEDDINGS_FILENAME), mmap_mode=mmap_mode
+            )
+            search._norms = np.load(
+                os.path.join(folder, NORMS_FILENAME), mmap_mode=mmap_mode
+            )
+        search.node_ids = node_ids
+        search.positions = {node_id: i for i, node_id in enumerate(node_ids)}
+        return search
+
+    def _reserve(self, rows, dim):
+        if self._matrix is not None and self._matrix.shape[1] != dim:
+            raise ValueError(
+                f"Embedding dimension {dim} does not match {self._matrix.shape[1]}."
+            )
+        capacity = 0 if self._matrix is None else len(self._matrix)
+        writable = self._matrix is not None and self._matrix.flags.writeable
+        if rows <= capacity and writable:
+            return
+        capacity = max(rows, 2 * capacity, 64)
+        matrix = np.empty((capacity, dim), dtype=np.float32)
+        norms = np.empty(capacity, dtype=np.float32)
+        size = len(self)
+        if size:
+            matrix[:size] = self._matrix[:size]
+            norms[:size] = self._norms[:size]
+        self._matrix, self._norms = matrix, norms
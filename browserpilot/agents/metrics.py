@@ -0,0 +1,231 @@
+"""Counters and histograms shared by the agent, the compiler and memory, with
+Prometheus text and JSON export."""
+import json
+import math
+import threading
+import time
+from contextlib import contextmanager
+
+# Seconds, for latencies.
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+# For counts, e.g. WebDriver commands per action.
+COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200, 500)
+
+
+def _labels_key(labels):
+    return tuple(sorted((key, str(value)) for key, value in labels.items()))
+
+
+def _format_labels(key, extra=()):
+    pairs = list(key) + list(extra)
+    if not pairs:
+        return ""
+    escaped = [
+        (name, value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+        for name, value in pairs
+    ]
+    return "{" + ",".join(f'{name}="{value}"' for name, value in escaped) + "}"
+
+
+def _format_value(value):
+    if value == math.inf:
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """A value per set of labels that only goes up."""
+
+    type = "counter"
+
+    def __init__(self, name, help_text, lock):
+        self.name = name
+        self.help = help_text
+        self.values = {}  # Labels key => value.
+        self._lock = lock
+
+    def inc(self, amount=1, **labels):
+        key = _labels_key(labels)
+        with self._lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def value(self, **labels):
+        return self.values.get(_labels_key(labels), 0)
+
+    def snapshot(self):
+        """The values, copied, so they can be exported while other threads
+        keep counting."""
+        with self._lock:
+            return sorted(self.values.items())
+
+    def to_prometheus(self):
+        return [
+            f"{self.name}{_format_labels(key)} {_format_value(value)}"
+            for key, value in self.snapshot()
+        ]
+
+    def to_dict(self):
+        return [{"labels": dict(key), "value": value} for key, value in self.snapshot()]
+
+
+class Histogram:
+    """Counts of observations per bucket, plus their sum, per set of labels."""
+
+    type = "histogram"
+
+    def __init__(self, name, help_text, lock, buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.buckets = tuple(buckets) + (math.inf,)
+        self.values = {}  # Labels key => {"buckets", "sum", "count"}.
+        self._lock = lock
+
+    def observe(self, value, **labels):
+        key = _labels_key(labels)
+        with self._lock:
+            series = self.values.get(key)
+            if series is None:
+                series = self.values[key] = {
+                    "buckets": [0] * len(self.buckets),
+                    "sum": 0.0,
+                    "count": 0,
+                }
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series["buckets"][i] += 1
+                    break
+            series["sum"] += value
+            series["count"] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def snapshot(self):
+        with self._lock:
+            return sorted(
+                (key, dict(series, buckets=list(series["buckets"])))
+                for key, series in self.values.items()
+            )
+
+    def to_prometheus(self):
+        lines = []
+        for key, series in self.snapshot():
+            cumulative = 0
+            for bound, count in zip(self.buckets, series["buckets"]):
+                cumulative += count
+                le = (("le", _format_value(bound)),)
+                lines.append(f"{self.name}_bucket{_format_labels(key, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(key)} {_format_value(series['sum'])}")
+            lines.append(f"{self.name}_count{_format_labels(key)} {series['count']}")
+        return lines
+
+    def to_dict(self):
+        return [
+            {
+                "labels": dict(key),
+                "count": series["count"],
+                "sum": series["sum"],
+                "buckets": {
+                    _format_value(bound): count
+                    for bound, count in zip(self.buckets, series["buckets"])
+                },
+            }
+            for key, series in self.snapshot()
+        ]
+
+
+class MetricsRegistry:
+    """Named counters and histograms, created on first use."""
+
+    def __init__(self):
+        self.metrics = {}
+        self._lock = threading.Lock()
+
+    def counter(self, name, help_text=""):
+        return self._get(name, Counter, help_text)
+
+    def histogram(self, name, help_text="", buckets=DEFAULT_BUCKETS):
+        return self._get(name, Histogram, help_text, buckets=buckets)
+
+    def reset(self):
+        with self._lock:
+            self.metrics = {}
+
+    def to_prometheus(self):
+        """The text exposition format, for a /metrics endpoint or a .prom
+        file for node_exporter's textfile collector."""
+        lines = []
+        for name, metric in self._snapshot():
+            if metric.help:
+                lines.append(f"# HELP {name} {metric.help}")
+            lines.append(f"# TYPE {name} {metric.type}")
+            lines.extend(metric.to_prometheus())
+        return "\n".join(lines) + "\n"
+
+    def to_dict(self):
+        return {
+            name: {"type": metric.type, "help": metric.help, "values": metric.to_dict()}
+            for name, metric in self._snapshot()
+        }
+
+    def dump(self, filename):
+        """Write JSON if `filename` ends with .json, else Prometheus text."""
+        with open(filename, "w") as f:
+            if filename.endswith(".json"):
+                json.dump(self.to_dict(), f, indent=2)
+            else:
+                f.write(self.to_prometheus())
+
+    def _snapshot(self):
+        with self._lock:
+            return sorted(self.metrics.items())
+
+    def _get(self, name, cls, help_text, **kwargs):
+        metric = self.metrics.get(name)
+        if metric is None:
+            with self._lock:
+                metric = self.metrics.get(name)
+                if metric is None:
+                    metric = self.metrics[name] = cls(name, help_text, self._lock, **kwargs)
+        assert isinstance(metric, cls), f"{name} is a {metric.type}."
+        return metric
+
+
+# Shared by every agent, compiler and memory in the process unless they are
+# given their own.
+REGISTRY = MetricsRegistry()
+
+
+def count_embeddings(metrics, source, texts=1):
+    """Count a call to the embedding model for `texts` texts."""
+    metrics.counter(
+        "browserpilot_embedding_batches_total", "Embedding model calls by source."
+    ).inc(source=source)
+    metrics.counter(
+        "browserpilot_embedding_texts_total", "Texts embedded by source."
+    ).inc(texts, source=source)
+
+
+def record_sleep(metrics, seconds, action):
+    """Count time deliberately spent waiting in `action`."""
+    metrics.counter(
+        "browserpilot_sleep_seconds_total", "Seconds spent sleeping by action."
+    ).inc(seconds, action=action)
+
+
+def instrument_driver(driver, on_command):
+    """Wrap `driver.execute`, through which every WebDriver command goes
+    (including CDP commands), to call `on_command(name)` first."""
+    execute = driver.execute
+
+    def counted_execute(driver_command, params=None):
+        on_command(driver_command)
+        return execute(driver_command, params)
+
+    driver.execute = counted_execute
+    return driver
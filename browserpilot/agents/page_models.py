@@ -0,0 +1,641 @@
+"""Page models: how the agent reads the DOM, layout and visibility of a page."""
+import logging
+import re
+import time
+
+from selenium.common.exceptions import WebDriverException
+from selenium.webdriver.common.by import By
+from selenium.webdriver.remote.command import Command
+
+from .metrics import instrument_driver
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+PAGE_MODELS = ["auto", "cdp", "webdriver"]
+
+# Computed styles requested from `DOMSnapshot.captureSnapshot`. The order
+# matters, since the snapshot returns the values positionally.
+SNAPSHOT_STYLES = ["display", "visibility", "opacity", "pointer-events"]
+DISPLAY, VISIBILITY, OPACITY, POINTER_EVENTS = range(len(SNAPSHOT_STYLES))
+INLINE_DISPLAYS = set(["inline", "contents", ""])
+# A snapshot is reused until a command that may change the page is sent, or
+# until it is this old (seconds), since pages also change on their own.
+SNAPSHOT_MAX_AGE = 1.0
+# WebDriver commands after which a snapshot is still good.
+READ_ONLY_COMMANDS = set(
+    [
+        Command.FIND_ELEMENT,
+        Command.FIND_ELEMENTS,
+        Command.FIND_CHILD_ELEMENT,
+        Command.FIND_CHILD_ELEMENTS,
+        Command.SWITCH_TO_FRAME,
+        Command.SWITCH_TO_PARENT_FRAME,
+        Command.GET_CURRENT_URL,
+        Command.GET_TITLE,
+        Command.W3C_GET_CURRENT_WINDOW_HANDLE,
+        Command.W3C_GET_WINDOW_HANDLES,
+        Command.GET_ELEMENT_TEXT,
+        Command.GET_ELEMENT_TAG_NAME,
+        Command.GET_ELEMENT_ATTRIBUTE,
+        Command.GET_ELEMENT_PROPERTY,
+        Command.GET_ELEMENT_RECT,
+        Command.GET_ELEMENT_VALUE_OF_CSS_PROPERTY,
+        Command.IS_ELEMENT_SELECTED,
+        Command.IS_ELEMENT_ENABLED,
+    ]
+)
+# Locators that can be matched against the attributes in a snapshot, and the
+# attribute they match (None for the tag name).
+SNAPSHOT_LOCATORS = {
+    By.ID: "id",
+    By.NAME: "name",
+    By.CLASS_NAME: "class",
+    By.TAG_NAME: None,
+}
+# ChromeDriver's element references end with the backend node id of the
+# element, e.g. "f.<frame>.d.<document>.e.42".
+BACKEND_NODE_ID = re.compile(r"\.e\.(\d+)$")
+
+IS_VISIBLE_IN_VIEWPORT_SCRIPT = (
+    "var elem = arguments[0],                 "
+    "  box = elem.getBoundingClientRect(),    "
+    "  cx = box.left + box.width / 2,         "
+    "  cy = box.top + box.height / 2,         "
+    "  e = document.elementFromPoint(cx, cy); "
+    "for (; e; e = e.parentElement) {         "
+    "  if (e === elem)                        "
+    "    return true;                         "
+    "}                                        "
+    "return false;                            "
+)
+
+# Batched equivalent of calling `is_displayed()` on every element.
+ARE_DISPLAYED_SCRIPT = """
+return arguments[0].map(function (e) {
+    if (e.getClientRects().length === 0) {
+        return false;
+    }
+    if (e.checkVisibility) {
+        return e.checkVisibility({checkOpacity: true, checkVisibilityCSS: true});
+    }
+    var style = window.getComputedStyle(e);
+    return style.display !== 'none' && style.visibility !== 'hidden' && style.opacity !== '0';
+});
+"""
+
+# Returns up to `limit` displayed elements matching the query that iterator
+# `token` has not returned yet. The first call queries the whole document and
+# installs a MutationObserver; later calls only look at what was added since,
+# plus the matches still waiting (hidden, or past `limit`), so each round costs
+# the new elements rather than the whole feed. XPath can't be matched against
+# a subtree, so it is queried again, but only after something was added.
+# Elements are held in WeakSets or dropped once detached. If there are none,
+# scrolls down a viewport for more to load.
+NEW_ELEMENTS_SCRIPT = """
+var token = arguments[0], by = arguments[1], value = arguments[2], limit = arguments[3];
+var iters = window.__bpIters = window.__bpIters || {};
+function matches(e) {
+    if (by === 'link text' || by === 'partial link text') {
+        if (e.tagName !== 'A') {
+            return false;
+        }
+        var text = e.innerText.trim();
+        return by === 'link text' ? text === value : text.indexOf(value) !== -1;
+    }
+    return e.matches(value);
+}
+function query(root) {
+    var found = [];
+    if (by === 'xpath') {
+        var result = document.evaluate(value, document, null, XPathResult.ORDERED_NODE_SNAPSHOT_TYPE, null);
+        for (var i = 0; i < result.snapshotLength; i++) {
+            found.push(result.snapshotItem(i));
+        }
+        return found;
+    }
+    if (root.nodeType === 1 && matches(root)) {
+        found.push(root);
+    }
+    var selector = by === 'css selector' ? value : 'a';
+    Array.prototype.forEach.call(root.querySelectorAll(selector), function (e) {
+        if (by === 'css selector' || matches(e)) {
+            found.push(e);
+        }
+    });
+    return found;
+}
+var it = iters[token];
+function enqueue(found) {
+    for (var i = 0; i < found.length; i++) {
+        var e = found[i];
+        if (e.nodeType === 1 && !it.queued.has(e)) {
+            it.queued.add(e);
+            it.waiting.push(e);
+        }
+    }
+}
+if (!it) {
+    it = iters[token] = {queued: new WeakSet(), waiting: [], added: [], observer: null};
+    it.observer = new MutationObserver(function (records) {
+        for (var i = 0; i < records.length; i++) {
+            records[i].addedNodes.forEach(function (n) {
+                if (n.nodeType === 1) {
+                    it.added.push(n);
+                }
+            });
+        }
+    });
+    it.observer.observe(document.documentElement, {subtree: true, childList: true});
+    enqueue(query(document));
+} else if (it.added.length > 0) {
+    if (by === 'xpath') {
+        enqueue(query(document));
+    } else {
+        it.added.forEach(function (n) {
+            if (n.isConnected) {
+                enqueue(query(n));
+            }
+        });
+    }
+}
+it.added = [];
+var fresh = [], waiting = [];
+for (var i = 0; i < it.waiting.length; i++) {
+    var e = it.waiting[i];
+    if (!e.isConnected) {
+        continue;
+    }
+    // Hidden elements are left for later, in case they are shown.
+    if (fresh.length < limit && e.getClientRects().length > 0) {
+        fresh.push(e);
+    } else {
+        waiting.push(e);
+    }
+}
+it.waiting = waiting;
+if (fresh.length === 0) {
+    window.scrollBy(0, window.innerHeight);
+}
+return fresh;
+"""
+FORGET_ITERATOR_SCRIPT = """
+var iters = window.__bpIters || {};
+if (iters[arguments[0]]) {
+    iters[arguments[0]].observer.disconnect();
+    delete iters[arguments[0]];
+}
+"""
+
+
+def _as_query(by, value):
+    """Turns a Selenium locator into one NEW_ELEMENTS_SCRIPT understands,
+    the same way the remote driver turns id, name and class name locators
+    into CSS selectors."""
+    if by == By.ID:
+        return By.CSS_SELECTOR, '[id="%s"]' % value.replace('"', '\\"')
+    if by == By.NAME:
+        return By.CSS_SELECTOR, '[name="%s"]' % value.replace('"', '\\"')
+    if by == By.CLASS_NAME:
+        return By.CSS_SELECTOR, "." + value
+    if by == By.TAG_NAME:
+        return By.CSS_SELECTOR, value
+    return by, value
+
+
+def make_page_model(driver, page_model="auto"):
+    """Returns the page model for `driver`. "auto" picks the Chrome DevTools
+    Protocol one when the driver supports it, e.g. not on Selenium Grid."""
+    assert page_model in PAGE_MODELS, f"Invalid page model: {page_model}"
+    if page_model == "auto":
+        has_cdp = hasattr(driver, "execute_cdp_cmd")
+        page_model = "cdp" if has_cdp else "webdriver"
+    logger.info(f"Using {page_model} page model.")
+    if page_model == "cdp":
+        return CDPPageModel(driver)
+    return WebDriverPageModel(driver)
+
+
+class WebDriverPageModel:
+    """Reads the page with plain WebDriver commands. Works everywhere, but
+    costs a round trip per frame and per element."""
+
+    def __init__(self, driver):
+        self.driver = driver
+
+    def find_elements(self, by="id", value=None):
+        """Returns (element, iframe) tuples for all displayed elements on the
+        page and in its iframes that match `by` and `value`."""
+        elements = self.driver.find_elements(by, value)
+        elements = [(element, None) for element in self._displayed(elements)]
+        iframes = self.driver.find_elements(by=By.TAG_NAME, value="iframe")
+        logger.debug(f"Found {len(iframes)} iframes.")
+        for iframe in iframes:
+            self.driver.switch_to.frame(iframe)
+            iframe_elements = self.driver.find_elements(by, value)
+            elements.extend(
+                (element, iframe) for element in self._displayed(iframe_elements)
+            )
+            self.driver.switch_to.default_content()
+        return elements
+
+    def get_text(self):
+        """Returns the visible text from the page and its iframes."""
+        text = self.driver.find_element(by=By.TAG_NAME, value="body").text
+
+        # Check for iframes too.
+        iframes = self.driver.find_elements(by=By.TAG_NAME, value="iframe")
+        for iframe in iframes:
+            self.driver.switch_to.frame(iframe)
+            visible_text = self.driver.find_element(
+                by=By.TAG_NAME, value="body"
+            ).text
+            text = text + "\n" + visible_text
+            self.driver.switch_to.default_content()
+
+        return text
+
+    def new_elements(self, token, by, value, limit=50):
+        """Returns up to `limit` displayed elements of the top frame that
+        match `by` and `value` and that were not returned for `token` yet,
+        in document order. If there are none, scrolls down so that more can
+        load. Costs one script."""
+        by, value = _as_query(by, value)
+        return self.driver.execute_script(NEW_ELEMENTS_SCRIPT, token, by, value, limit)
+
+    def forget(self, token):
+        """Drop what the page remembers for `token`."""
+        self.driver.execute_script(FORGET_ITERATOR_SCRIPT, token)
+
+    def is_visible_in_viewport(self, element):
+        """Whether `element` is visible in the viewport. Expects the driver to
+        be switched to the element's frame already."""
+        return self.driver.execute_script(IS_VISIBLE_IN_VIEWPORT_SCRIPT, element)
+
+    def _displayed(self, elements):
+        return [element for element in elements if element.is_displayed()]
+
+
+class CDPPageModel(WebDriverPageModel):
+    """Reads the page through the Chrome DevTools Protocol.
+
+    `DOMSnapshot.captureSnapshot` returns the DOM, layout, paint order and
+    computed styles of every frame in one call. Text is read from it, and so
+    are the visibility of found elements and whether one is visible in the
+    viewport, by the backend node id in its ChromeDriver reference, without
+    a command per element. WebDriver is still needed for the element
+    references themselves, but `find_elements` only switches into iframes
+    that are displayed and, for id, name, class name and tag name locators,
+    that have a match in the snapshot.
+
+    A snapshot is reused until a command that may change the page goes out
+    (see READ_ONLY_COMMANDS) or it is SNAPSHOT_MAX_AGE old. Frames that are
+    not in it (out-of-process iframes, e.g. cross-origin ones) and elements
+    whose reference has no backend node id are read with WebDriver instead.
+    Falls back to plain WebDriver if the browser refuses a CDP command.
+    """
+
+    def __init__(self, driver):
+        super().__init__(driver)
+        self.cdp_available = True
+        self.snapshot = None  # Cached, see `_snapshot`.
+        self.reading = False  # Whether our own read-only commands are out.
+        instrument_driver(driver, self._on_command)
+
+    def capture_snapshot(self):
+        """Returns the raw `DOMSnapshot.captureSnapshot` result for all
+        frames."""
+        return self.driver.execute_cdp_cmd(
+            "DOMSnapshot.captureSnapshot",
+            {"computedStyles": SNAPSHOT_STYLES, "includePaintOrder": True},
+        )
+
+    def get_text(self):
+        snapshot = self._snapshot()
+        if snapshot is None:
+            return super().get_text()
+
+        strings = snapshot.raw["strings"]
+        texts = [
+            _get_document_text(document, strings)
+            for document in snapshot.raw["documents"]
+        ]
+        missing = [
+            node_index
+            for node_index in snapshot.iframes()
+            if snapshot.content_document(node_index) is None
+        ]
+        if missing:
+            iframe_texts = self._missing_frame_texts(snapshot, missing)
+            if iframe_texts is None:
+                return super().get_text()
+            texts.extend(iframe_texts)
+        return "\n".join([text for text in texts if text])
+
+    def find_elements(self, by="id", value=None):
+        snapshot = self._snapshot()
+        if snapshot is None:
+            return super().find_elements(by, value)
+
+        with self._read_only():
+            elements = self.driver.find_elements(by, value)
+            elements = [(element, None) for element in self._displayed(elements, 0)]
+            iframes = self.driver.find_elements(by=By.TAG_NAME, value="iframe")
+            for iframe in iframes:
+                node = snapshot.node(_backend_node_id(iframe))
+                if node is not None and node[0] != 0:
+                    node = None  # Another process's node with the same id.
+                if node is not None and not snapshot.may_contain(node[1], by, value):
+                    continue
+                # Backend node ids are only unique within a process, so only
+                # look up elements of a document that is in the snapshot.
+                doc_index = None if node is None else snapshot.content_document(node[1])
+                self.driver.switch_to.frame(iframe)
+                iframe_elements = self.driver.find_elements(by, value)
+                elements.extend(
+                    (element, iframe)
+                    for element in self._displayed(iframe_elements, doc_index)
+                )
+                self.driver.switch_to.default_content()
+        return elements
+
+    def is_visible_in_viewport(self, element):
+        if getattr(element, "iframe", None) is not None:
+            # In an iframe, which has a viewport of its own.
+            return super().is_visible_in_viewport(element)
+        snapshot = self._snapshot(viewport=True)
+        node = None if snapshot is None else snapshot.node(_backend_node_id(element))
+        if node is None or node[0] != 0:
+            return super().is_visible_in_viewport(element)
+        return snapshot.is_visible_in_viewport(node[1])
+
+    def _displayed(self, elements, doc_index=None):
+        """The `elements` that are displayed. They are looked up in the
+        snapshot if they are in document `doc_index` of it, and checked with
+        one script otherwise."""
+        if not elements:
+            return elements
+        snapshot = None if doc_index is None else self._snapshot()
+        nodes = []
+        if snapshot is not None:
+            nodes = [snapshot.node(_backend_node_id(element)) for element in elements]
+        if snapshot is None or any(
+            node is None or node[0] != doc_index for node in nodes
+        ):
+            with self._read_only():
+                displayed = self.driver.execute_script(ARE_DISPLAYED_SCRIPT, elements)
+        else:
+            displayed = [snapshot.is_displayed(*node) for node in nodes]
+        return [element for element, shown in zip(elements, displayed) if shown]
+
+    def _missing_frame_texts(self, snapshot, iframe_nodes):
+        """The text of the iframes of the top document at `iframe_nodes`,
+        read with WebDriver. None if they can't be found."""
+        with self._read_only():
+            iframes = self.driver.find_elements(by=By.TAG_NAME, value="iframe")
+        by_node = {}
+        for iframe in iframes:
+            node = snapshot.node(_backend_node_id(iframe))
+            if node is not None and node[0] == 0:
+                by_node[node[1]] = iframe
+        if any(node_index not in by_node for node_index in iframe_nodes):
+            return None
+
+        texts = []
+        with self._read_only():
+            for node_index in iframe_nodes:
+                try:
+                    self.driver.switch_to.frame(by_node[node_index])
+                    body = self.driver.find_element(by=By.TAG_NAME, value="body")
+                    texts.append(body.text)
+                except WebDriverException as exc:
+                    logger.debug(f"Could not read an iframe: {exc}")
+                finally:
+                    self.driver.switch_to.default_content()
+        return texts
+
+    def _snapshot(self, viewport=False):
+        """The current `_Snapshot`, taken again if the cached one may be out
+        of date. With `viewport`, it knows the viewport too. None without
+        CDP."""
+        if not self.cdp_available:
+            return None
+        snapshot = self.snapshot
+        fresh = snapshot is not None and time.time() - snapshot.time < SNAPSHOT_MAX_AGE
+        try:
+            with self._read_only():
+                if not fresh:
+                    snapshot = self.snapshot = _Snapshot(self.capture_snapshot())
+                if viewport and snapshot.viewport is None:
+                    metrics = self.driver.execute_cdp_cmd("Page.getLayoutMetrics", {})
+                    snapshot.viewport = metrics["cssLayoutViewport"]
+        except WebDriverException as exc:
+            self._disable_cdp(exc)
+            return None
+        return snapshot
+
+    def _read_only(self):
+        return _ReadOnly(self)
+
+    def _on_command(self, command):
+        if not self.reading and command not in READ_ONLY_COMMANDS:
+            self.snapshot = None
+
+    def _disable_cdp(self, exc):
+        logger.warning(
+            f"CDP is unavailable, falling back to WebDriver page model: {exc}"
+        )
+        self.cdp_available = False
+        self.snapshot = None
+
+
+class _ReadOnly:
+    """Marks the commands a CDPPageModel sends within it as ones that don't
+    change the page."""
+
+    def __init__(self, page_model):
+        self.page_model = page_model
+        self.outer = None
+
+    def __enter__(self):
+        self.outer = self.page_model.reading
+        self.page_model.reading = True
+
+    def __exit__(self, *exc_info):
+        self.page_model.reading = self.outer
+
+
+def _backend_node_id(element):
+    match = BACKEND_NODE_ID.search(getattr(element, "id", None) or "")
+    return int(match.group(1)) if match else None
+
+
+class _Snapshot:
+    """Lookups into one `DOMSnapshot.captureSnapshot` result. Nodes are
+    (document index, node index) pairs."""
+
+    def __init__(self, raw):
+        self.raw = raw
+        self.time = time.time()
+        self.viewport = None  # `cssLayoutViewport` of Page.getLayoutMetrics.
+        self.strings = raw["strings"]
+        self.nodes = {}  # Backend node id => node.
+        self.layouts = []  # Per document: node index => first layout index.
+        self.content_documents = {}  # Node index in the top document => document.
+        for doc_index, document in enumerate(raw["documents"]):
+            for node_index, backend_id in enumerate(document["nodes"]["backendNodeId"]):
+                self.nodes[backend_id] = (doc_index, node_index)
+            layout = {}
+            for i, node_index in enumerate(document["layout"]["nodeIndex"]):
+                layout.setdefault(node_index, i)
+            self.layouts.append(layout)
+        top = raw["documents"][0]["nodes"] if raw["documents"] else {}
+        content = top.get("contentDocumentIndex", {"index": [], "value": []})
+        self.content_documents = dict(zip(content["index"], content["value"]))
+
+    def node(self, backend_node_id):
+        return self.nodes.get(backend_node_id)
+
+    def iframes(self):
+        """Node indices of the iframes of the top document."""
+        if not self.raw["documents"]:
+            return []
+        names = self.raw["documents"][0]["nodes"]["nodeName"]
+        return [i for i, name in enumerate(names) if self.strings[name] == "IFRAME"]
+
+    def content_document(self, node_index):
+        """Index of the document in iframe `node_index` of the top document,
+        or None if it is not in the snapshot, e.g. out of process."""
+        return self.content_documents.get(node_index)
+
+    def style(self, doc_index, node_index, style):
+        layout_index = self.layouts[doc_index].get(node_index)
+        if layout_index is None:
+            return None
+        styles = self.raw["documents"][doc_index]["layout"]["styles"]
+        value = styles[layout_index][style]
+        return self.strings[value] if value >= 0 else ""
+
+    def is_displayed(self, doc_index, node_index):
+        """Like ARE_DISPLAYED_SCRIPT: the node has a box, isn't hidden, and
+        neither it nor an ancestor is transparent."""
+        if node_index not in self.layouts[doc_index]:
+            return False
+        if self.style(doc_index, node_index, VISIBILITY) in ["hidden", "collapse"]:
+            return False
+        parents = self.raw["documents"][doc_index]["nodes"]["parentIndex"]
+        while node_index >= 0:
+            if self.style(doc_index, node_index, OPACITY) == "0":
+                return False
+            node_index = parents[node_index]
+        return True
+
+    def may_contain(self, iframe_node, by, value):
+        """Whether iframe `iframe_node` of the top document may hold
+        elements found by `by` and `value`: it is displayed, and for simple
+        locators, its document (if in the snapshot) has a match."""
+        if not self.is_displayed(0, iframe_node):
+            return False
+        doc_index = self.content_document(iframe_node)
+        if doc_index is None or by not in SNAPSHOT_LOCATORS:
+            return True
+        nodes = self.raw["documents"][doc_index]["nodes"]
+        if by == By.TAG_NAME:
+            names = [self.strings[name].lower() for name in nodes["nodeName"]]
+            return value.lower() in names
+        for attributes in nodes["attributes"]:
+            for i in range(0, len(attributes), 2):
+                if self.strings[attributes[i]] != SNAPSHOT_LOCATORS[by]:
+                    continue
+                found = self.strings[attributes[i + 1]]
+                if found == value or by == By.CLASS_NAME and value in found.split():
+                    return True
+        return False
+
+    def is_visible_in_viewport(self, node_index):
+        """Like IS_VISIBLE_IN_VIEWPORT_SCRIPT, for a node of the top
+        document: the center of its box is in the viewport, and what is
+        painted on top there (ignoring `pointer-events: none`, as
+        `elementFromPoint` does) is the node or one of its descendants."""
+        layout_index = self.layouts[0].get(node_index)
+        if layout_index is None:
+            return False
+        layout = self.raw["documents"][0]["layout"]
+        x, y, width, height = layout["bounds"][layout_index]
+        cx, cy = x + width / 2, y + height / 2
+        viewport = self.viewport
+        if not (
+            viewport["pageX"] <= cx < viewport["pageX"] + viewport["clientWidth"]
+            and viewport["pageY"] <= cy < viewport["pageY"] + viewport["clientHeight"]
+        ):
+            return False
+
+        top, top_order = None, -1
+        for i, (left, upper, box_width, box_height) in enumerate(layout["bounds"]):
+            order = layout["paintOrders"][i]
+            if order <= top_order or not (
+                left <= cx < left + box_width and upper <= cy < upper + box_height
+            ):
+                continue
+            hit = layout["nodeIndex"][i]
+            if self.style(0, hit, POINTER_EVENTS) == "none":
+                continue
+            top, top_order = hit, order
+        parents = self.raw["documents"][0]["nodes"]["parentIndex"]
+        while top is not None and top >= 0:
+            if top == node_index:
+                return True
+            top = parents[top]
+        return False
+
+
+def _get_document_text(document, strings):
+    """Rebuild the rendered text of one document of a DOM snapshot.
+
+    Only text that has a layout box and is not `visibility: hidden` is kept.
+    Runs of text that share the same block-level ancestor are joined with
+    spaces, and different blocks are separated by newlines, which is roughly
+    what `innerText` does.
+    """
+    parents = document["nodes"]["parentIndex"]
+    layout = document["layout"]
+
+    # Node index => [display, visibility].
+    styles = {}
+    for i, node_index in enumerate(layout["nodeIndex"]):
+        styles[node_index] = [
+            strings[s] if s >= 0 else "" for s in layout["styles"][i]
+        ]
+
+    blocks = {}
+
+    def block_of(node_index):
+        """Nearest ancestor of `node_index` that is not displayed inline."""
+        if node_index in blocks:
+            return blocks[node_index]
+        block = parents[node_index]
+        while block >= 0 and styles.get(block, [""])[0] in INLINE_DISPLAYS:
+            block = parents[block]
+        blocks[node_index] = block
+        return block
+
+    lines = []
+    last_block = None
+    for i, node_index in enumerate(layout["nodeIndex"]):
+        text_index = layout["text"][i]
+        if text_index < 0:
+            continue
+        style = styles.get(node_index) or styles.get(parents[node_index], ["", ""])
+        if style[1] == "hidden":
+            continue
+        text = " ".join(strings[text_index].split())
+        if not text:
+            continue
+        block = block_of(node_index)
+        if lines and block == last_block:
+            lines[-1] = lines[-1] + " " + text
+        else:
+            lines.append(text)
+        last_block = block
+
+    return "\n".join(lines)
@@ -0,0 +1,196 @@
+"""Fetching server-rendered pages over plain HTTP, for read-only steps that
+don't need the browser to run the page."""
+import logging
+import re
+from http.cookies import CookieError, SimpleCookie
+from urllib.parse import urlsplit
+
+from selenium.common.exceptions import WebDriverException
+
+from .metrics import REGISTRY
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+MIN_TEXT_LENGTH = 200  # Characters. Less, with scripts on the page, means JS renders it.
+# Ids of the element that single-page app frameworks render into.
+APP_ROOT_IDS = ["root", "app", "__next", "__nuxt", "___gatsby", "svelte"]
+# Elements whose text is never shown.
+INVISIBLE_ELEMENTS = ["head", "script", "style", "noscript", "template", "svg"]
+HTML_CONTENT_TYPES = ["text/html", "application/xhtml+xml"]
+MAX_RETRIES = 2  # Per kind of error: connect, read, status, other.
+MAX_REDIRECTS = 5  # Counted apart, so retries don't use them up.
+
+
+class StaticPage:
+    """A page fetched without the browser."""
+
+    def __init__(self, url, status, text):
+        self.url = url  # After redirects.
+        self.status = status
+        self.text = text
+
+
+def needs_javascript(soup):
+    """Returns why the page in `soup` probably needs a browser to render or
+    behave (e.g. "empty #root"), or None if its HTML looks complete. See
+    also MIN_TEXT_LENGTH."""
+    if soup.find("meta", attrs={"http-equiv": re.compile("^refresh$", re.I)}):
+        return "meta refresh"
+    for root_id in APP_ROOT_IDS:
+        root = soup.find(id=root_id)
+        if root is not None and not root.get_text(strip=True):
+            return f"empty #{root_id}"
+    return None
+
+
+def get_visible_text(soup):
+    """The text of the page that would be shown, one block per line. Like
+    `WebDriverPageModel.get_text`, but without CSS, so only elements hidden
+    with the `hidden` attribute or an inline style are left out."""
+    for name in INVISIBLE_ELEMENTS:
+        for tag in soup.find_all(name):
+            tag.decompose()
+    hidden_style = re.compile(r"display\s*:\s*none|visibility\s*:\s*hidden")
+    for tag in soup.find_all(True):
+        if tag.decomposed:
+            continue  # Inside an element removed before.
+        if tag.has_attr("hidden") or hidden_style.search(tag.get("style", "")):
+            tag.decompose()
+    return soup.get_text("\n", strip=True)
+
+
+class StaticFetcher:
+    """Fetches pages with a pooled HTTP client that sends the browser's
+    cookies and user agent, so the server sees the same session.
+
+    `fetch` returns None whenever the page should be loaded in the browser
+    instead: it isn't HTML, the request failed, or `needs_javascript` says
+    so. Cookies the server sets are copied into the browser over CDP when it
+    is available, and kept for later fetches otherwise.
+    """
+
+    def __init__(self, driver, max_connections=10, timeout=10, metrics=None):
+        import urllib3
+
+        self.driver = driver
+        self.metrics = metrics or REGISTRY
+        self.http = urllib3.PoolManager(
+            maxsize=max_connections,
+            timeout=urllib3.Timeout(total=timeout),
+            # Without `total`, which would count redirects as retries too.
+            retries=urllib3.Retry(
+                total=None,
+                connect=MAX_RETRIES,
+                read=MAX_RETRIES,
+                status=MAX_RETRIES,
+                other=MAX_RETRIES,
+                redirect=MAX_REDIRECTS,
+                raise_on_redirect=False,
+            ),
+        )
+        self.user_agent = None  # Read from the browser on first use.
+        self.cookies = {}  # Hostname => {name: value}, without CDP.
+
+    def fetch(self, url):
+        """Returns a StaticPage, or None to use the browser."""
+        import urllib3
+        from bs4 import BeautifulSoup
+
+        headers = urllib3.util.make_headers(accept_encoding=True)
+        headers["User-Agent"] = self._user_agent()
+        headers["Accept"] = "text/html,application/xhtml+xml;q=0.9,*/*;q=0.8"
+        cookie = self._cookie_header(url)
+        if cookie:
+            headers["Cookie"] = cookie
+        try:
+            response = self.http.request("GET", url, headers=headers)
+        except urllib3.exceptions.HTTPError as exc:
+            return self._fall_back(url, f"request failed: {exc}")
+
+        final_url = response.geturl() or url
+        self._store_cookies(final_url, response.headers.getlist("Set-Cookie"))
+        content_type = response.headers.get("Content-Type", "").split(";")[0].strip()
+        if response.status >= 400:
+            return self._fall_back(url, f"status {response.status}")
+        if content_type.lower() not in HTML_CONTENT_TYPES:
+            return self._fall_back(url, f"content type {content_type or 'unknown'}")
+
+        soup = BeautifulSoup(response.data, "html.parser")
+        reason = needs_javascript(soup)
+        if reason is not None:
+            return self._fall_back(url, reason)
+        has_scripts = soup.find("script") is not None
+        text = get_visible_text(soup)
+        if has_scripts and len(text) < MIN_TEXT_LENGTH:
+            return self._fall_back(url, "little text before scripts run")
+
+        self._count("static")
+        return StaticPage(final_url, response.status, text)
+
+    def _fall_back(self, url, reason):
+        logger.info(f"Loading {url} in the browser: {reason}.")
+        self._count("browser")
+        return None
+
+    def _count(self, outcome):
+        self.metrics.counter(
+            "browserpilot_static_fetches_total",
+            "Pages fetched over plain HTTP, by whether the browser was needed.",
+        ).inc(outcome=outcome)
+
+    def _user_agent(self):
+        if self.user_agent is None:
+            self.user_agent = self.driver.execute_script("return navigator.userAgent;")
+        return self.user_agent
+
+    def _cookie_header(self, url):
+        hostname = urlsplit(url).hostname or ""
+        cookies = dict(self.cookies.get(hostname, {}))
+        try:
+            if hasattr(self.driver, "execute_cdp_cmd"):
+                result = self.driver.execute_cdp_cmd("Network.getCookies", {"urls": [url]})
+                browser_cookies = result.get("cookies", [])
+            else:
+                # Only has the cookies of the page the browser is on.
+                browser_cookies = [
+                    c
+                    for c in self.driver.get_cookies()
+                    if hostname.endswith(c.get("domain", "").lstrip("."))
+                ]
+        except WebDriverException as exc:
+            logger.debug(f"Could not read the browser's cookies: {exc}")
+            browser_cookies = []
+        for c in browser_cookies:
+            cookies[c["name"]] = c["value"]
+        return "; ".join(f"{name}={value}" for name, value in cookies.items())
+
+    def _store_cookies(self, url, set_cookie_headers):
+        hostname = urlsplit(url).hostname or ""
+        for header in set_cookie_headers:
+            try:
+                parsed = SimpleCookie(header)
+            except CookieError:
+                continue
+            for name, morsel in parsed.items():
+                if self._set_browser_cookie(url, name, morsel):
+                    continue
+                self.cookies.setdefault(hostname, {})[name] = morsel.value
+
+    def _set_browser_cookie(self, url, name, morsel):
+        """Copy a cookie into the browser. Returns whether it worked."""
+        if not hasattr(self.driver, "execute_cdp_cmd"):
+            return False
+        cookie = {"name": name, "value": morsel.value, "url": url}
+        if morsel["domain"]:
+            cookie["domain"] = morsel["domain"]
+        if morsel["path"]:
+            cookie["path"] = morsel["path"]
+        cookie["secure"] = bool(morsel["secure"])
+        cookie["httpOnly"] = bool(morsel["httponly"])
+        try:
+            self.driver.execute_cdp_cmd("Network.setCookie", cookie)
+        except WebDriverException as exc:
+            logger.debug(f"Could not copy cookie {name} to the browser: {exc}")
+            return False
+        return True
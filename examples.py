@@ -1,5 +1,10 @@
+import json
+import urllib.request
+
 import click
+import yaml
 
+from browserpilot.agents.compilers.batch_compiler import OUTPUT_FORMATS, compile_files
 from browserpilot.agents.gpt_selenium_agent import GPTSeleniumAgent
 # from browserpilot.agents.goal_agent import GoalAgent
 
@@ -17,7 +22,8 @@ def cli():
 @click.option("--memory_folder", default=None, help="Memory folder.")
 @click.option("--debug", is_flag=True, help="Enable debugging.")
 @click.option("--output", default=None, help="Instruction output file.")
-def selenium(instructions, chromedriver_path, model, memory_folder, debug, output):
+@click.option("--metrics_output", default=None, help="Metrics file (.json or .prom).")
+def selenium(instructions, chromedriver_path, model, memory_folder, debug, output, metrics_output):
     with open(instructions, "r") as instructions:
         agent = GPTSeleniumAgent(
             instructions,
@@ -27,9 +33,112 @@ def selenium(instructions, chromedriver_path, model, memory_folder, debug, outpu
             memory_folder=memory_folder,
             debug=debug,
             retry=True,
+            metrics_output_file=metrics_output,
         )
         agent.run()
 
+
+@cli.command()
+@click.option("--chromedriver_path", default="./chromedriver", help="chromedriver path")
+@click.option("--model", default="gpt-4o-mini", help="which model?")
+@click.option("--browsers", default=2, help="Number of warm browsers.")
+@click.option("--port", default=8765, help="Port to serve the job API on.")
+@click.option("--socket", "socket_path", default=None, help="Serve on a Unix socket instead.")
+@click.option("--headless", is_flag=True, help="Run the browsers headless.")
+@click.option("--jobs_dir", default="daemon_jobs", help="Folder for the jobs' output files.")
+@click.option("--token", envvar="BROWSERPILOT_DAEMON_TOKEN", help="Token to submit jobs.")
+def daemon(chromedriver_path, model, browsers, port, socket_path, headless, jobs_dir, token):
+    from browserpilot.agents.daemon import AgentDaemon
+
+    agent_daemon = AgentDaemon(
+        browsers=browsers,
+        jobs_dir=jobs_dir,
+        token=token,
+        chromedriver_path=chromedriver_path,
+        model_for_instructions=model,
+        headless=headless,
+        retry=True,
+    )
+    agent_daemon.start()
+    agent_daemon.serve(port=port, socket_path=socket_path)
+
+
+@cli.command()
+@click.argument("instructions")
+@click.option("--url", default="http://127.0.0.1:8765", help="Daemon URL.")
+@click.option("--output", default=None, help="Output file, in the daemon's jobs_dir.")
+@click.option("--token", envvar="BROWSERPILOT_DAEMON_TOKEN", help="The daemon's token.")
+def submit(instructions, url, output, token):
+    """Submit a job to a running daemon and stream its status."""
+    with open(instructions, "r") as f:
+        instructions = f.read()
+    loaded = yaml.safe_load(instructions)
+    if isinstance(loaded, dict):  # E.g. with compiled instructions.
+        instructions = loaded
+    body = json.dumps({"instructions": instructions, "output_file": output})
+    headers = {"Content-Type": "application/json"}
+    if token:
+        headers["Authorization"] = f"Bearer {token}"
+    request = urllib.request.Request(f"{url}/jobs", data=body.encode("utf-8"), headers=headers)
+    with urllib.request.urlopen(request) as resp:
+        job = json.loads(resp.read())
+    with urllib.request.urlopen(f"{url}/jobs/{job['id']}/events") as resp:
+        for line in resp:
+            click.echo(line.decode("utf-8").rstrip())
+
+
+@cli.command(name="compile")
+@click.argument("instructions", nargs=-1, required=True)
+@click.option("--model", default="gpt-4o-mini", help="which model?")
+@click.option("--output_dir", default=None, help="Folder for the compiled files.")
+@click.option("--format", "output_format", default="yaml", type=click.Choice(OUTPUT_FORMATS))
+@click.option("--workers", default=8, help="Blocks to compile at once.")
+@click.option("--cache", "cache_file", default=None, help="Completion cache file (.json).")
+@click.option("--force", is_flag=True, help="Recompile files that are already compiled.")
+@click.option("--report", default=None, help="Write the per-block report to this JSON file.")
+def compile_instructions(
+    instructions, model, output_dir, output_format, workers, cache_file, force, report
+):
+    """Compile instruction files without running them (no browser)."""
+    reports = compile_files(
+        instructions,
+        output_dir=output_dir,
+        output_format=output_format,
+        model=model,
+        max_workers=workers,
+        cache_file=cache_file,
+        force=force,
+    )
+    click.echo(f"{'file':<50}{'block':>6}{'model':>16}{'seconds':>9}{'tokens':>8}")
+    for r in reports:
+        model_name = "error" if r["error"] else "cache" if r["cached"] else r["model"]
+        tokens = r["prompt_tokens"] + r["completion_tokens"]
+        click.echo(
+            f"{r['file'][-50:]:<50}{r['block']:>6}{model_name:>16}{r['seconds']:>9.2f}{tokens:>8}"
+        )
+    click.echo(
+        f"{len(reports)} blocks, {sum(r['requests'] for r in reports)} requests, "
+        f"{sum(r['prompt_tokens'] + r['completion_tokens'] for r in reports)} tokens."
+    )
+    if report:
+        with open(report, "w") as f:
+            json.dump(reports, f, indent=2)
+    failed = [r for r in reports if r["error"]]
+    for r in failed:
+        click.echo(f"{r['file']} block {r['block']} failed: {r['error']}", err=True)
+    if failed:
+        raise SystemExit(1)
+
+
+@cli.command()
+@click.option("--url", default="http://127.0.0.1:8765", help="Daemon URL.")
+@click.option("--json", "as_json", is_flag=True, help="Print JSON instead.")
+def metrics(url, as_json):
+    """Print the metrics of a running daemon, in the Prometheus text format."""
+    query = "?format=json" if as_json else ""
+    with urllib.request.urlopen(f"{url}/metrics{query}") as resp:
+        click.echo(resp.read().decode("utf-8"), nl=False)
+
 """🤫
 @cli.command()
 @click.option("--instructions", default=None, help="Instructions file.")
@@ -0,0 +1,113 @@
+import pytest
+from selenium import webdriver
+
+from browserpilot.agents import gpt_selenium_agent
+from browserpilot.agents.flight_recorder import RECORDER_SCRIPT
+from browserpilot.agents.gpt_selenium_agent import (
+    IS_LOADED_SCRIPT,
+    NAVIGATE_SCRIPT,
+    GPTSeleniumAgent,
+)
+
+
+class FakeElement:
+    def __init__(self, text):
+        self.text = text
+
+
+class FakeSwitchTo:
+    def __init__(self, driver):
+        self.driver = driver
+
+    def window(self, handle):
+        assert handle in self.driver.urls, f"No such window: {handle}"
+        self.driver.current_window_handle = handle
+
+    def new_window(self, type_hint=None):
+        handle = f"tab-{len(self.driver.urls)}"
+        self.driver.urls[handle] = "about:blank"
+        self.driver.current_window_handle = handle
+
+    def frame(self, frame):
+        pass
+
+    def default_content(self):
+        pass
+
+
+class FakeDriver:
+    """Just enough of a Chrome WebDriver for the agent: tabs with a URL each,
+    and a body whose text is the URL. No CDP, like Selenium Grid."""
+
+    _is_remote = False
+    session_id = "fake-session"
+
+    def __init__(self, *args, **kwargs):
+        self.urls = {"main": "about:blank"}
+        self.current_window_handle = "main"
+        self.switch_to = FakeSwitchTo(self)
+        self.commands = []
+        self.scripts = []
+        self.errors = {}  # Command => exception to raise.
+        self.script_results = {}  # Script => what it returns.
+
+    def execute(self, driver_command, params=None):
+        self.commands.append(driver_command)
+        if driver_command in self.errors:
+            raise self.errors[driver_command]
+        return {"value": None}
+
+    @property
+    def window_handles(self):
+        return list(self.urls)
+
+    @property
+    def current_url(self):
+        return self.urls[self.current_window_handle]
+
+    def get(self, url):
+        self.execute("get", {"url": url})
+        self.urls[self.current_window_handle] = url
+
+    def execute_script(self, script, *args):
+        self.execute("executeScript", {"script": script})
+        self.scripts.append(script)
+        if script == NAVIGATE_SCRIPT:
+            self.urls[self.current_window_handle] = args[0]
+        elif script == IS_LOADED_SCRIPT:
+            return True
+        elif script == RECORDER_SCRIPT:
+            return {"url": self.current_url, "navigated": False, "mutations": [], "dropped": 0}
+        return self.script_results.get(script)
+
+    def find_element(self, by=None, value=None):
+        self.execute("findElement", {"using": by, "value": value})
+        return FakeElement(f"Text of {self.current_url}")
+
+    def find_elements(self, by=None, value=None):
+        self.execute("findElements", {"using": by, "value": value})
+        return []
+
+    def quit(self):
+        pass
+
+
+@pytest.fixture
+def make_agent(monkeypatch, tmp_path):
+    """Returns a function that creates a GPTSeleniumAgent on a FakeDriver."""
+    monkeypatch.setattr(webdriver, "Chrome", FakeDriver)
+    monkeypatch.setattr(gpt_selenium_agent, "Service", lambda path: None)
+
+    def make(compiled=None, **kwargs):
+        instructions = {"instructions": ["Test."]}
+        if compiled is not None:
+            instructions["compiled"] = compiled.split("\n")
+        kwargs.setdefault("flight_recorder_folder", str(tmp_path))
+        return GPTSeleniumAgent(
+            instructions=instructions,
+            chromedriver_path="chromedriver",
+            user_data_dir=str(tmp_path / "user_data"),
+            **kwargs,
+        )
+
+    return make
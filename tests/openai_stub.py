@@ -0,0 +1,79 @@
+"""A local OpenAI-compatible server with a latency profile per model, for
+testing model routing without the API."""
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class OpenAIStub:
+    """Answers `/v1/chat/completions` and `/v1/completions`.
+
+    `latencies` maps a model to the seconds it takes to answer, and
+    `responder(model, prompt)` returns the completion text. Every request is
+    kept in `requests` as (model, prompt).
+    """
+
+    def __init__(self, latencies, responder):
+        self.latencies = latencies
+        self.responder = responder
+        self.requests = []
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+                model = body["model"]
+                if "messages" in body:
+                    prompt = body["messages"][-1]["content"]
+                else:
+                    prompt = body["prompt"]
+                stub.requests.append((model, prompt))
+                time.sleep(stub.latencies.get(model, 0.0))
+                text = stub.responder(model, prompt)
+                if self.path.endswith("/chat/completions"):
+                    choice = {
+                        "index": 0,
+                        "message": {"role": "assistant", "content": text},
+                        "finish_reason": "stop",
+                    }
+                    kind = "chat.completion"
+                else:
+                    choice = {"index": 0, "text": text, "finish_reason": "stop"}
+                    kind = "text_completion"
+                payload = json.dumps(
+                    {
+                        "id": f"stub-{len(stub.requests)}",
+                        "object": kind,
+                        "created": int(time.time()),
+                        "model": model,
+                        "choices": [choice],
+                        "usage": {
+                            "prompt_tokens": len(prompt) // 4,
+                            "completion_tokens": len(text) // 4,
+                            "total_tokens": (len(prompt) + len(text)) // 4,
+                        },
+                    }
+                ).encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self.server.server_port}/v1"
+
+    def models(self):
+        return [model for model, _ in self.requests]
+
+    def __enter__(self):
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *exc):
+        self.server.shutdown()
+        self.server.server_close()
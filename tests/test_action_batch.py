@@ -0,0 +1,90 @@
+import pytest
+from selenium.common.exceptions import WebDriverException
+from selenium.webdriver.remote.command import Command
+from selenium.webdriver.remote.webelement import WebElement
+
+from browserpilot.agents.action_batch import TYPABLE_SCRIPT, ActionBatch
+from conftest import FakeDriver
+
+
+def test_file_inputs_are_typed_into_directly():
+    driver = FakeDriver()
+    driver.script_results[TYPABLE_SCRIPT] = [True, False, True]
+    name, upload, comment = [WebElement(driver, id_) for id_ in ["1", "2", "3"]]
+    batch = ActionBatch(driver)
+    batch.add("send_keys", name, "Ada")
+    batch.add("click", name)
+    batch.add("send_keys", upload, "/tmp/cv.pdf")
+    batch.add("send_keys", comment, "Hi")
+
+    assert batch.flush() == 4
+    commands = [
+        command
+        for command in driver.commands
+        if command in [Command.W3C_ACTIONS, Command.SEND_KEYS_TO_ELEMENT]
+    ]
+    assert commands == [
+        Command.W3C_ACTIONS,  # Name and click.
+        Command.SEND_KEYS_TO_ELEMENT,  # The file input, on its own.
+        Command.W3C_ACTIONS,  # Comment.
+    ]
+
+
+def test_failed_batch_is_blamed_on_the_statement_that_queued_it(make_agent):
+    agent = make_agent(
+        compiled="""field = env.find_element("id", "name")
+env.click(field)
+env.wait(0)""",
+        batch_actions=True,
+        retry=True,
+    )
+    agent.page_model.find_elements = lambda by, value: [(WebElement(agent.driver, "1"), None)]
+    agent.driver.errors[Command.W3C_ACTIONS] = WebDriverException("element not interactable")
+    prompts = []
+
+    def get_completion(prompt, **kwargs):
+        prompts.append(prompt)
+        agent.driver.errors.clear()
+        return "pass"
+
+    agent.instruction_compiler.get_completion = get_completion
+    agent.run()
+
+    assert len(prompts) == 1
+    assert "Failed on line: env.click(field)" in prompts[0]
+    assert "env.wait(0)" not in prompts[0].split("Failed on line:")[1]
+
+
+def test_a_form_filled_line_by_line_is_one_request(make_agent):
+    agent = make_agent(
+        compiled="""fields = env.find_elements("css selector", "input")
+env.send_keys(fields[0], "Ada")
+env.send_keys(fields[1], "Lovelace")
+env.send_keys(fields[2], "ada@example.com")
+env.click(fields[3])""",
+        batch_actions=True,
+    )
+    agent.page_model.find_elements = lambda by, value: [
+        (WebElement(agent.driver, str(i)), None) for i in range(4)
+    ]
+    agent.driver.script_results[TYPABLE_SCRIPT] = [True, True, True]
+    agent.run()
+
+    assert agent.driver.commands.count(Command.W3C_ACTIONS) == 1
+    assert Command.SEND_KEYS_TO_ELEMENT not in agent.driver.commands
+
+
+def test_actions_of_the_failed_statement_are_dropped(make_agent):
+    agent = make_agent(
+        compiled="""field = env.find_element("id", "name")
+env.click(field)
+env.send_keys(field, "Ada") or undefined_name""",
+        batch_actions=True,
+    )
+    agent.page_model.find_elements = lambda by, value: [(WebElement(agent.driver, "1"), None)]
+
+    with pytest.raises(Exception, match="Failed to execute instruction."):
+        agent.run()
+    # The click happened; the keys will be sent when the statement is rerun.
+    assert agent.driver.commands.count(Command.W3C_ACTIONS) == 1
+    assert TYPABLE_SCRIPT not in agent.driver.scripts
@@ -0,0 +1,107 @@
+import asyncio
+import json
+
+import pytest
+
+from browserpilot.agents.async_gpt_selenium_agent import (
+    AsyncGPTSeleniumAgent,
+    AsyncLimits,
+)
+from browserpilot.agents.metrics import MetricsRegistry
+
+
+def run_async(agent):
+    async_agent = AsyncGPTSeleniumAgent(agent, AsyncLimits(webdriver_threads=2))
+    asyncio.run(async_agent.run())
+    return async_agent
+
+
+def test_functions_that_call_env_are_awaited(make_agent, tmp_path, monkeypatch):
+    output = tmp_path / "texts.json"
+    agent = make_agent(
+        compiled=f"""def visit(url):
+    def read():
+        return env.get_text_from_page()
+    env.get(url)
+    return read()
+def visit_all(urls):
+    return [visit(url) for url in urls]
+def plain(text):
+    return text.upper()
+texts = visit_all(["a.com", "b.com"])
+env.save(json.dumps([plain(text) for text in texts]), {str(output)!r})""",
+    )
+    monkeypatch.setattr("time.sleep", lambda seconds: None)
+    run_async(agent)
+
+    assert json.loads(output.read_text()) == [
+        "TEXT OF HTTP://A.COM",
+        "TEXT OF HTTP://B.COM",
+    ]
+
+
+def test_failure_resumes_from_the_failed_statement(make_agent, tmp_path, monkeypatch):
+    output = tmp_path / "output.txt"
+    agent = make_agent(
+        compiled=f"""visits = 0
+def visit(url):
+    global visits
+    visits += 1
+    env.get(url)
+visit("a.com")
+env.find_element("id", "missing")""",
+        retry=True,
+        flight_recorder_size=50,
+    )
+    agent.page_model.find_elements = lambda by, value: []
+    prompts = []
+
+    async def aget_completion(prompt, **kwargs):
+        prompts.append(prompt)
+        return f"env.save(str(visits), {str(output)!r})"
+
+    monkeypatch.setattr(agent.instruction_compiler, "aget_completion", aget_completion)
+    monkeypatch.setattr("time.sleep", lambda seconds: None)
+    run_async(agent)
+
+    assert len(prompts) == 1
+    assert "No elements found." in prompts[0]
+    assert output.read_text() == "1"  # `visit` did not run again.
+    assert list(tmp_path.glob("flight_recorder_*.json"))
+
+
+def test_failure_without_retry_raises(make_agent, monkeypatch):
+    agent = make_agent(compiled='env.find_element("id", "missing")')
+    agent.page_model.find_elements = lambda by, value: []
+
+    with pytest.raises(Exception, match="Failed to execute instruction.") as info:
+        run_async(agent)
+    assert "No elements found." in str(info.value.__cause__)
+
+
+def test_generator_expressions_that_call_env(make_agent, tmp_path, monkeypatch):
+    output = tmp_path / "output.json"
+    agent = make_agent(
+        compiled=f"""env.get("a.com")
+elements = [env.driver.find_element("tag name", "body")] * 3
+total = sum(len(env.get_text_of_element(e)) for e in elements)
+visible = any(env.get_text_of_element(e) == "" for e in elements)
+lazy = (e for e in elements)
+env.save(json.dumps([total, visible, len(list(lazy))]), {str(output)!r})""",
+    )
+    monkeypatch.setattr("time.sleep", lambda seconds: None)
+    run_async(agent)
+
+    assert json.loads(output.read_text()) == [3 * len("Text of http://a.com"), False, 3]
+
+
+def test_get_goes_through_the_agent(make_agent, monkeypatch):
+    metrics = MetricsRegistry()
+    agent = make_agent(compiled='env.get("a.com")\nenv.wait(2)', metrics=metrics)
+    monkeypatch.setattr("time.sleep", lambda seconds: None)
+    run_async(agent)
+
+    actions = metrics.counter("browserpilot_actions_total", "")
+    assert actions.value(action="get", outcome="ok") == 1
+    assert actions.value(action="wait", outcome="ok") == 1
+    assert agent.driver.current_url == "http://a.com"
@@ -0,0 +1,32 @@
+import json
+import os
+
+from browserpilot.agents.compilers import batch_compiler
+from browserpilot.agents.compilers.batch_compiler import compile_files
+
+
+def fake_get_action_output(self, instructions, block=None):
+    if "broken" in instructions:
+        raise RuntimeError("The API is down.")
+    self.api_cache[instructions] = "cached completion"
+    return {"instruction": instructions, "action_output": 'env.get("http://google.com")'}
+
+
+def test_a_failing_block_does_not_stop_the_others(tmp_path, monkeypatch):
+    monkeypatch.setattr(
+        batch_compiler._MeteredCompiler, "get_action_output", fake_get_action_output
+    )
+    paths = []
+    for name, instructions in [("good", "Go to google.com"), ("bad", "Click the broken link")]:
+        path = tmp_path / f"{name}.txt"
+        path.write_text(instructions)
+        paths.append(str(path))
+    cache_file = str(tmp_path / "cache.json")
+
+    reports = compile_files(paths, output_dir=str(tmp_path / "out"), cache_file=cache_file)
+
+    errors = {os.path.basename(r["file"]): r["error"] for r in reports}
+    assert errors == {"good.txt": None, "bad.txt": "RuntimeError: The API is down."}
+    assert os.listdir(tmp_path / "out") == ["good.yaml"]
+    with open(cache_file) as f:
+        assert list(json.load(f).values()) == ["cached completion"]
@@ -0,0 +1,187 @@
+import http.client
+import json
+import os
+import threading
+import time
+from http.server import ThreadingHTTPServer
+
+import pytest
+from selenium.common.exceptions import InvalidSessionIdException
+
+from browserpilot.agents import daemon
+from browserpilot.agents.daemon import AgentDaemon, DaemonRequestHandler, reset_browser
+from conftest import FakeDriver
+
+
+class CDPDriver(FakeDriver):
+    def __init__(self):
+        super().__init__()
+        self.history = {"main": ["about:blank"]}
+        self.cookies = []
+        self.cdp = []
+        self.closed = []
+
+    def execute_cdp_cmd(self, cmd, params):
+        self.cdp.append((cmd, params))
+        if cmd == "Page.getNavigationHistory":
+            urls = self.history.get(self.current_window_handle, [])
+            return {"entries": [{"url": url} for url in urls]}
+        if cmd == "Network.getAllCookies":
+            return {"cookies": self.cookies}
+        return {}
+
+    def close(self):
+        self.closed.append(self.current_window_handle)
+        del self.urls[self.current_window_handle]
+
+
+def test_reset_browser_clears_storage_of_every_visited_origin():
+    driver = CDPDriver()
+    driver.history["main"] += ["https://shop.example.com/cart", "https://shop.example.com/pay"]
+    driver.urls["tab-1"] = "http://localhost:8000/app"
+    driver.history["tab-1"] = ["about:blank", "http://localhost:8000/app"]
+    driver.cookies = [{"name": "sid", "domain": ".tracker.net"}]
+
+    reset_browser(driver)
+
+    cleared = [
+        params["origin"] for cmd, params in driver.cdp if cmd == "Storage.clearDataForOrigin"
+    ]
+    assert sorted(cleared) == [
+        "http://localhost:8000",
+        "http://tracker.net",
+        "https://shop.example.com",
+        "https://tracker.net",
+    ]
+    assert ("Network.clearBrowserCookies", {}) in driver.cdp
+    assert driver.closed == ["tab-1"]
+
+
+class FakeAgent:
+    def __init__(self, outcomes):
+        self.driver = CDPDriver()
+        self.outcomes = outcomes  # What each run raises, or None.
+        self.current_instruction = None
+
+    def run(self):
+        outcome = self.outcomes.pop(0)
+        if outcome is not None:
+            raise outcome
+
+
+def test_daemon_survives_a_browser_that_cannot_be_relaunched(monkeypatch):
+    monkeypatch.setattr(AgentDaemon, "_prepare", lambda self, agent, job: None)
+    monkeypatch.setattr(daemon, "EVENT_POLL_INTERVAL", 0.01)
+    launches = []
+
+    def launch(self, slot):
+        launches.append(slot)
+        if len(launches) == 1:
+            raise RuntimeError("chromedriver is gone")
+        self.agents[slot] = FakeAgent([None])
+
+    monkeypatch.setattr(AgentDaemon, "_launch", launch)
+    agent_daemon = AgentDaemon(browsers=1)
+    agent_daemon.agents[0] = FakeAgent([InvalidSessionIdException("invalid session id")])
+    # Like `start`, without launching the browsers.
+    worker = threading.Thread(target=agent_daemon._work, args=(0,), daemon=True)
+    worker.start()
+    agent_daemon._workers.append(worker)
+
+    died = agent_daemon.submit("Go to google.com")
+    recovered = agent_daemon.submit("Go to google.com")
+    agent_daemon.shutdown()
+
+    assert died.status == "failed"
+    assert "invalid session id" in died.error
+    assert recovered.status == "done"
+    assert launches == [0, 0]
+    assert not worker.is_alive()
+
+
+def test_prepare_forgets_the_last_job(make_agent):
+    agent = make_agent()
+    agent.current_instruction = "A block of the last job."
+    agent.current_action = "env.wait(1)"
+    job = daemon.DaemonJob("1", "Go to google.com")
+
+    AgentDaemon()._prepare(agent, job)
+
+    assert agent.current_instruction is None
+    assert agent.current_action is None
+
+
+@pytest.fixture
+def serve():
+    servers = []
+
+    def serve(agent_daemon):
+        server = ThreadingHTTPServer(("127.0.0.1", 0), DaemonRequestHandler)
+        server.agent_daemon = agent_daemon
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        servers.append(server)
+        return server.server_port
+
+    yield serve
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
+
+def post_job(port, body, **headers):
+    connection = http.client.HTTPConnection("127.0.0.1", port)
+    connection.request("POST", "/jobs", body=json.dumps(body), headers=headers)
+    response = connection.getresponse()
+    status, data = response.status, json.loads(response.read())
+    connection.close()
+    return status, data
+
+
+def test_only_local_json_requests_with_the_token_can_submit_jobs(serve, tmp_path):
+    agent_daemon = AgentDaemon(jobs_dir=str(tmp_path), token="secret")
+    port = serve(agent_daemon)
+    body = {"instructions": "Go to google.com"}
+    auth = {"Authorization": "Bearer secret"}
+    as_json = {"Content-Type": "application/json"}
+
+    # What a form on another site can send.
+    assert post_job(port, body, **{"Content-Type": "text/plain"}, **auth)[0] == 415
+    assert post_job(port, body, Origin="https://evil.example", **as_json, **auth)[0] == 403
+    assert post_job(port, body, **as_json)[0] == 401
+    assert post_job(port, body, **as_json, Authorization="Bearer wrong")[0] == 401
+    assert agent_daemon.jobs == {}
+
+    status, job = post_job(port, body, Origin="http://localhost:3000", **as_json, **auth)
+    assert status == 202
+    assert list(agent_daemon.jobs) == [job["id"]]
+
+
+def test_output_files_stay_in_the_jobs_folder(serve, tmp_path):
+    jobs_dir = tmp_path / "jobs"
+    agent_daemon = AgentDaemon(jobs_dir=str(jobs_dir))
+    port = serve(agent_daemon)
+    headers = {"Content-Type": "application/json"}
+    for output_file in ["../outside.yaml", str(tmp_path / "outside.yaml"), "."]:
+        body = {"instructions": "Go to google.com", "output_file": output_file}
+        assert post_job(port, body, **headers)[0] == 400
+
+    body = {"instructions": "Go to google.com", "output_file": "out/job.yaml"}
+    status, job = post_job(port, body, **headers)
+    assert status == 202
+    output_file = agent_daemon.jobs[job["id"]].output_file
+    assert output_file == os.path.realpath(jobs_dir / "out" / "job.yaml")
+    assert os.path.isdir(jobs_dir / "out")
+
+
+def test_finished_jobs_are_forgotten():
+    agent_daemon = AgentDaemon(job_ttl=60, max_jobs=2)
+    now = time.time()
+    jobs = [agent_daemon.submit("Go to google.com") for _ in range(3)]
+    for job, finished in zip(jobs[:2], [now - 120, now - 30]):
+        job.started = finished - 1
+        job.finish("done")
+        job.finished = finished
+
+    # The expired job goes, then the oldest finished one, to make room.
+    agent_daemon.submit("Go to google.com")
+    assert list(agent_daemon.jobs) == ["2", "3"]
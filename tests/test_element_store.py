@@ -0,0 +1,72 @@
+from browserpilot.agents.element_store import ElementStore, estimate_tokens
+
+
+class FakeNode:
+    def __init__(self, node_id, text):
+        self.node_id = node_id
+        self.text = text
+
+
+class FakeIndex:
+    def __init__(self):
+        self.node_ids = set()
+
+    def insert_nodes(self, nodes):
+        self.node_ids.update(node.node_id for node in nodes)
+
+    def delete_nodes(self, node_ids, delete_from_docstore=False):
+        self.node_ids.difference_update(node_ids)
+
+
+def make_store(max_page_tokens):
+    store = ElementStore(max_page_tokens=max_page_tokens)
+    store._index = FakeIndex()
+    return store
+
+
+def test_elements_over_budget_are_added_once_there_is_room():
+    text = "x" * 40  # 10 tokens.
+    store = make_store(max_page_tokens=3 * estimate_tokens(text))
+    nodes = [FakeNode(f"top:{i}", text) for i in range(5)]
+
+    store._insert(store._within_budget(nodes), "element_store")
+    assert sorted(store.index.node_ids) == ["top:0", "top:1", "top:2"]
+    assert sorted(store.pending) == ["top:3", "top:4"]
+
+    # Nothing changed, so there is still no room.
+    store._insert(store._within_budget([]), "element_store")
+    assert sorted(store.pending) == ["top:3", "top:4"]
+
+    store._remove("top", ["0", "4"])  # "4" was never added, but is gone too.
+    store._insert(store._within_budget([]), "element_store")
+    assert sorted(store.index.node_ids) == ["top:1", "top:2", "top:3"]
+    assert store.pending == {}
+    assert store.tokens == 3 * estimate_tokens(text)
+
+
+def test_dropping_a_frame_forgets_its_pending_elements():
+    store = make_store(max_page_tokens=1)
+    store._insert(store._within_budget([FakeNode("frame:1", "long text")]), "element_store")
+    assert list(store.pending) == ["frame:1"]
+
+    store._drop_frame("frame")
+    assert store.pending == {}
+
+
+class SnapshotDriver:
+    def __init__(self, snapshot):
+        self.snapshot = snapshot
+
+    def execute_script(self, script, *args):
+        return self.snapshot
+
+
+def test_removed_elements_are_dropped_from_pending_too():
+    store = make_store(max_page_tokens=1)
+    store._insert(store._within_budget([FakeNode("top:4", "long text")]), "element_store")
+    assert list(store.pending) == ["top:4"]
+
+    snapshot = {"full": False, "removed": ["4"], "subtrees": [], "shallow": []}
+    store._sync_frame(SnapshotDriver(snapshot), "top", None)
+    assert store.pending == {}
+    assert store.index.node_ids == set()
@@ -0,0 +1,20 @@
+import json
+
+from browserpilot.agents.flight_recorder import FlightRecorder
+from conftest import FakeDriver
+
+
+def test_dumps_in_the_same_second_get_their_own_file(tmp_path):
+    recorder = FlightRecorder()
+    assert recorder.dump_filename(tmp_path) != recorder.dump_filename(tmp_path)
+
+
+def test_page_mutations_are_drained_when_dumping():
+    driver = FakeDriver()
+    recorder = FlightRecorder()
+    assert recorder.watch(driver) == "about:blank"
+    recorder.record("click", [], 0.01)
+
+    dump = json.loads(recorder.to_json(page_dom_diff=recorder.drain_page(driver)))
+    assert dump["page_dom_diff"] == {"navigated": False, "mutations": [], "dropped": 0}
+    assert [entry["action"] for entry in dump["entries"]] == ["click"]
@@ -0,0 +1,62 @@
+import pytest
+from selenium.common.exceptions import InvalidSessionIdException, WebDriverException
+
+from browserpilot.agents import grid_scheduler
+from browserpilot.agents.grid_scheduler import GridScheduler, is_dead_session
+
+
+def wrapped(exc):
+    """Raise `exc` the way the agent reports a failed instruction."""
+    try:
+        try:
+            raise exc
+        except Exception as inner:
+            raise Exception("Failed to execute instruction.") from inner
+    except Exception as outer:
+        return outer
+
+
+def test_is_dead_session_looks_through_wrapping():
+    assert is_dead_session(wrapped(WebDriverException("invalid session id")))
+    assert is_dead_session(wrapped(InvalidSessionIdException()))
+    assert not is_dead_session(wrapped(WebDriverException("element not interactable")))
+    assert not is_dead_session(wrapped(ValueError("invalid session id")))
+
+
+def test_agent_with_retry_raises_when_the_session_dies(make_agent):
+    agent = make_agent(compiled='env.find_element("id", "name")', retry=True)
+
+    def find_elements(by, value):
+        raise InvalidSessionIdException("invalid session id")
+
+    agent.page_model.find_elements = find_elements
+    with pytest.raises(Exception) as info:
+        agent.run()
+    assert is_dead_session(info.value)
+
+
+def test_job_is_requeued_when_a_wrapped_session_error_kills_it(monkeypatch):
+    monkeypatch.setattr(grid_scheduler, "check_health", lambda url: True)
+    runs = []
+
+    class FakeAgent:
+        def __init__(self, instructions, remote_url=None, **kwargs):
+            self.driver = self
+
+        def run(self):
+            runs.append(1)
+            if len(runs) == 1:
+                raise wrapped(WebDriverException("chrome not reachable"))
+
+        def quit(self):
+            pass
+
+    scheduler = GridScheduler(["http://node"], agent_factory=FakeAgent)
+    scheduler.start()
+    job = scheduler.submit("Go to google.com")
+    assert job.wait(5)
+    scheduler.shutdown()
+
+    assert job.status == "done"
+    assert job.attempts == 2
+    assert scheduler.stats()["nodes"]["http://node"]["requeued"] == 1
@@ -0,0 +1,40 @@
+import json
+import os
+import subprocess
+import sys
+
+# Loose enough for a busy CI machine; `benchmarks/import_time.py` shows
+# where the time goes. It takes about 160 ms on a laptop.
+IMPORT_BUDGET_SECONDS = 1.5
+# Only imported when memory, retrieval, element search or the LLM is used.
+DEFERRED_MODULES = ["openai", "llama_index", "langchain", "langchain_openai", "bs4"]
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+IMPORT_SCRIPT = """
+import json, sys, time
+start = time.perf_counter()
+import browserpilot.agents.gpt_selenium_agent
+seconds = time.perf_counter() - start
+print(json.dumps({"seconds": seconds, "modules": sorted(sys.modules)}))
+"""
+
+
+def import_agent():
+    """Import the agent in a fresh interpreter, the best of three runs."""
+    runs = []
+    for _ in range(3):
+        result = subprocess.run(
+            [sys.executable, "-c", IMPORT_SCRIPT],
+            cwd=REPO_ROOT,
+            capture_output=True,
+            text=True,
+            check=True,
+        )
+        runs.append(json.loads(result.stdout))
+    return min(runs, key=lambda run: run["seconds"])
+
+
+def test_importing_the_agent_is_fast_and_defers_heavy_dependencies():
+    imported = import_agent()
+    eager = [name for name in DEFERRED_MODULES if name in imported["modules"]]
+    assert eager == []
+    assert imported["seconds"] < IMPORT_BUDGET_SECONDS
@@ -0,0 +1,82 @@
+import asyncio
+import json
+
+from selenium.webdriver.remote.webelement import WebElement
+
+from browserpilot.agents.async_gpt_selenium_agent import (
+    AsyncGPTSeleniumAgent,
+    AsyncLimits,
+)
+from browserpilot.agents.metrics import MetricsRegistry
+
+
+def test_every_round_trip_is_recorded(make_agent):
+    metrics = MetricsRegistry()
+    agent = make_agent(metrics=metrics, flight_recorder_size=50)
+    elements = [WebElement(agent.driver, str(i)) for i in range(3)]
+    rounds = [elements[:2], [], elements[2:]]
+    calls = []
+
+    def new_elements(token, by, value, limit=50):
+        calls.append(token)
+        return rounds.pop(0) if rounds else []
+
+    agent.page_model.new_elements = new_elements
+    items = agent.iter_elements("css selector", ".post", idle_timeout=0.05, poll_interval=0.01)
+
+    # Nothing happens until the first item is asked for.
+    actions = metrics.counter("browserpilot_actions_total", "")
+    assert actions.value(action="iter_elements", outcome="ok") == 0
+
+    assert [element.id for element in items] == ["0", "1", "2"]
+    assert len(calls) >= 4  # Plus rounds with nothing new, until the idle timeout.
+    assert actions.value(action="iter_elements", outcome="ok") == len(calls)
+    recorded = [entry["action"] for entry in agent.flight_recorder.entries]
+    assert recorded.count("iter_elements") == len(calls)
+
+
+def test_recording_costs_no_round_trip_by_default(make_agent, monkeypatch):
+    monkeypatch.setattr("time.sleep", lambda seconds: None)
+    agent = make_agent(batch_actions=True)
+    agent.page_model.new_elements = lambda token, by, value: []
+    assert list(agent.iter_elements("css selector", ".post", idle_timeout=0.02)) == []
+    agent.get("a.com")
+    scripts = len(agent.driver.scripts)
+    agent.click(WebElement(agent.driver, "1"))
+    agent.flush_actions()
+
+    assert len(agent.driver.scripts) == scripts  # No DOM drain per action.
+    recorded = [entry["action"] for entry in agent.flight_recorder.entries]
+    assert recorded[-2:] == ["get", "click"]
+    assert agent.flight_recorder.entries[-2]["url"] == "http://a.com"
+
+
+def test_async_iter_elements_streams_rounds(make_agent, tmp_path):
+    output = tmp_path / "ids.json"
+    agent = make_agent(
+        compiled=f"""def first_ids(n):
+    ids = []
+    for post in env.iter_elements("css selector", ".post", max_items=n, poll_interval=0):
+        ids.append(post.id)
+    return ids
+streamed = first_ids(3)
+collected = [e.id for e in list(env.iter_elements("css selector", ".post", idle_timeout=0))]
+env.save(json.dumps([streamed, collected]), {str(output)!r})""",
+    )
+    rounds = []
+
+    def new_elements(token, by, value):
+        rounds.append(token)
+        start = 2 * len([t for t in rounds if t == token]) - 2
+        if start >= 6:
+            return []
+        return [WebElement(agent.driver, str(i)) for i in range(start, start + 2)]
+
+    agent.page_model.new_elements = new_elements
+    asyncio.run(AsyncGPTSeleniumAgent(agent, AsyncLimits(webdriver_threads=1)).run())
+
+    streamed, collected = json.loads(output.read_text())
+    assert streamed == ["0", "1", "2"]
+    assert collected == ["0", "1", "2", "3", "4", "5"]
+    # Only the rounds needed for 3 items, then 3 full rounds and an empty one.
+    assert len(rounds) == 2 + 4
@@ -0,0 +1,95 @@
+import json
+
+from selenium import webdriver
+
+from browserpilot.agents.load_profiles import (
+    IMAGE_PATTERNS,
+    NetworkController,
+    configure_chrome_options,
+)
+
+
+class CDPDriver:
+    """Records CDP commands and serves a canned performance log."""
+
+    def __init__(self):
+        self.cdp_commands = []
+        self.log = []
+
+    def execute_cdp_cmd(self, cmd, params):
+        self.cdp_commands.append((cmd, params))
+        return {}
+
+    def get_log(self, log_type):
+        entries, self.log = self.log, []
+        return entries
+
+    def event(self, method, **params):
+        message = {"message": {"method": method, "params": params}}
+        self.log.append({"message": json.dumps(message)})
+
+
+def test_images_are_blocked_per_call_with_cdp():
+    options = webdriver.ChromeOptions()
+    configure_chrome_options(options, "text-only")
+    assert "prefs" not in options.experimental_options
+
+    driver = CDPDriver()
+    network = NetworkController(driver, "text-only")
+    network.apply("default")
+    blocked = [
+        params["urls"]
+        for cmd, params in driver.cdp_commands
+        if cmd == "Network.setBlockedURLs"
+    ]
+    assert set(IMAGE_PATTERNS) <= set(blocked[0])
+    assert blocked[1] == []
+
+
+def test_images_are_blocked_for_the_session_without_cdp():
+    options = webdriver.ChromeOptions()
+    configure_chrome_options(options, "text-only", cdp=False)
+    prefs = options.experimental_options["prefs"]
+    assert prefs["profile.managed_default_content_settings.images"] == 2
+
+
+def test_bytes_saved_are_estimated_from_earlier_loads():
+    driver = CDPDriver()
+    network = NetworkController(driver, "no-media")
+    for request_id, url, size in [("1", "/a.png", 1000), ("2", "/b.png", 3000)]:
+        driver.event(
+            "Network.requestWillBeSent", requestId=request_id, type="Image", request={"url": url}
+        )
+        driver.event("Network.loadingFinished", requestId=request_id, encodedDataLength=size)
+    assert network.collect()["bytes_loaded"] == 4000
+
+    for request_id, url in [("3", "/a.png"), ("4", "/c.png"), ("5", "/font.woff")]:
+        driver.event(
+            "Network.requestWillBeSent", requestId=request_id, request={"url": url}
+        )
+        driver.event(
+            "Network.loadingFailed",
+            requestId=request_id,
+            type="Font" if url.endswith("woff") else "Image",
+            blockedReason="inspector",
+        )
+    collected = network.collect()
+    assert collected["blocked_requests"] == 3
+    # The same URL's size, the mean image size, and nothing for the font.
+    assert collected["bytes_saved"] == 1000 + 2000
+    assert network.stats["bytes_saved"] == 3000
+
+
+def test_requests_are_counted_for_a_per_call_profile_on_a_default_agent():
+    options = webdriver.ChromeOptions()
+    configure_chrome_options(options, "default")
+    assert options.to_capabilities()["goog:loggingPrefs"] == {"performance": "ALL"}
+
+    driver = CDPDriver()
+    network = NetworkController(driver, "default")
+    network.apply("text-only")
+    driver.event("Network.requestWillBeSent", requestId="1", request={"url": "/a.png"})
+    driver.event("Network.loadingFailed", requestId="1", blockedReason="inspector")
+    collected = network.collect()
+    assert collected["requests"] == 1
+    assert collected["blocked_requests"] == 1
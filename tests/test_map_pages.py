@@ -0,0 +1,66 @@
+import asyncio
+import json
+
+from browserpilot.agents.async_gpt_selenium_agent import (
+    AsyncGPTSeleniumAgent,
+    AsyncLimits,
+)
+
+
+def test_map_pages_fn_can_use_env(make_agent, tmp_path):
+    output = tmp_path / "texts.json"
+    agent = make_agent(
+        compiled=f"""def read(url):
+    return env.get_text_from_page()
+texts = env.map_pages(["a.com", "b.com", "c.com"], read, max_tabs=2)
+lengths = env.map_pages(["d.com"], lambda url: len(env.get_text_from_page()))
+env.save(json.dumps([texts, lengths]), {str(output)!r})""",
+    )
+    agent.run()
+
+    texts, lengths = json.loads(output.read_text())
+    assert texts == [
+        "Text of http://a.com",
+        "Text of http://b.com",
+        "Text of http://c.com",
+    ]
+    assert lengths == [len("Text of http://d.com")]
+    assert agent.driver.current_window_handle == "main"
+
+
+def test_map_pages_gives_each_page_its_own_element_store(make_agent):
+    agent = make_agent()
+    store = agent.element_store
+
+    stores = agent.map_pages(["a.com", "b.com"], lambda url: agent.element_store)
+
+    assert stores[0] is not stores[1]
+    assert store not in stores
+    assert agent.element_store is store
+
+
+def test_async_agent_wraps_get_many(make_agent):
+    agent = AsyncGPTSeleniumAgent(make_agent(), AsyncLimits(webdriver_threads=2))
+    assert asyncio.run(agent.get_many(["a.com"])) == ["Text of http://a.com"]
+
+
+def test_async_map_pages_awaits_fn_in_each_tab(make_agent, tmp_path):
+    output = tmp_path / "texts.json"
+    agent = make_agent(
+        compiled=f"""def read(url):
+    return env.get_text_from_page()
+texts = env.map_pages(["a.com", "b.com", "c.com"], read, max_tabs=2)
+urls = env.map_pages(["d.com"], lambda url: url)
+env.save(json.dumps([texts, urls]), {str(output)!r})""",
+    )
+    # One worker thread: `read` must not wait for a thread held by map_pages.
+    asyncio.run(AsyncGPTSeleniumAgent(agent, AsyncLimits(webdriver_threads=1)).run())
+
+    texts, urls = json.loads(output.read_text())
+    assert texts == [
+        "Text of http://a.com",
+        "Text of http://b.com",
+        "Text of http://c.com",
+    ]
+    assert urls == ["http://d.com"]
+    assert agent.driver.current_window_handle == "main"
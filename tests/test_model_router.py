@@ -0,0 +1,113 @@
+import pytest
+
+from browserpilot.agents.compilers import instruction_compiler, model_router
+from browserpilot.agents.compilers.instruction_compiler import InstructionCompiler
+from browserpilot.agents.compilers.model_router import (
+    LATENCY_PROBE_INTERVAL,
+    ModelRouter,
+)
+from browserpilot.agents.metrics import MetricsRegistry
+from openai_stub import OpenAIStub
+
+openai = pytest.importorskip("openai")
+
+TIERS = [
+    {"name": "fast", "models": ["gpt-4o-mini-a", "gpt-4o-mini-b"], "max_complexity": 4},
+    {"name": "strong", "models": ["gpt-4o"], "max_complexity": None},
+]
+COMPLEX_BLOCK = "\n".join(
+    [
+        "Go to google.com",
+        "For each result, if it mentions a price, compare it with the last one",
+        "Summarize the cheapest one",
+    ]
+)
+
+
+def good_code(model, prompt):
+    return 'env.get("http://google.com")'
+
+
+@pytest.fixture
+def stub(monkeypatch, request):
+    latencies, responder = request.param
+    with OpenAIStub(latencies, responder) as stub:
+        client = openai.OpenAI(base_url=stub.url, api_key="test", max_retries=0)
+        monkeypatch.setattr(instruction_compiler, "_client", client)
+        yield stub
+
+
+def make_compiler(tiers=TIERS):
+    return InstructionCompiler(
+        instructions="Go to google.com",
+        model_router=ModelRouter(tiers),
+        metrics=MetricsRegistry(),
+    )
+
+
+@pytest.mark.parametrize(
+    "stub", [({"gpt-4o-mini-a": 0.05, "gpt-4o-mini-b": 0.0}, good_code)], indirect=True
+)
+def test_blocks_go_to_the_fastest_model_of_their_tier(stub):
+    compiler = make_compiler()
+    for i in range(4):
+        compiler.get_action_output(f"Go to example{i}.com")
+    compiler.get_action_output(COMPLEX_BLOCK)
+
+    # Both fast models are measured once, then the faster one is used.
+    assert stub.models() == [
+        "gpt-4o-mini-a",
+        "gpt-4o-mini-b",
+        "gpt-4o-mini-b",
+        "gpt-4o-mini-b",
+        "gpt-4o",
+    ]
+    report = compiler.model_router.report()
+    assert report["fast"]["calls"] == 4
+    assert report["strong"]["calls"] == 1
+
+
+def broken_on_fast_tier(model, prompt):
+    if model.startswith("gpt-4o-mini"):
+        return "env.get("  # Does not parse.
+    return good_code(model, prompt)
+
+
+@pytest.mark.parametrize("stub", [({}, broken_on_fast_tier)], indirect=True)
+def test_invalid_code_escalates_to_the_next_tier(stub):
+    compiler = make_compiler()
+    action_info = compiler.get_action_output("Go to google.com")
+
+    assert action_info["action_output"] == good_code(None, None)
+    assert stub.models() == ["gpt-4o-mini-a", "gpt-4o"]
+    report = compiler.model_router.report()
+    assert report["fast"]["escalations"] == 1
+    assert report["fast"]["escalation_rate"] == 1.0
+
+
+@pytest.mark.parametrize("stub", [({"gpt-4o-mini": 0.05}, good_code)], indirect=True)
+def test_slow_tier_is_skipped_and_probed_again(stub):
+    tiers = [
+        {"name": "fast", "models": ["gpt-4o-mini"], "max_complexity": 4, "max_latency": 0.01},
+        {"name": "strong", "models": ["gpt-4o"], "max_complexity": None},
+    ]
+    compiler = make_compiler(tiers)
+    for i in range(LATENCY_PROBE_INTERVAL + 1):
+        compiler.get_action_output(f"Go to example{i}.com")
+
+    models = stub.models()
+    assert models[0] == "gpt-4o-mini"  # Measured, and too slow.
+    assert models[1:LATENCY_PROBE_INTERVAL] == ["gpt-4o"] * (LATENCY_PROBE_INTERVAL - 1)
+    assert models[LATENCY_PROBE_INTERVAL] == "gpt-4o-mini"  # Probed again.
+    assert compiler.model_router.report()["fast"]["latency_skips"] == LATENCY_PROBE_INTERVAL
+
+
+def test_only_the_most_recent_failed_blocks_are_remembered(monkeypatch):
+    monkeypatch.setattr(model_router, "MAX_FAILED_BLOCKS", 2)
+    router = ModelRouter(TIERS)
+    for block in ["Click a", "Click b", "Click a", "Click c"]:
+        router.escalate(block)
+
+    assert list(router.failures) == ["Click a", "Click c"]
+    assert router.failures["Click a"] == 2
+    assert router.tier_index("Click b") == 0
@@ -0,0 +1,190 @@
+from selenium.webdriver.remote.command import Command
+from selenium.webdriver.remote.webelement import WebElement
+
+from browserpilot.agents.page_models import ARE_DISPLAYED_SCRIPT, CDPPageModel
+
+STRINGS = [
+    "#document", "HTML", "BODY", "DIV", "#text", "IFRAME", "SPAN", "id", "a",
+    "b", "c", "cover", "d", "same", "cross", "class", "price", "Hello",
+    "In frame", "block", "visible", "1", "auto", "inline", "frame-0", "frame-1",
+]
+
+
+def s(string):
+    return STRINGS.index(string)
+
+
+def node(parent, name, backend_id, **attributes):
+    flat = []
+    for key, value in attributes.items():
+        flat += [s(key), s(value)]
+    return parent, s(name), backend_id, flat
+
+
+def document(frame, nodes, layout, content_documents=None):
+    """`layout` is (node index, bounds, paint order, text or None, display)."""
+    content_documents = content_documents or {}
+    return {
+        "frameId": s(frame),
+        "nodes": {
+            "parentIndex": [n[0] for n in nodes],
+            "nodeName": [n[1] for n in nodes],
+            "backendNodeId": [n[2] for n in nodes],
+            "attributes": [n[3] for n in nodes],
+            "contentDocumentIndex": {
+                "index": list(content_documents),
+                "value": list(content_documents.values()),
+            },
+        },
+        "layout": {
+            "nodeIndex": [entry[0] for entry in layout],
+            "bounds": [entry[1] for entry in layout],
+            "paintOrders": [entry[2] for entry in layout],
+            "text": [-1 if entry[3] is None else s(entry[3]) for entry in layout],
+            "styles": [[s(entry[4]), s("visible"), s("1"), s("auto")] for entry in layout],
+        },
+    }
+
+
+TOP = document(
+    "frame-0",
+    [
+        node(-1, "#document", 1),
+        node(0, "HTML", 2),
+        node(1, "BODY", 3),
+        node(2, "DIV", 4, id="a"),
+        node(3, "#text", 5),
+        node(2, "DIV", 6, id="b"),  # No box: display: none.
+        node(2, "IFRAME", 7, id="same"),
+        node(2, "IFRAME", 8, id="cross"),  # Out of process.
+        node(2, "DIV", 9, id="c"),
+        node(2, "DIV", 10, id="cover"),
+        node(2, "DIV", 11, id="d"),
+    ],
+    [
+        (1, [0, 0, 800, 2000], 0, None, "block"),
+        (2, [0, 0, 800, 2000], 1, None, "block"),
+        (3, [0, 0, 100, 100], 2, None, "block"),
+        (4, [0, 0, 30, 10], 3, "Hello", "inline"),
+        (6, [0, 100, 300, 100], 4, None, "inline"),
+        (7, [300, 100, 300, 100], 5, None, "inline"),
+        (8, [0, 200, 100, 100], 6, None, "block"),
+        (9, [0, 200, 100, 100], 7, None, "block"),
+        (10, [0, 1000, 10, 10], 8, None, "block"),
+    ],
+    content_documents={6: 1},
+)
+FRAME = document(
+    "frame-1",
+    [
+        node(-1, "#document", 101),
+        node(0, "HTML", 102),
+        node(1, "BODY", 103),
+        node(2, "SPAN", 104, **{"class": "price"}),
+        node(3, "#text", 105),
+    ],
+    [
+        (1, [0, 0, 300, 100], 0, None, "block"),
+        (2, [0, 0, 300, 100], 1, None, "block"),
+        (3, [0, 0, 50, 10], 2, None, "inline"),
+        (4, [0, 0, 50, 10], 3, "In frame", "inline"),
+    ],
+)
+SNAPSHOT = {"strings": STRINGS, "documents": [TOP, FRAME]}
+VIEWPORT = {"pageX": 0, "pageY": 0, "clientWidth": 800, "clientHeight": 600}
+
+
+class Body:
+    text = "Cross-origin text"
+
+
+class SwitchTo:
+    def __init__(self, driver):
+        self.driver = driver
+
+    def frame(self, frame):
+        self.driver.execute(Command.SWITCH_TO_FRAME)
+        self.driver.frame = frame.id
+
+    def default_content(self):
+        self.driver.execute(Command.SWITCH_TO_FRAME)
+        self.driver.frame = None
+
+
+class CDPDriver:
+    """Serves SNAPSHOT, and elements by id for each frame."""
+
+    def __init__(self):
+        self.commands = []
+        self.cdp_commands = []
+        self.frame = None
+        self.switch_to = SwitchTo(self)
+        self.elements = {
+            None: {"a": [4], "b": [6], "iframe": [7, 8]},
+            "f.1.d.1.e.7": {},
+            "f.1.d.1.e.8": {"a": [4]},  # Same id as #a, in another process.
+        }
+
+    def execute(self, command, params=None):
+        self.commands.append(command)
+        return {"value": None}
+
+    def execute_cdp_cmd(self, cmd, params):
+        self.execute("executeCdpCommand")
+        self.cdp_commands.append(cmd)
+        return SNAPSHOT if cmd == "DOMSnapshot.captureSnapshot" else {"cssLayoutViewport": VIEWPORT}
+
+    def execute_script(self, script, *args):
+        self.execute(Command.W3C_EXECUTE_SCRIPT)
+        if script == ARE_DISPLAYED_SCRIPT:
+            return [True for _ in args[0]]
+        return None
+
+    def find_elements(self, by=None, value=None):
+        self.execute(Command.FIND_ELEMENTS)
+        ids = self.elements[self.frame].get(value, [])
+        return [WebElement(self, f"f.1.d.1.e.{backend_id}") for backend_id in ids]
+
+    def find_element(self, by=None, value=None):
+        self.execute(Command.FIND_ELEMENT)
+        return Body()
+
+
+def test_text_of_out_of_process_iframes_is_read_with_webdriver():
+    driver = CDPDriver()
+    text = CDPPageModel(driver).get_text()
+    assert text.split("\n") == ["Hello", "In frame", "Cross-origin text"]
+    assert driver.cdp_commands == ["DOMSnapshot.captureSnapshot"]
+
+
+def test_find_elements_uses_the_snapshot():
+    driver = CDPDriver()
+    page_model = CDPPageModel(driver)
+    found = page_model.find_elements("id", "a")
+    hidden = page_model.find_elements("id", "b")
+
+    # The same-process iframe has no #a, so only the other one is searched,
+    # and what is found there is checked with a script.
+    assert [(e.id, iframe and iframe.id) for e, iframe in found] == [
+        ("f.1.d.1.e.4", None),
+        ("f.1.d.1.e.4", "f.1.d.1.e.8"),
+    ]
+    assert hidden == []
+    assert driver.cdp_commands == ["DOMSnapshot.captureSnapshot"]
+    assert driver.commands.count(Command.W3C_EXECUTE_SCRIPT) == 1
+    assert driver.commands.count(Command.SWITCH_TO_FRAME) == 2 * 2
+
+
+def test_visibility_in_viewport_comes_from_one_snapshot():
+    driver = CDPDriver()
+    page_model = CDPPageModel(driver)
+    visible = [
+        page_model.is_visible_in_viewport(WebElement(driver, f"f.1.d.1.e.{backend_id}"))
+        for backend_id in [4, 9, 11]
+    ]
+    assert visible == [True, False, False]  # #c is covered, #d is below.
+    assert driver.cdp_commands == ["DOMSnapshot.captureSnapshot", "Page.getLayoutMetrics"]
+
+    driver.execute_script("window.scrollBy(0, 100);")  # May change the page.
+    page_model.is_visible_in_viewport(WebElement(driver, "f.1.d.1.e.4"))
+    assert driver.cdp_commands.count("DOMSnapshot.captureSnapshot") == 2
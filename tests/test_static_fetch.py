@@ -0,0 +1,60 @@
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from browserpilot.agents.static_fetch import MAX_REDIRECTS, StaticFetcher
+
+ARTICLE = (
+    "<html><body><article>" + "Server-rendered text. " * 20 + "</article></body></html>"
+).encode()
+
+
+class Handler(BaseHTTPRequestHandler):
+    """Redirects /<n> to /<n - 1>, and serves an article at /0."""
+
+    def do_GET(self):
+        hops = int(self.path.strip("/"))
+        if hops > 0:
+            self.send_response(302)
+            self.send_header("Location", f"/{hops - 1}")
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", "text/html")
+        self.send_header("Content-Length", str(len(ARTICLE)))
+        self.end_headers()
+        self.wfile.write(ARTICLE)
+
+    def log_message(self, *args):
+        pass
+
+
+class NoCDPDriver:
+    def execute_script(self, script, *args):
+        return "Mozilla/5.0"
+
+    def get_cookies(self):
+        return []
+
+
+@pytest.fixture
+def base_url():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{server.server_port}"
+    server.shutdown()
+
+
+def test_follows_more_redirects_than_retries(base_url):
+    fetcher = StaticFetcher(NoCDPDriver())
+    page = fetcher.fetch(f"{base_url}/{MAX_REDIRECTS}")
+    assert page is not None
+    assert page.url.endswith("/0")
+    assert "Server-rendered text." in page.text
+
+
+def test_too_many_redirects_fall_back_to_the_browser(base_url):
+    fetcher = StaticFetcher(NoCDPDriver())
+    assert fetcher.fetch(f"{base_url}/{MAX_REDIRECTS + 1}") is None
@@ -0,0 +1,35 @@
+import numpy as np
+import pytest
+
+# The memories package imports llama_index, though VectorSearch only needs NumPy.
+pytest.importorskip("llama_index")
+from browserpilot.agents.memories.vector_search import VectorSearch  # noqa: E402
+
+
+def test_top_k_is_ordered_by_cosine_similarity():
+    search = VectorSearch()
+    search.add(["x", "diagonal", "y"], [[2, 0], [1, 1], [0, 3]])
+    search.add(["near-x"], [[4, 1]])
+
+    hits = search.top_k([1, 0], k=3)
+    assert [node_id for node_id, _ in hits] == ["x", "near-x", "diagonal"]
+    assert hits[0][1] == pytest.approx(1.0)
+    assert hits[2][1] == pytest.approx(np.sqrt(0.5))
+    assert len(search.top_k([1, 0], k=10)) == 4
+
+
+def test_removed_rows_are_never_returned(tmp_path):
+    search = VectorSearch()
+    search.add([f"node-{i}" for i in range(100)], np.eye(100))
+    search.remove(["node-3", "node-50", "unknown"])
+
+    assert len(search) == 98
+    assert search.top_k(np.eye(100)[3], k=1)[0][1] == pytest.approx(0.0)
+    assert search.top_k(np.eye(100)[51], k=1) == [("node-51", pytest.approx(1.0))]
+
+    search.save(tmp_path)
+    loaded = VectorSearch.load(tmp_path, mmap=True)
+    loaded.remove(["node-51"])
+    loaded.add(["node-3"], [np.eye(100)[3]])
+    assert loaded.top_k(np.eye(100)[3], k=1) == [("node-3", pytest.approx(1.0))]
+    assert "node-51" not in [node_id for node_id, _ in loaded.top_k(np.eye(100)[51], k=98)]